@@ -0,0 +1,73 @@
+import os
+import py_compile
+import tempfile
+
+import agent_worker
+import latency
+
+# Submitted code is checked before it replaces an agent file: it has to
+# compile, import cleanly in a sandboxed worker and play a short series
+# against reference_opponent without raising, crashing, hanging or going over
+# the move budget. The series runs in a scratch directory, so the live file
+# of an agent being edited is not touched until the new code has passed.
+REFERENCE_OPPONENT = 'reference_opponent'
+SMOKE_MATCHES = 5
+SMOKE_ROUNDS = 20
+SMOKE_TIMEOUT = 5.0
+SMOKE_MEMORY_MB = 512
+SMOKE_CPU_SECONDS = 30  # per series, so a rejected agent can't outlive its check
+
+class AgentValidationError(Exception):
+    pass
+
+def check_syntax(code, filename):
+    try:
+        compile(code, filename, 'exec')
+    except (SyntaxError, ValueError) as exc:
+        raise AgentValidationError(f"Code does not compile: {exc}") from None
+
+# Plays the smoke series and returns the agent's latency.AgentTimings.
+# move_budget is in seconds and applies as in a tournament: a slower move
+# forfeits, and here rejects the agent. Matches are capped at SMOKE_ROUNDS
+# rounds so a slow agent that never loses can't hold up a submit for long.
+def smoke_test(module_name, code, move_budget=None, num_matches=SMOKE_MATCHES, timeout=SMOKE_TIMEOUT,
+               memory_mb=SMOKE_MEMORY_MB, cpu_seconds=SMOKE_CPU_SECONDS):
+    timings = (latency.AgentTimings(), latency.AgentTimings())
+    with tempfile.TemporaryDirectory() as directory:
+        with open(os.path.join(directory, f"{module_name}.py"), 'w') as f:
+            f.write(code)
+        with agent_worker.AgentWorkerPool(memory_mb, cpu_seconds, timeout=timeout, cwd=directory) as pool:
+            try:
+                agent = agent_worker.SandboxedAgent(pool, module_name)
+                opponent = agent_worker.SandboxedAgent(pool, REFERENCE_OPPONENT)
+            except agent_worker.AgentRaised as exc:
+                raise AgentValidationError(str(exc)) from None
+            except agent_worker.AgentCrashed:
+                raise AgentValidationError("Import crashed or did not finish in time") from None
+            try:
+                agent_worker.play_series(agent, opponent, num_matches, timings, move_budget, SMOKE_ROUNDS)
+            except agent_worker.AgentRaised as exc:
+                raise AgentValidationError(f"Agent raised during the smoke match: {exc}") from None
+            except agent_worker.AgentCrashed as exc:
+                raise AgentValidationError(f"Agent crashed during the smoke match: {exc}") from None
+    agent_timings = timings[0]
+    if agent_timings.forfeits:
+        if move_budget is None:
+            raise AgentValidationError("Agent crashed or hung during the smoke match")
+        raise AgentValidationError(f"Agent crashed, hung or went over the {move_budget * 1000:.0f} ms move budget "
+                                   f"during the smoke match")
+    return agent_timings
+
+def validate_agent(module_name, code, move_budget=None, num_matches=SMOKE_MATCHES):
+    check_syntax(code, f"{module_name}.py")
+    return smoke_test(module_name, code, move_budget, num_matches)
+
+# Writes the agent's bytecode to __pycache__ next to it, checked against a
+# hash of the source rather than its mtime: an edit saved within the same
+# second as the previous version can't leave stale bytecode behind. Workers
+# and pool processes then import the agent without compiling it again.
+def precompile(path):
+    try:
+        py_compile.compile(path, doraise=True, invalidation_mode=py_compile.PycInvalidationMode.CHECKED_HASH)
+    except py_compile.PyCompileError as exc:
+        raise AgentValidationError(f"Code does not compile: {exc.msg}") from None
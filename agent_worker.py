@@ -0,0 +1,625 @@
+import importlib
+import json
+import os
+import random
+import select
+import signal
+import struct
+import subprocess
+import sys
+import threading
+import time
+
+import latency
+import profiling
+import rules
+from match_archive import DRAW
+from rules import MOVES
+
+# Each agent module can be hosted in its own long-lived subprocess so a hung,
+# crashing or memory-hungry agent can't take the tournament down with it.
+# The worker keeps one agent instance per concurrent game ("slot") and speaks
+# a small binary protocol over its stdin/stdout pipes:
+#
+#   request   op (B), count (I), then count items
+#     PLAY    slot (I), opponent's last move code (B, NO_MOVE for None)
+#     RESET   slot (I)  -- create or reset the slot's agent (latency.reset_method)
+#     SEED    one seed (Q) for the worker's random and numpy.random
+#     QUIT    no items
+#   response  op (B), count (I), then count items
+#     PLAY    move code (B, rules.INVALID if not a move, HUNG if play() ran
+#             past the move timeout), play() wall time and CPU time in ns
+#             (QQ); the move budget is charged in CPU time, so a worker that
+#             is descheduled on a busy host does not forfeit
+#     RESET   __init__() time in ns (Q), HUNG_NS if it ran past the timeout
+#     SEED    CPU time the worker has used so far in ns (Q)
+#     HELLO   / ERROR: count bytes of UTF-8 JSON / message
+#
+# One PLAY frame carries every active game of a series, so isolation costs
+# one round-trip per round of the series rather than one per move.
+#
+# The worker itself interrupts a play() or reset that runs longer than its
+# move timeout (with SIGALRM, where there is one) and drops that slot's agent,
+# so a hung move forfeits only its own game and the worker carries on. Only a
+# worker that dies or stops answering altogether loses every game it hosts:
+# their agent instances die with it.
+OP_PLAY, OP_RESET, OP_QUIT, OP_HELLO, OP_ERROR, OP_SEED = range(6)
+NO_MOVE = 255
+HUNG = 254
+HUNG_NS = 2 ** 64 - 1
+
+FRAME = struct.Struct('<BI')
+PLAY_REQUEST = struct.Struct('<IB')
+PLAY_RESPONSE = struct.Struct('<BQQ')
+SLOT = struct.Struct('<I')
+DURATION = struct.Struct('<Q')
+SEED = struct.Struct('<Q')
+
+DEFAULT_MEMORY_MB = 1024
+# Seconds a single play() or reset may run before it counts as hung.
+DEFAULT_TIMEOUT = 10.0
+# Games of one series played side by side, i.e. agent instances per worker.
+MAX_CONCURRENT_GAMES = 100
+# Crashes or hangs tolerated per agent per series before the series fails.
+MAX_RESTARTS = 3
+
+class AgentWorkerError(Exception):
+    pass
+
+# The agent itself raised: treated like any other agent exception and fails
+# the series, same as in-process play.
+class AgentRaised(AgentWorkerError):
+    pass
+
+# The worker died, hung past its deadline or sent garbage; the agent forfeits
+# the games in progress and the worker is replaced.
+class AgentCrashed(AgentWorkerError):
+    pass
+
+def _apply_limits(memory_mb, cpu_seconds):
+    try:
+        import resource
+    except ImportError:  # not available on Windows
+        return
+    if memory_mb:
+        limit = memory_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    if cpu_seconds:
+        resource.setrlimit(resource.RLIMIT_CPU, (cpu_seconds, cpu_seconds + 1))
+
+class _MoveTimedOut(BaseException):
+    pass
+
+def _raise_timed_out(signum, frame):
+    raise _MoveTimedOut
+
+# Seeds the RNGs agents are likely to use. numpy is only seeded if something
+# already imported it.
+def seed_random(seed):
+    random.seed(seed)
+    numpy = sys.modules.get('numpy')
+    if numpy is not None:
+        numpy.random.seed(seed % 2 ** 32)
+
+def _read_exact(stream, size):
+    data = stream.read(size)
+    if len(data) != size:
+        raise EOFError
+    return data
+
+def _send(stream, op, payload=b'', count=None):
+    stream.write(FRAME.pack(op, len(payload) if count is None else count) + payload)
+    stream.flush()
+
+def serve(module_name, memory_mb=None, cpu_seconds=None, move_timeout=None):
+    stdin = sys.stdin.buffer
+    stdout = sys.stdout.buffer
+    # Anything the agent prints must not end up in the protocol stream.
+    sys.stdout = sys.stderr
+    _apply_limits(memory_mb, cpu_seconds)
+    timeout_ns = int(move_timeout * 1e9) if move_timeout else None
+    # Without setitimer (Windows) a slow call can't be interrupted; it still
+    # counts as hung once it returns, and the parent's deadline is the backstop.
+    alarm = timeout_ns is not None and hasattr(signal, 'setitimer')
+    if alarm:
+        signal.signal(signal.SIGALRM, _raise_timed_out)
+
+    # Returns (result, hung). An agent that swallows the interruption is
+    # caught by the elapsed-time check at the call site.
+    def guarded(call, *args):
+        if not alarm:
+            return call(*args), False
+        try:
+            signal.setitimer(signal.ITIMER_REAL, move_timeout)
+            try:
+                return call(*args), False
+            finally:
+                signal.setitimer(signal.ITIMER_REAL, 0)
+        except _MoveTimedOut:
+            return None, True
+    try:
+        agent_class = importlib.import_module(module_name).Agent
+    except BaseException as exc:
+        _send(stdout, OP_ERROR, f"{type(exc).__name__}: {exc}".encode('utf-8', errors='replace'))
+        return
+    hello = {'class_name': agent_class.__name__}
+    _send(stdout, OP_HELLO, json.dumps(hello).encode('utf-8'))
+
+    agents = {}
+    perf_counter_ns = time.perf_counter_ns
+    thread_time_ns = time.thread_time_ns
+    while True:
+        try:
+            op, count = FRAME.unpack(_read_exact(stdin, FRAME.size))
+        except EOFError:
+            return
+        try:
+            # Past MAX_RESTARTS hangs in one frame the series fails anyway,
+            # so the rest of the frame is answered as hung without waiting.
+            hangs = 0
+            if op == OP_PLAY:
+                payload = _read_exact(stdin, PLAY_REQUEST.size * count)
+                response = bytearray()
+                for slot, last_code in PLAY_REQUEST.iter_unpack(payload):
+                    if hangs > MAX_RESTARTS:
+                        agents.pop(slot, None)
+                        response += PLAY_RESPONSE.pack(HUNG, 0, 0)
+                        continue
+                    agent = agents[slot]
+                    start = perf_counter_ns()
+                    cpu_start = thread_time_ns()
+                    move, hung = guarded(agent.play, None if last_code == NO_MOVE else MOVES[last_code])
+                    cpu = thread_time_ns() - cpu_start
+                    elapsed = perf_counter_ns() - start
+                    if hung or (timeout_ns is not None and elapsed > timeout_ns):
+                        hangs += 1
+                        del agents[slot]
+                        response += PLAY_RESPONSE.pack(HUNG, elapsed, cpu)
+                    else:
+                        response += PLAY_RESPONSE.pack(rules.encode(move), elapsed, cpu)
+                _send(stdout, OP_PLAY, bytes(response), count)
+            elif op == OP_RESET:
+                payload = _read_exact(stdin, SLOT.size * count)
+                response = bytearray()
+                for (slot,) in SLOT.iter_unpack(payload):
+                    if hangs > MAX_RESTARTS:
+                        agents.pop(slot, None)
+                        response += DURATION.pack(HUNG_NS)
+                        continue
+                    start = perf_counter_ns()
+                    agent = agents.get(slot)
+                    if agent is None:
+                        agent, hung = guarded(agent_class)
+                    else:
+                        _, hung = guarded(latency.reset_agent, agent)
+                    elapsed = perf_counter_ns() - start
+                    if hung or (timeout_ns is not None and elapsed > timeout_ns):
+                        hangs += 1
+                        agents.pop(slot, None)
+                        response += DURATION.pack(HUNG_NS)
+                    else:
+                        agents[slot] = agent
+                        response += DURATION.pack(elapsed)
+                _send(stdout, OP_RESET, bytes(response), count)
+            elif op == OP_SEED:
+                (seed,) = SEED.unpack(_read_exact(stdin, SEED.size))
+                seed_random(seed)
+                _send(stdout, OP_SEED, DURATION.pack(time.process_time_ns()), 1)
+            elif op == OP_QUIT:
+                return
+            else:
+                _send(stdout, OP_ERROR, f"Unknown op {op}".encode('utf-8'))
+                return
+        except Exception as exc:
+            _send(stdout, OP_ERROR, f"{type(exc).__name__}: {exc}".encode('utf-8', errors='replace'))
+
+# Parent-side handle on one worker subprocess. The agent module is looked up
+# in cwd (default: this process's working directory) before anywhere else.
+# cpu_seconds is what every series may use: the worker's lifetime limit is
+# twice that, and the pool recycles it between series once it has used
+# cpu_seconds (worn_out), so a long-lived worker never runs out mid-series.
+class AgentWorker:
+    def __init__(self, module_name, memory_mb=DEFAULT_MEMORY_MB, cpu_seconds=None, timeout=DEFAULT_TIMEOUT,
+                 cwd=None):
+        self.module_name = module_name
+        self.timeout = timeout
+        self.cpu_seconds = cpu_seconds
+        self.cpu_ns = 0  # as of the last SEED reply
+        self.seeds = 0
+        command = [sys.executable, '-m', 'agent_worker', module_name, '--move-timeout', str(timeout)]
+        if memory_mb:
+            command += ['--memory-mb', str(memory_mb)]
+        if cpu_seconds:
+            command += ['--cpu-seconds', str(2 * cpu_seconds)]
+        env = dict(os.environ)
+        here = os.path.dirname(os.path.abspath(__file__))
+        env['PYTHONPATH'] = os.pathsep.join(filter(None, [os.getcwd(), here, env.get('PYTHONPATH')]))
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                        stderr=subprocess.DEVNULL, env=env, bufsize=0, cwd=cwd)
+        self._buffer = b''
+        # A worker that never says hello (an agent hanging or spinning at
+        # import) is killed, not left running behind the error.
+        try:
+            op, payload = self._read_frame(None, timeout)
+            if op == OP_ERROR:
+                raise AgentRaised(f"{module_name} failed to load: {payload.decode('utf-8', errors='replace')}")
+            if op != OP_HELLO:
+                raise AgentCrashed(f"{module_name} worker sent an unexpected greeting")
+            hello = json.loads(payload)
+        except BaseException:
+            self.kill()
+            raise
+        self.class_name = hello['class_name']
+
+    @property
+    def alive(self):
+        return self.process.poll() is None
+
+    # A worker is only worn out after serving a series, so one whose import
+    # alone takes the allowance isn't recycled forever.
+    @property
+    def worn_out(self):
+        return bool(self.cpu_seconds) and self.seeds > 1 and self.cpu_ns >= self.cpu_seconds * 1e9
+
+    def _read(self, size, deadline):
+        fd = self.process.stdout.fileno()
+        while len(self._buffer) < size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise AgentCrashed(f"{self.module_name} did not answer in time")
+            ready, _, _ = select.select([fd], [], [], remaining)
+            if not ready:
+                continue
+            chunk = os.read(fd, max(65536, size - len(self._buffer)))
+            if not chunk:
+                raise AgentCrashed(f"{self.module_name} worker exited")
+            self._buffer += chunk
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    # item_size=None means the payload is count raw bytes (HELLO/ERROR).
+    def _read_frame(self, item_size, timeout):
+        deadline = time.monotonic() + timeout
+        op, count = FRAME.unpack(self._read(FRAME.size, deadline))
+        if op in (OP_HELLO, OP_ERROR) or item_size is None:
+            return op, self._read(count, deadline)
+        return op, self._read(item_size * count, deadline)
+
+    def _request(self, op, payload, count):
+        try:
+            self.process.stdin.write(FRAME.pack(op, count) + payload)
+        except (BrokenPipeError, OSError):
+            raise AgentCrashed(f"{self.module_name} worker exited") from None
+
+    def _response(self, op, item_size, timeout):
+        reply, payload = self._read_frame(item_size, timeout)
+        if reply == OP_ERROR:
+            raise AgentRaised(payload.decode('utf-8', errors='replace'))
+        if reply != op:
+            raise AgentCrashed(f"{self.module_name} worker sent op {reply}, expected {op}")
+        return payload
+
+    # Requests are split into send/receive so both agents of a series can
+    # work on the same round at the same time.
+    def send_play(self, requests):
+        self._request(OP_PLAY, b''.join(PLAY_REQUEST.pack(slot, code) for slot, code in requests), len(requests))
+
+    def receive_play(self, timeout=None):
+        payload = self._response(OP_PLAY, PLAY_RESPONSE.size, timeout or self.timeout)
+        return list(PLAY_RESPONSE.iter_unpack(payload))
+
+    def send_reset(self, slots):
+        self._request(OP_RESET, b''.join(SLOT.pack(slot) for slot in slots), len(slots))
+
+    def receive_reset(self, timeout=None):
+        payload = self._response(OP_RESET, DURATION.size, timeout or self.timeout)
+        return [ns for (ns,) in DURATION.iter_unpack(payload)]
+
+    def send_seed(self, seed):
+        self._request(OP_SEED, SEED.pack(seed), 1)
+
+    def receive_seed(self, timeout=None):
+        payload = self._response(OP_SEED, DURATION.size, timeout or self.timeout)
+        (self.cpu_ns,) = DURATION.unpack(payload)
+        self.seeds += 1
+        return self.cpu_ns
+
+    def close(self):
+        if self.alive:
+            try:
+                self._request(OP_QUIT, b'', 0)
+                self.process.stdin.close()
+                self.process.wait(timeout=1)
+            except (AgentWorkerError, OSError, subprocess.TimeoutExpired):
+                self.kill()
+
+    def kill(self):
+        if self.alive:
+            self.process.kill()
+        self.process.wait()
+
+# Long-lived workers per agent module, shared by every series of a tournament.
+# A worker is checked out for the duration of one series.
+class AgentWorkerPool:
+    def __init__(self, memory_mb=DEFAULT_MEMORY_MB, cpu_seconds=None, timeout=DEFAULT_TIMEOUT, cwd=None):
+        self.memory_mb = memory_mb
+        self.cpu_seconds = cpu_seconds
+        self.timeout = timeout
+        self.cwd = cwd
+        self.spawned = 0
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, module_name):
+        with self._lock:
+            idle = self._idle.get(module_name)
+            while idle:
+                worker = idle.pop()
+                if worker.alive:
+                    return worker
+        return self._spawn(module_name)
+
+    def _spawn(self, module_name):
+        worker = AgentWorker(module_name, self.memory_mb, self.cpu_seconds, self.timeout, self.cwd)
+        with self._lock:
+            self.spawned += 1
+        return worker
+
+    def release(self, worker):
+        if not worker.alive:
+            worker.kill()
+            return
+        with self._lock:
+            self._idle.setdefault(worker.module_name, []).append(worker)
+
+    def replace(self, worker):
+        worker.kill()
+        return self.acquire(worker.module_name)
+
+    # A worn-out worker is swapped for a new process, never another idle one.
+    def recycle(self, worker):
+        worker.close()
+        return self._spawn(worker.module_name)
+
+    def close(self):
+        with self._lock:
+            workers = [worker for idle in self._idle.values() for worker in idle]
+            self._idle = {}
+        for worker in workers:
+            worker.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+# Stands in for an agent class in the tournament when agents are sandboxed:
+# it carries what the scheduler needs (its names) without ever
+# importing the agent into the tournament process.
+class SandboxedAgent:
+    def __init__(self, pool, module_name):
+        worker = pool.acquire(module_name)
+        self.pool = pool
+        self.__module__ = module_name
+        self.__name__ = worker.class_name
+        pool.release(worker)
+
+class _Game:
+    __slots__ = ('slot', 'match_num', 'loads1', 'loads2', 'mirror1', 'mirror2', 'last1', 'last2', 'rounds')
+
+    def __init__(self, slot, match_num):
+        self.slot = slot
+        self.match_num = match_num
+        self.loads1 = 0
+        self.loads2 = 0
+        self.mirror1 = True
+        self.mirror2 = True
+        self.last1 = NO_MOVE
+        self.last2 = NO_MOVE
+        self.rounds = bytearray()
+
+# Sends one batch to each side before reading either reply, so both agents
+# think about the same round at once; a side whose request is None is left
+# out. Returns the replies and which sides crashed; an agent exception is
+# raised only after both replies are read so the surviving worker's pipe stays
+# in step. Profiled runs count the whole exchange as agent time.
+def _exchange(workers, send, receive, requests, timeout):
+    with profiling.phase('agents'):
+        return _exchange_batches(workers, send, receive, requests, timeout)
+
+def _exchange_batches(workers, send, receive, requests, timeout):
+    replies = [None, None]
+    crashed = [False, False]
+    for side, worker in enumerate(workers):
+        if requests[side] is None:
+            continue
+        try:
+            getattr(worker, send)(requests[side])
+        except AgentCrashed:
+            crashed[side] = True
+    raised = None
+    for side, worker in enumerate(workers):
+        if crashed[side] or requests[side] is None:
+            continue
+        try:
+            replies[side] = getattr(worker, receive)(timeout)
+        except AgentCrashed:
+            crashed[side] = True
+        except AgentRaised as exc:
+            raised = raised or exc
+    if raised is not None:
+        raise raised
+    return replies, crashed
+
+# Plays a whole series between two sandboxed agents and returns (rounds,
+# outcome) per match, in match order. Up to MAX_CONCURRENT_GAMES matches run
+# at once, each on its own pair of agent instances ("slot"); a slot's agents
+# are reset before every match they play, as in the in-process series loop.
+# A hung play() or reset forfeits that game only. A worker that crashes or
+# stops answering forfeits every game in progress, as its agents are gone,
+# and is replaced and seeded again. More than MAX_RESTARTS hangs or crashes
+# of one agent fail the series.
+def play_series(agent1, agent2, num_matches=100, timings=None, move_budget=None, rounds=100):
+    pool = agent1.pool
+    budget_ns = None if move_budget is None else int(move_budget * 1e9)
+    workers = [pool.acquire(agent1.__module__), pool.acquire(agent2.__module__)]
+    failures = [0, 0]
+    results = [None] * num_matches
+    games = {}
+    slots = range(min(num_matches, MAX_CONCURRENT_GAMES))
+    next_match = 0
+    legal, outcome_table, load_delta = rules.LEGAL, rules.OUTCOME, rules.LOAD_DELTA
+    finished_cleanly = False
+    # Derived from the caller's random state, so a seeded series seeds both
+    # workers, and every worker that replaces one, the same way every time.
+    seeds = (random.getrandbits(64), random.getrandbits(64))
+
+    # Only a backstop for a worker that stops answering: the worker gives up
+    # on any single call after pool.timeout seconds itself, so a batch of
+    # moves that each finish in time never runs into it.
+    def timeout_for(count):
+        return pool.timeout * (count + 1)
+
+    def failed(side):
+        failures[side] += 1
+        if failures[side] > MAX_RESTARTS:
+            raise AgentCrashed(f"{workers[side].module_name} crashed or hung {failures[side]} times")
+
+    def forfeit(game, lost):
+        if lost[0] and lost[1]:
+            outcome = DRAW
+        else:
+            outcome = 1 if lost[0] else 0
+        results[game.match_num] = (bytes(game.rounds), outcome)
+        for side in (0, 1):
+            if lost[side]:
+                timings[side].forfeits += 1
+        del games[game.slot]
+
+    def hung(game, lost):
+        forfeit(game, lost)
+        for side in (0, 1):
+            if lost[side]:
+                failed(side)
+
+    # Seeds the given sides' workers, replacing any that crash and recycling
+    # any that have used up their CPU allowance, until all of them are seeded.
+    def seed(sides):
+        while sides:
+            requests = tuple(seeds[side] if side in sides else None for side in (0, 1))
+            _, crashed = _exchange(workers, 'send_seed', 'receive_seed', requests, timeout_for(1))
+            retry = []
+            for side in sides:
+                if crashed[side]:
+                    failed(side)
+                    workers[side] = pool.replace(workers[side])
+                elif workers[side].worn_out:
+                    workers[side] = pool.recycle(workers[side])
+                else:
+                    continue
+                retry.append(side)
+            sides = retry
+
+    def replace_crashed(crashed):
+        for game in list(games.values()):
+            forfeit(game, crashed)
+        sides = [side for side in (0, 1) if crashed[side]]
+        for side in sides:
+            failed(side)
+            workers[side] = pool.replace(workers[side])
+        seed(sides)
+
+    try:
+        seed([0, 1])
+
+        while games or next_match < num_matches:
+            starting = []
+            for slot in slots:
+                if slot not in games and next_match < num_matches:
+                    games[slot] = _Game(slot, next_match)
+                    starting.append(slot)
+                    next_match += 1
+            if starting:
+                replies, crashed = _exchange(workers, 'send_reset', 'receive_reset', (starting, starting),
+                                             timeout_for(len(starting)))
+                if crashed[0] or crashed[1]:
+                    replace_crashed(crashed)
+                    continue
+                for slot, ns1, ns2 in zip(starting, replies[0], replies[1]):
+                    if ns1 != HUNG_NS:
+                        timings[0].reset.record(ns1)
+                    if ns2 != HUNG_NS:
+                        timings[1].reset.record(ns2)
+                    if ns1 == HUNG_NS or ns2 == HUNG_NS:
+                        hung(games[slot], (ns1 == HUNG_NS, ns2 == HUNG_NS))
+                if not games:
+                    continue
+
+            active = list(games.values())
+            requests = ([(game.slot, game.last2) for game in active], [(game.slot, game.last1) for game in active])
+            replies, crashed = _exchange(workers, 'send_play', 'receive_play', requests, timeout_for(len(active)))
+            if crashed[0] or crashed[1]:
+                replace_crashed(crashed)
+                continue
+
+            record1, record2 = timings[0].play.record, timings[1].play.record
+            for game, (move1, ns1, cpu1), (move2, ns2, cpu2) in zip(active, replies[0], replies[1]):
+                record1(ns1)
+                record2(ns2)
+                if move1 == HUNG or move2 == HUNG:
+                    hung(game, (move1 == HUNG, move2 == HUNG))
+                    continue
+                code1 = legal[move1][2 if game.loads1 >= 2 else game.loads1][game.mirror1]
+                code2 = legal[move2][2 if game.loads2 >= 2 else game.loads2][game.mirror2]
+                game.rounds.append((code1 << 4) | code2)
+                game.loads1 += load_delta[code1]
+                game.loads2 += load_delta[code2]
+                if code1 == rules.MIRROR:
+                    game.mirror1 = False
+                if code2 == rules.MIRROR:
+                    game.mirror2 = False
+                winner = outcome_table[code1][code2]
+
+                if budget_ns is not None:
+                    over1 = cpu1 > budget_ns
+                    over2 = cpu2 > budget_ns
+                    if over1:
+                        timings[0].forfeits += 1
+                    if over2:
+                        timings[1].forfeits += 1
+                    if over1 and not over2:
+                        winner = 1
+                    elif over2 and not over1:
+                        winner = 0
+
+                if winner is None and len(game.rounds) == rounds:
+                    winner = DRAW
+                if winner is None:
+                    game.last1, game.last2 = code1, code2
+                else:
+                    results[game.match_num] = (bytes(game.rounds), winner)
+                    del games[game.slot]
+        finished_cleanly = True
+    finally:
+        for worker in workers:
+            if finished_cleanly:
+                pool.release(worker)
+            else:
+                # A failed series may leave replies unread in the pipe.
+                worker.kill()
+
+    return results
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Host one agent module for the tournament (internal).")
+    parser.add_argument('module')
+    parser.add_argument('--memory-mb', type=int, default=None)
+    parser.add_argument('--cpu-seconds', type=int, default=None)
+    parser.add_argument('--move-timeout', type=float, default=None)
+    args = parser.parse_args()
+    serve(args.module, args.memory_mb, args.cpu_seconds, args.move_timeout)
+
+if __name__ == '__main__':
+    main()
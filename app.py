@@ -1,13 +1,25 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, Response, stream_with_context, send_file
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 import subprocess
 import os
+import sys
 import re
 import logging
 import traceback
 from logging.handlers import RotatingFileHandler
 import threading
 import json
+import sqlite3
+from datetime import datetime, timezone
+
+import agent_validation
+import game_sessions
+import pairwise
+import progress
+import rules
+import visualize_game
 
 # Initialize Flask app
 app = Flask(__name__)
@@ -16,15 +28,78 @@ app = Flask(__name__)
 app.config['LOADING_GIF'] = 'static/cute-dancing.gif'
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///agents.db'
 app.config['SECRET_KEY'] = 'your_secret_key_here'  # Change this to a random secret key
+app.config['MOVE_BUDGET_MS'] = 100  # an agent whose move takes longer forfeits the round
 db = SQLAlchemy(app)
 
+# WAL lets leaderboard reads carry on while a finished tournament is written.
+@event.listens_for(Engine, 'connect')
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.close()
+
 # Constants
 OUTPUT_FILE = 'tournament_output.txt'
 PROGRESS_FILE = 'tournament_progress.json'
+# Where results and timings lived before the database; only read once to
+# import an existing leaderboard.
+RESULTS_FILE = 'tournament_results.json'
+LATENCY_FILE = 'agent_latency.json'
+CHECKPOINT_FILE = 'tournament_checkpoint.jsonl'  # left behind by an interrupted tournament
+# Whatever the tournament process and its agents print, kept apart from its
+# events.
+CONSOLE_FILE = os.path.join('logs', 'tournament_console.log')
 
 # Global variables
 tournament_running = False
 
+# In-memory record of the current tournament, fed by the events tournament.py
+# prints with --events. Event ids keep increasing across tournaments, so a
+# client only ever receives the events after the last id it has seen.
+class TournamentEvents:
+    def __init__(self, heartbeat=15):
+        self.heartbeat = heartbeat
+        self._condition = threading.Condition()
+        self._events = []
+        self._first_id = 1
+        self.state = {'progress': {}, 'series': [], 'results': {}, 'errors': []}
+
+    def reset(self):
+        with self._condition:
+            self._first_id += len(self._events)
+            self._events = []
+            self.state = {'progress': {}, 'series': [], 'results': {}, 'errors': []}
+
+    def publish(self, event, data):
+        with self._condition:
+            if event == 'progress':
+                self.state['progress'] = data
+            elif event == 'series':
+                self.state['series'].append(data)
+            elif event == 'results':
+                self.state['results'] = dict(data['standings'])
+            elif event == 'error':
+                self.state['errors'].append(data)
+            self._events.append((event, json.dumps(data)))
+            self._condition.notify_all()
+
+    @property
+    def last_id(self):
+        with self._condition:
+            return self._first_id + len(self._events) - 1
+
+    def wait_for_events(self, after_id):
+        with self._condition:
+            self._condition.wait_for(lambda: self._first_id + len(self._events) - 1 > after_id,
+                                     timeout=self.heartbeat)
+            start = max(after_id + 1 - self._first_id, 0)
+            return [(self._first_id + i, event, data)
+                    for i, (event, data) in enumerate(self._events[start:], start)]
+
+tournament_events = TournamentEvents()
+
 # Logging setup
 if not os.path.exists('logs'):
     os.mkdir('logs')
@@ -37,25 +112,88 @@ file_handler.setFormatter(logging.Formatter(
 file_handler.setLevel(logging.INFO)
 app.logger.addHandler(file_handler)
 
-# Database model
+# Database models
 class Agent(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(100), nullable=False)
-    code = db.Column(db.Text, nullable=False)
-    score = db.Column(db.Float, default=0)
+    name = db.Column(db.String(100), nullable=False, unique=True, index=True)
+    code = db.Column(db.Text, nullable=False, default='')
+    score = db.Column(db.Float, default=0, index=True)
+    latency = db.Column(db.Text)  # JSON timing summary from the last tournament the agent played
+
+class TournamentRun(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    finished_at = db.Column(db.DateTime, nullable=False, index=True,
+                            default=lambda: datetime.now(timezone.utc))
+    seconds = db.Column(db.Float)
+    num_matches = db.Column(db.Integer)
+    num_errors = db.Column(db.Integer, default=0)
+    standings = db.Column(db.Text)  # JSON [[agent, score], ...]
+
+class PairResult(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    tournament_id = db.Column(db.Integer, db.ForeignKey('tournament_run.id'), nullable=False, index=True)
+    agent1 = db.Column(db.String(100), nullable=False, index=True)
+    agent2 = db.Column(db.String(100), nullable=False, index=True)
+    score1 = db.Column(db.Float, nullable=False)
+    score2 = db.Column(db.Float, nullable=False)
+    seconds = db.Column(db.Float)
+    cached = db.Column(db.Boolean, default=False)
+    __table_args__ = (db.Index('ix_pair_result_pair', 'agent1', 'agent2', 'tournament_id'),)
+
+# The leaderboard as the pages need it, built from the database on first use
+# and dropped whenever it changes (a tournament finishing, an agent being
+# added or deleted), so page loads and status polls don't touch the database.
+class LeaderboardCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshot = None
+
+    def get(self):
+        snapshot = self._snapshot
+        if snapshot is None:
+            with self._lock:
+                if self._snapshot is None:
+                    agents = Agent.query.order_by(Agent.score.desc(), Agent.name).all()
+                    matrix = pairwise.PairwiseMatrix.load() if os.path.exists(pairwise.MATRIX_FILE) else None
+                    self._snapshot = {
+                        'standings': [(agent.name, agent.score or 0) for agent in agents],
+                        'latency': {agent.name: json.loads(agent.latency) for agent in agents if agent.latency},
+                        'matrix': matrix,
+                        'matrix_json': None if matrix is None else matrix.to_dict(),
+                    }
+                snapshot = self._snapshot
+        return snapshot
+
+    def invalidate(self):
+        with self._lock:
+            self._snapshot = None
+
+leaderboard_cache = LeaderboardCache()
+replay_cache = None  # made by set_up, with the rest of the on-disk state
+game_sessions_manager = game_sessions.SessionManager(move_budget=app.config['MOVE_BUDGET_MS'] / 1000)
+_set_up = False
+_set_up_lock = threading.Lock()
+
+# Creates or migrates the database and the replay cache directory before the
+# first request rather than on import, so tooling and tests can import this
+# module without touching the disk.
+@app.before_request
+def set_up():
+    global _set_up, replay_cache
+    if _set_up:
+        return
+    with _set_up_lock:
+        if not _set_up:
+            initialize_database()
+            replay_cache = visualize_game.ReplayCache()
+            _set_up = True
 
 # Routes
 
 @app.route('/')
 def index():
-    try:
-        with open('tournament_results.json', 'r') as f:
-            results = json.load(f)
-        sorted_results = sorted(results.items(), key=lambda x: x[1], reverse=True)
-        return render_template('index.html', agents=sorted_results)
-    except FileNotFoundError:
-        app.logger.error("tournament_results.json not found. Initializing with empty results.")
-        return render_template('index.html', agents=[])
+    leaderboard = leaderboard_cache.get()
+    return render_template('index.html', agents=leaderboard['standings'], latency=leaderboard['latency'])
 
 @app.route('/submit', methods=['GET', 'POST'])
 def submit():
@@ -73,20 +211,23 @@ def submit():
         
         agent_name = f"{name}_agent" if not name.endswith('_agent') else name
         
+        error = validate_agent_code(agent_name, code)
+        if error:
+            flash(error, 'error')
+            return render_template('submit.html', name=name, code=code)
+        
         # Save the agent file
         save_agent_file(agent_name, code)
         
-        # Update the JSON file
-        with open('tournament_results.json', 'r') as f:
-            results = json.load(f)
-        
-        if agent_name not in results:
-            results[agent_name] = 0
-            with open('tournament_results.json', 'w') as f:
-                json.dump(results, f)
+        agent = Agent.query.filter_by(name=agent_name).first()
+        if agent is None:
+            db.session.add(Agent(name=agent_name, code=code, score=0))
             flash('Agent submitted successfully!', 'success')
         else:
+            agent.code = code
             flash('Agent updated successfully!', 'success')
+        db.session.commit()
+        leaderboard_cache.invalidate()
         
         return redirect(url_for('index'))
     return render_template('submit.html')
@@ -94,16 +235,20 @@ def submit():
 @app.route('/edit/<string:id>', methods=['GET', 'POST'])
 def edit(id):
     try:
-        with open('tournament_results.json', 'r') as f:
-            results = json.load(f)
-        
-        if id not in results:
+        agent = Agent.query.filter_by(name=id).first()
+        if agent is None:
             flash('Agent not found!', 'error')
             return redirect(url_for('index'))
         
         if request.method == 'POST':
             code = request.form['code']
+            error = validate_agent_code(id, code)
+            if error:
+                flash(error, 'error')
+                return render_template('edit.html', agent={'name': id, 'code': code})
             save_agent_file(id, code)
+            agent.code = code
+            db.session.commit()
             flash('Agent updated successfully!', 'success')
             return redirect(url_for('index'))
         
@@ -117,21 +262,19 @@ def edit(id):
 
 @app.route('/delete/<string:id>')
 def delete(id):
-    try:
-        with open('tournament_results.json', 'r') as f:
-            results = json.load(f)
-        
-        if id in results:
-            del results[id]
-            with open('tournament_results.json', 'w') as f:
-                json.dump(results, f)
-            
+    agent = Agent.query.filter_by(name=id).first()
+    if agent is not None:
+        db.session.delete(agent)
+        db.session.commit()
+        leaderboard_cache.invalidate()
+        game_sessions_manager.pool.invalidate(id)
+        try:
             os.remove(f'{id}.py')
-            flash('Agent deleted successfully!', 'success')
-        else:
-            flash('Agent not found!', 'error')
-    except FileNotFoundError:
-        flash('Tournament results file not found!', 'error')
+        except FileNotFoundError:
+            app.logger.warning(f"Deleted {id} had no agent file")
+        flash('Agent deleted successfully!', 'success')
+    else:
+        flash('Agent not found!', 'error')
     
     return redirect(url_for('index'))
 
@@ -140,51 +283,175 @@ def run_tournament():
     global tournament_running
     if not tournament_running:
         tournament_running = True
-        threading.Thread(target=run_tournament_script).start()
+        # ?profile=1 writes a profiling report next to the results (see profiling.py).
+        profile = request.args.get('profile', '').lower() in ('1', 'true', 'yes')
+        threading.Thread(target=run_tournament_script, args=(profile,)).start()
         return jsonify({'status': 'started'})
     else:
         return jsonify({'status': 'already_running'})
 
 @app.route('/tournament_status')
 def tournament_status():
-    app.logger.info("Received request for tournament status")
-    results = {}
-    if os.path.exists(OUTPUT_FILE):
-        app.logger.info(f"Output file found: {OUTPUT_FILE}")
-        with open(OUTPUT_FILE, 'r') as f:
-            lines = f.readlines()
-            app.logger.info(f"Read {len(lines)} lines from output file")
-            results = parse_tournament_results(lines)
-    else:
-        app.logger.warning(f"Output file not found: {OUTPUT_FILE}")
-    
-    # Read progress from PROGRESS_FILE
-    progress = {}
-    if os.path.exists(PROGRESS_FILE):
-        with open(PROGRESS_FILE, 'r') as f:
-            progress = json.load(f)
+    # Served from the in-memory event state instead of re-reading the output
+    # file, which grows with every round of the tournament.
+    results = tournament_events.state['results']
+    # A tournament started outside the app only shows up in the progress
+    # file, which tournament.py replaces atomically.
+    current_progress = tournament_events.state['progress'] or progress.read_progress(PROGRESS_FILE)
     
-    # Read full results from tournament_results.json
-    full_results = {}
-    if os.path.exists('tournament_results.json'):
-        with open('tournament_results.json', 'r') as f:
-            full_results = json.load(f)
+    full_results = dict(leaderboard_cache.get()['standings'])
     
     response = {
         'running': tournament_running,
         'results': results,
-        'progress': progress,
+        'progress': current_progress,
         'full_results': full_results
     }
-    app.logger.info(f"Sending tournament status response: {response}")
+    app.logger.debug(f"Sending tournament status response: {response}")
     return jsonify(response)
 
+@app.route('/api/matrix')
+def pairwise_matrix():
+    matrix_json = leaderboard_cache.get()['matrix_json']
+    if matrix_json is None:
+        return jsonify({'error': 'No tournament has been played yet'}), 404
+    return jsonify(matrix_json)
+
+# /api/head_to_head/<agent>?opponent=<name> for one pairing (both seatings),
+# or ?top=K for the agent's record against the K best-rated others.
+@app.route('/api/head_to_head/<string:agent>')
+def head_to_head(agent):
+    matrix = leaderboard_cache.get()['matrix']
+    if matrix is None:
+        return jsonify({'error': 'No tournament has been played yet'}), 404
+    opponent = request.args.get('opponent')
+    try:
+        if opponent:
+            return jsonify({'agent': agent, 'opponent': opponent, **matrix.head_to_head(agent, opponent)})
+        top = request.args.get('top', 5, type=int)
+        return jsonify({'agent': agent, 'top': top, **matrix.against_top(agent, top)})
+    except KeyError as e:
+        return jsonify({'error': f"Unknown agent {e}"}), 404
+
+# Animated replay of one archived match: /replay/<agent1>/<agent2>/<n>?format=gif
+# (or mp4 when imageio-ffmpeg is installed). Rendered on first request and
+# served from the replay cache after that.
+@app.route('/replay/<string:agent1>/<string:agent2>/<int:match_num>')
+def replay(agent1, agent2, match_num):
+    fmt = request.args.get('format', 'gif')
+    if fmt not in visualize_game.FORMATS:
+        return jsonify({'error': f"Unknown format '{fmt}', expected one of: {', '.join(visualize_game.FORMATS)}"}), 400
+    if fmt == 'mp4' and not visualize_game.mp4_available():
+        return jsonify({'error': 'MP4 replays need imageio-ffmpeg on the server'}), 501
+    try:
+        path = visualize_game.render_archived_match(agent1, agent2, match_num, fmt, replay_cache)
+    except FileNotFoundError:
+        return jsonify({'error': 'No tournament has been played yet'}), 404
+    except (KeyError, IndexError) as e:
+        return jsonify({'error': e.args[0]}), 404
+    return send_file(os.path.abspath(path), mimetype='image/gif' if fmt == 'gif' else 'video/mp4', max_age=3600)
+
+# Human-vs-agent games (game_sessions.py). POST /api/games with {"agent": name}
+# starts one, POST /api/games/<id>/move with {"move": ...} plays a round, and
+# the game is closed when the match ends, on DELETE or after going idle.
+@app.route('/api/games', methods=['POST'])
+def start_game():
+    agent_name = (request.get_json(silent=True) or request.form).get('agent', '')
+    if agent_name not in dict(leaderboard_cache.get()['standings']):
+        return jsonify({'error': f"Unknown agent '{agent_name}'"}), 404
+    try:
+        session = game_sessions_manager.start(agent_name)
+    except game_sessions.TooManySessions as e:
+        return jsonify({'error': str(e)}), 503
+    except Exception as e:
+        app.logger.exception(f"Could not start a game against {agent_name}")
+        return jsonify({'error': f"Could not load {agent_name}: {type(e).__name__}: {e}"}), 500
+    return jsonify(session.state()), 201
+
+@app.route('/api/games/<string:session_id>')
+def game_state(session_id):
+    try:
+        return jsonify(game_sessions_manager.get(session_id).state())
+    except game_sessions.UnknownSession as e:
+        return jsonify({'error': str(e)}), 404
+
+@app.route('/api/games/<string:session_id>/move', methods=['POST'])
+def game_move(session_id):
+    move = (request.get_json(silent=True) or request.form).get('move')
+    if move not in rules.MOVE_CODES:
+        return jsonify({'error': f"Unknown move {move!r}"}), 400
+    try:
+        return jsonify(game_sessions_manager.play(session_id, move))
+    except game_sessions.UnknownSession as e:
+        return jsonify({'error': str(e)}), 404
+
+@app.route('/api/games/<string:session_id>', methods=['DELETE'])
+def end_game(session_id):
+    if game_sessions_manager.end(session_id) is None:
+        return jsonify({'error': f"No game {session_id!r} in progress"}), 404
+    return jsonify({'status': 'ended'})
+
+@app.route('/tournament_history')
+def tournament_history():
+    limit = request.args.get('limit', 20, type=int)
+    runs = TournamentRun.query.order_by(TournamentRun.finished_at.desc()).limit(limit).all()
+    return jsonify([{
+        'id': run.id,
+        'finished_at': run.finished_at.isoformat(),
+        'seconds': run.seconds,
+        'num_matches': run.num_matches,
+        'num_errors': run.num_errors,
+        'standings': json.loads(run.standings),
+    } for run in runs])
+
+@app.route('/tournament_events')
+def tournament_events_stream():
+    # Server-Sent Events: each client only receives events newer than the
+    # last id it has seen (EventSource resends it as Last-Event-ID).
+    # New clients start from now and get a status snapshot instead of a
+    # replay of the tournament so far.
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    try:
+        after_id = int(last_event_id)
+    except (TypeError, ValueError):
+        after_id = tournament_events.last_id
+
+    def stream():
+        nonlocal after_id
+        status = {'running': tournament_running, 'progress': tournament_events.state['progress']}
+        yield f"id: {after_id}\nevent: status\ndata: {json.dumps(status)}\n\n"
+        while True:
+            events = tournament_events.wait_for_events(after_id)
+            if not events:
+                yield ": keep-alive\n\n"
+                continue
+            for event_id, event, data in events:
+                yield f"id: {event_id}\nevent: {event}\ndata: {data}\n\n"
+                after_id = event_id
+
+    return Response(stream_with_context(stream()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 
 # Helper functions
+# Compiles, imports and smoke-tests submitted code in a sandbox before it is
+# saved (see agent_validation.py). Returns the reason it was rejected, if any.
+def validate_agent_code(agent_name, code):
+    try:
+        timings = agent_validation.validate_agent(agent_name, code, app.config['MOVE_BUDGET_MS'] / 1000)
+    except agent_validation.AgentValidationError as e:
+        app.logger.info(f"Rejected code for {agent_name}: {e}")
+        return f"Agent rejected: {e}"
+    app.logger.info(f"Accepted code for {agent_name}: {timings.summary()['play']}")
+    return None
+
 def save_agent_file(agent_name, code):
     filename = f"{agent_name}_agent.py" if not agent_name.endswith('_agent') else f"{agent_name}.py"
     with open(filename, 'w') as f:
         f.write(code)
+    # Store the bytecode now so tournament workers don't each compile it.
+    agent_validation.precompile(filename)
+    game_sessions_manager.pool.invalidate(filename[:-3])
 
 def delete_agent_file(agent_name):
     try:
@@ -192,129 +459,152 @@ def delete_agent_file(agent_name):
     except FileNotFoundError:
         pass
 
-def parse_tournament_results(lines):
-    results = {}
-    parsing_results = False
-    app.logger.info("--- Starting to parse tournament results ---")
-    for line in lines:
-        #app.logger.info(f"Reading line: {line.strip()}")
-        if line.strip() == "Tournament Results:":
-            parsing_results = True
-            app.logger.info("Found 'Tournament Results:' line, starting to parse results")
-            continue
-        if parsing_results:
-            parts = line.strip().split(": ")
-            if len(parts) == 2:
-                agent, score = parts
-                try:
-                    numeric_score = float(score.split()[0])
-                    results[agent] = numeric_score
-                    app.logger.info(f"Parsed result: {agent} = {numeric_score}")
-                except ValueError:
-                    app.logger.error(f"Error parsing score for {agent}: {score}")
-            else:
-                app.logger.warning(f"Skipping line (not in expected format): {line.strip()}")
-    app.logger.info("--- Finished parsing tournament results ---")
-    app.logger.info(f"Final parsed results: {results}")
-    return results
-
-def update_agent_scores(results):
+def read_agent_code(agent_name):
+    try:
+        with open(f'{agent_name}.py', 'r') as f:
+            return f.read()
+    except FileNotFoundError:
+        return ''
+
+def update_agent_scores(results, latency=None):
     app.logger.info("Updating agent scores in the database")
+    latency = latency or {}
     for agent_name, score in results.items():
         db_agent_name = f"{agent_name}_agent" if not agent_name.endswith('_agent') else agent_name
         agent = Agent.query.filter_by(name=db_agent_name).first()
-        if agent:
-            agent.score = score
-            app.logger.info(f"Updated {db_agent_name} score to {score}")
-        else:
-            app.logger.warning(f"Agent {db_agent_name} not found in database")
+        if agent is None:
+            # Agent files dropped in next to the app rather than submitted.
+            agent = Agent(name=db_agent_name, code=read_agent_code(db_agent_name))
+            db.session.add(agent)
+            app.logger.info(f"Added {db_agent_name} to the database")
+        agent.score = score
+        if agent_name in latency:
+            agent.latency = json.dumps(latency[agent_name])
+        app.logger.info(f"Updated {db_agent_name} score to {score}")
     db.session.commit()
     app.logger.info("Database update completed")
 
-def initialize_tournament_results():
-    if not os.path.exists('tournament_results.json'):
-        results = {}
+# Stores a finished tournament (its standings and every pairing's scores)
+# and the new leaderboard in one transaction.
+def record_tournament(final, new_results):
+    run = TournamentRun(seconds=final['seconds'], num_matches=final['num_matches'],
+                        num_errors=len(final['errors']), standings=json.dumps(final['standings']))
+    db.session.add(run)
+    db.session.flush()
+    db.session.add_all(
+        PairResult(tournament_id=run.id, agent1=series['agent1'], agent2=series['agent2'],
+                   score1=series['score1'], score2=series['score2'], seconds=series['seconds'],
+                   cached=series['cached'])
+        for series in final['series']
+    )
+    update_agent_scores(new_results, final['latency'])
+    leaderboard_cache.invalidate()
+    return run
+
+def initialize_database():
+    db.create_all()
+    if Agent.query.first() is not None:
+        app.logger.info("Agent table already populated, skipping initialization")
+        return
+
+    # Import the leaderboard kept in JSON files by earlier versions, or start
+    # every agent file on the disk at 0.
+    results = {}
+    if os.path.exists(RESULTS_FILE):
+        with open(RESULTS_FILE, 'r') as f:
+            results = json.load(f)
+    else:
         for filename in os.listdir('.'):
             if filename.endswith('_agent.py'):
-                agent_name = filename[:-3]  # Remove '.py' from the end
-                results[agent_name] = 0
-        
-        with open('tournament_results.json', 'w') as f:
-            json.dump(results, f)
-        
-        app.logger.info(f"Initialized tournament_results.json with {len(results)} agents")
-    else:
-        app.logger.info("tournament_results.json already exists, skipping initialization")
+                results[filename[:-3]] = 0
+    latency = {}
+    if os.path.exists(LATENCY_FILE):
+        with open(LATENCY_FILE, 'r') as f:
+            latency = json.load(f)
+    update_agent_scores(results, latency)
+    leaderboard_cache.invalidate()
+    app.logger.info(f"Initialized the database with {len(results)} agents")
 
-def run_tournament_script():
+def parse_tournament_event(line):
+    if not line.startswith('{'):
+        return None
+    try:
+        event = json.loads(line)
+    except ValueError:
+        return None
+    if not isinstance(event, dict) or 'event' not in event:
+        return None
+    return event
+
+def run_tournament_script(profile=False):
     global tournament_running
     try:
-        open(OUTPUT_FILE, 'w').close()
-        open(PROGRESS_FILE, 'w').close()
+        tournament_events.reset()
 
-        process = subprocess.Popen(
-            ['python', 'tournament.py'],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            universal_newlines=True
-        )
+        # tournament.py writes its own output file; here we only consume its
+        # structured events, which arrive on a pipe of their own so nothing an
+        # agent prints can get into them. stdout and stderr go to
+        # CONSOLE_FILE, where a chatty agent can't stall the run either.
+        command = [sys.executable, 'tournament.py', '--log-level', 'series',
+                   '--move-budget-ms', str(app.config['MOVE_BUDGET_MS'])]
+        if os.path.exists(CHECKPOINT_FILE):
+            command.append('--resume')
+            app.logger.info("Resuming interrupted tournament from its checkpoint")
+        if profile:
+            command.append('--profile')
+        read_fd, write_fd = os.pipe()
+        try:
+            with open(CONSOLE_FILE, 'w') as console:
+                process = subprocess.Popen(command + ['--events-fd', str(write_fd)], pass_fds=(write_fd,),
+                                           stdin=subprocess.DEVNULL, stdout=console, stderr=subprocess.STDOUT)
+        except BaseException:
+            os.close(read_fd)
+            raise
+        finally:
+            os.close(write_fd)
 
-        while True:
-            output = process.stdout.readline()
-            if output == '' and process.poll() is not None:
-                break
-            if output:
-                app.logger.info(f"Tournament output: {output.strip()}")
-                with open(OUTPUT_FILE, 'a') as f:
-                    f.write(output)
-
-        stdout, stderr = process.communicate()
-        if stdout:
-            app.logger.info(f"Tournament final output: {stdout}")
-            with open(OUTPUT_FILE, 'a') as f:
-                f.write(stdout)
-        if stderr:
-            app.logger.error(f"Tournament error output: {stderr}")
-            with open(OUTPUT_FILE, 'a') as f:
-                f.write(f"Error: {stderr}")
+        final = None
+        with os.fdopen(read_fd, 'r') as events:
+            for line in events:
+                event = parse_tournament_event(line)
+                if event is None:
+                    app.logger.warning(f"Skipping a line on the tournament event pipe that is not an event: "
+                                       f"{line.rstrip()[:200]}")
+                    continue
+                name = event.pop('event')
+                tournament_events.publish(name, event)
+                if name == 'results':
+                    final = event
+        process.wait()
 
         if process.returncode != 0:
-            app.logger.error(f"Tournament script exited with error code {process.returncode}")
-            with open(OUTPUT_FILE, 'a') as f:
-                f.write(f"Tournament script exited with error code {process.returncode}\n")
-
-        # Parse results after tournament completion
-        with open(OUTPUT_FILE, 'r') as f:
-            lines = f.readlines()
-            new_results = parse_tournament_results(lines)
-        
+            app.logger.error(f"Tournament script exited with error code {process.returncode}, see {CONSOLE_FILE}")
+        if final is None:
+            raise RuntimeError(f"Tournament exited with code {process.returncode} without reporting results")
+
+        for error in final['errors']:
+            app.logger.error(f"Tournament error ({error['agent1']} vs {error['agent2']}): {error['type']}: {error['message']}")
+
         # Round scores to 2 decimal points
-        new_results = {agent: round(score, 2) for agent, score in new_results.items()}
+        new_results = {agent: round(score, 2) for agent, score in final['totals'].items()}
         
-        app.logger.info(f"Tournament results parsed: {new_results}")
-
-        # Read existing results
-        with open('tournament_results.json', 'r') as f:
-            existing_results = json.load(f)
+        app.logger.info(f"Tournament finished in {final['seconds']:.1f}s: {new_results}")
 
-        # Update results, preserving agents with existing scores
-        for agent, score in existing_results.items():
-            if agent not in new_results:
-                new_results[agent] = round(score, 2)
+        # Agents that weren't part of this run keep their existing scores and
+        # timings.
+        with app.app_context():
+            record_tournament(final, new_results)
+            full_results = dict(leaderboard_cache.get()['standings'])
 
-        # Write updated results to JSON file
-        with open('tournament_results.json', 'w') as f:
-            json.dump(new_results, f)
+        tournament_events.publish('finished', {'results': tournament_events.state['results'], 'full_results': full_results})
 
     except Exception as e:
         app.logger.exception(f"Error running tournament: {str(e)}")
-        with open(OUTPUT_FILE, 'a') as f:
-            f.write(f"Error running tournament: {str(e)}\n")
+        tournament_events.publish('error', {'agent1': None, 'agent2': None, 'type': type(e).__name__, 'message': str(e)})
     finally:
         tournament_running = False
+        tournament_events.publish('stopped', {})
 
 # Main execution
 if __name__ == '__main__':
-    with app.app_context():
-        initialize_tournament_results()
     app.run(debug=True)
\ No newline at end of file
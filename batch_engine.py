@@ -0,0 +1,120 @@
+import collections
+
+import numpy as np
+
+import rules
+from match_archive import DRAW
+
+# Agents opt in by declaring a vectorized policy on their class:
+#
+#     class Agent:
+#         @staticmethod
+#         def vectorized_policy(opponent_last_move, loads, mirror, rng):
+#             return np.where(loads >= 1, rules.FIREBALL, rules.LOAD)
+#
+# Every argument is an array with one entry per game still in progress:
+# the opponent's last validated move code (NO_MOVE on the first round), the
+# agent's own load count and whether its mirror is still available. rng is a
+# numpy Generator for randomized strategies. The policy returns move codes
+# (see rules.MOVES); anything illegal is turned into a load exactly like
+# Match.validate_move does. A policy must behave like the agent's play() would
+# from a freshly reset agent, since the engine has no per-agent state.
+NO_MOVE = -1
+
+# LEGAL flattened so a (move, loads bucket, mirror) lookup is one take().
+LEGAL = np.array(rules.LEGAL, dtype=np.int8).reshape(-1)
+LOAD_DELTA = np.array(rules.LOAD_DELTA, dtype=np.int16)
+OUTCOME = np.array([[-1 if winner is None else winner for winner in row] for row in rules.OUTCOME], dtype=np.int8).reshape(-1)
+
+BatchResult = collections.namedtuple('BatchResult', ['outcomes', 'rounds_played', 'moves'])
+ReplayStates = collections.namedtuple('ReplayStates', ['codes1', 'codes2', 'loads1', 'loads2', 'mirror1', 'mirror2',
+                                                       'rounds_played'])
+
+def get_vectorized_policy(agent_class):
+    return getattr(agent_class, 'vectorized_policy', None)
+
+def _legal_codes(policy, opponent_last_move, loads, mirror, rng):
+    codes = np.asarray(policy(opponent_last_move, loads, mirror, rng), dtype=np.intp)
+    # Unsigned compare folds the negative and too-large checks into one.
+    codes = np.where(codes.astype(np.uintp) < len(rules.MOVES), codes, rules.INVALID)
+    # Engine loads never go negative, so only the top of the bucket is clipped.
+    return LEGAL.take(codes * 6 + np.minimum(loads, 2) * 2 + mirror)
+
+def simulate_series(policy1, policy2, num_matches=100, rounds=100, rng=None):
+    if rng is None:
+        rng = np.random.default_rng()
+    outcomes = np.full(num_matches, DRAW, dtype=np.int8)
+    rounds_played = np.full(num_matches, rounds, dtype=np.int16)
+    moves = np.zeros((num_matches, rounds), dtype=np.uint8)
+
+    # State is kept only for games still in progress and compacted whenever
+    # some of them finish; games maps each row back to its match number.
+    games = np.arange(num_matches)
+    loads1 = np.zeros(num_matches, dtype=np.int16)
+    loads2 = np.zeros(num_matches, dtype=np.int16)
+    mirror1 = np.ones(num_matches, dtype=bool)
+    mirror2 = np.ones(num_matches, dtype=bool)
+    last1 = np.full(num_matches, NO_MOVE, dtype=np.int8)
+    last2 = np.full(num_matches, NO_MOVE, dtype=np.int8)
+
+    for round_num in range(rounds):
+        if games.size == 0:
+            break
+        code1 = _legal_codes(policy1, last2, loads1, mirror1, rng)
+        code2 = _legal_codes(policy2, last1, loads2, mirror2, rng)
+
+        moves[games, round_num] = (code1 << 4) | code2
+        loads1 += LOAD_DELTA.take(code1)
+        loads2 += LOAD_DELTA.take(code2)
+        mirror1 &= code1 != rules.MIRROR
+        mirror2 &= code2 != rules.MIRROR
+        last1, last2 = code1, code2
+
+        winners = OUTCOME.take(code1 * len(rules.MOVES) + code2)
+        finished = winners >= 0
+        if finished.any():
+            done = games[finished]
+            outcomes[done] = winners[finished]
+            rounds_played[done] = round_num + 1
+            keep = ~finished
+            games = games[keep]
+            loads1, loads2 = loads1[keep], loads2[keep]
+            mirror1, mirror2 = mirror1[keep], mirror2[keep]
+            last1, last2 = last1[keep], last2[keep]
+
+    return BatchResult(outcomes, rounds_played, moves)
+
+# State after every round of already played matches, rebuilt from their packed
+# rounds (archive bytes, (code1 << 4) | code2) with the same transitions as
+# Match.run_round: loads move by LOAD_DELTA and a mirror stays available until
+# it is played. All matches go through together as one (match, round) array;
+# rows past a match's length are padding.
+def replay_states(matches):
+    rounds_played = np.array([len(rounds) for rounds in matches], dtype=np.int16)
+    moves = np.zeros((len(matches), int(rounds_played.max(initial=0))), dtype=np.uint8)
+    for row, rounds in enumerate(matches):
+        moves[row, :len(rounds)] = np.frombuffer(rounds, dtype=np.uint8)
+    codes1 = moves >> 4
+    codes2 = moves & 0x0F
+    padding = np.arange(moves.shape[1]) >= rounds_played[:, None]
+    codes1[padding] = codes2[padding] = rules.SHIELD  # changes nothing
+    return ReplayStates(codes1, codes2,
+                        np.cumsum(LOAD_DELTA.take(codes1), axis=1, dtype=np.int16),
+                        np.cumsum(LOAD_DELTA.take(codes2), axis=1, dtype=np.int16),
+                        np.cumsum(codes1 == rules.MIRROR, axis=1) == 0,
+                        np.cumsum(codes2 == rules.MIRROR, axis=1) == 0,
+                        rounds_played)
+
+def series_scores(outcomes):
+    # Summed match by match, in order, so totals match the scalar path to the
+    # last bit of float rounding on the 1.1 draw scores.
+    total_score1, total_score2 = 0, 0
+    for outcome in outcomes.tolist():
+        if outcome == 0:
+            total_score1 += 1
+        elif outcome == 1:
+            total_score2 += 1
+        else:
+            total_score1 += 1.1
+            total_score2 += 1.1
+    return total_score1, total_score2
@@ -0,0 +1,743 @@
+import argparse
+import itertools
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import match_archive
+import results_cache
+import rules
+import tournament
+import tournament_plan
+from test_rules import legacy_determine_winner, legacy_validate_move
+
+# Small synthetic field so the benchmark does not depend on whatever agents
+# happen to be submitted. Each strategy is a pure-Python play() loop, which is
+# exactly the CPU-bound work the executors are competing on.
+SYNTHETIC_AGENTS = {
+    'constant': """
+class Agent:
+    def __init__(self):
+        pass
+
+    def play(self, opponent_last_move):
+        return 'shield'
+""",
+    'random': """
+import random
+
+class Agent:
+    def __init__(self):
+        self.loads = 0
+        self.mirror = True
+
+    def play(self, opponent_last_move):
+        moves = ['shield', 'load']
+        if self.loads >= 1:
+            moves.append('fireball')
+        if self.loads >= 2:
+            moves.append('tsunami')
+        if self.mirror:
+            moves.append('mirror')
+        move = random.choice(moves)
+        if move == 'load':
+            self.loads += 1
+        elif move == 'fireball':
+            self.loads -= 1
+        elif move == 'tsunami':
+            self.loads -= 2
+        elif move == 'mirror':
+            self.mirror = False
+        return move
+""",
+    # Counters the opponent's most frequent move so far, so it keeps state
+    # that grows with the match.
+    'stateful': """
+class Agent:
+    def __init__(self):
+        self.loads = 0
+        self.mirror = True
+        self.counts = {}
+
+    def play(self, opponent_last_move):
+        if opponent_last_move is not None:
+            self.counts[opponent_last_move] = self.counts.get(opponent_last_move, 0) + 1
+        favourite = max(self.counts, key=self.counts.get) if self.counts else None
+        if favourite == 'load' and self.loads >= 1:
+            move = 'fireball'
+        elif favourite in ('fireball', 'tsunami') and self.mirror:
+            move = 'mirror'
+        elif favourite == 'shield' and self.loads >= 2:
+            move = 'tsunami'
+        elif favourite in ('fireball', 'tsunami'):
+            move = 'shield'
+        else:
+            move = 'load'
+        if move == 'load':
+            self.loads += 1
+        elif move == 'fireball':
+            self.loads -= 1
+        elif move == 'tsunami':
+            self.loads -= 2
+        elif move == 'mirror':
+            self.mirror = False
+        return move
+""",
+    # Burns CPU on every move like an agent that searches before it plays.
+    'slow': """
+class Agent:
+    def __init__(self):
+        self.loads = 0
+
+    def play(self, opponent_last_move):
+        total = 0
+        for i in range(2000):
+            total += i * i
+        if self.loads >= 1 and total % 2 == 0:
+            self.loads -= 1
+            return 'fireball'
+        self.loads += 1
+        return 'load'
+""",
+}
+# Strategies the executor and shard benchmarks use.
+DEFAULT_MIX = ('constant', 'random')
+
+# mix lists strategy names, repeated to weight them; agents are assigned
+# from it in turn.
+def write_synthetic_field(directory, size, mix=DEFAULT_MIX):
+    strategies = sorted(mix)
+    names = []
+    for i in range(size):
+        strategy = strategies[i % len(strategies)]
+        name = f"bench{i}_{strategy}_agent"
+        with open(os.path.join(directory, f"{name}.py"), 'w') as f:
+            f.write(SYNTHETIC_AGENTS[strategy])
+        names.append(name)
+    return names
+
+# Agents of graded strength for the scheduler benchmark: a counter strategy
+# that plays a uniformly random legal move with probability noise instead, so
+# the full round-robin ranking roughly follows the noise level.
+GRADED_AGENT = """
+import random
+
+class Agent:
+    noise = {noise!r}
+
+    def __init__(self):
+        self.loads = 0
+        self.mirror = True
+
+    def play(self, opponent_last_move):
+        if random.random() < self.noise:
+            moves = ['shield', 'load']
+            if self.loads >= 1:
+                moves.append('fireball')
+            if self.loads >= 2:
+                moves.append('tsunami')
+            if self.mirror:
+                moves.append('mirror')
+            move = random.choice(moves)
+        elif opponent_last_move == 'load' and self.loads >= 1:
+            move = 'fireball'
+        elif opponent_last_move == 'load' and self.mirror:
+            move = 'mirror'
+        elif opponent_last_move == 'shield' and self.loads >= 2:
+            move = 'tsunami'
+        elif opponent_last_move in ('fireball', 'tsunami'):
+            move = 'shield'
+        else:
+            move = 'load'
+        if move == 'load':
+            self.loads += 1
+        elif move == 'fireball':
+            self.loads -= 1
+        elif move == 'tsunami':
+            self.loads -= 2
+        elif move == 'mirror':
+            self.mirror = False
+        return move
+"""
+
+def write_graded_field(directory, size):
+    names = []
+    for i in range(size):
+        name = f"graded{i:03d}_agent"
+        with open(os.path.join(directory, f"{name}.py"), 'w') as f:
+            f.write(GRADED_AGENT.format(noise=i / max(size - 1, 1)))
+        names.append(name)
+    return names
+
+def bench_executor_scaling(field_size, worker_counts, executors):
+    results = []
+    original_cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as workdir:
+        write_synthetic_field(workdir, field_size)
+        sys.path.insert(0, workdir)
+        os.chdir(workdir)
+        try:
+            num_series = field_size * (field_size - 1)
+            for executor in executors:
+                for workers in worker_counts:
+                    start = time.perf_counter()
+                    tournament.main(executor=executor, max_workers=workers, use_cache=False)
+                    elapsed = time.perf_counter() - start
+                    results.append({
+                        'executor': executor,
+                        'workers': workers,
+                        'seconds': elapsed,
+                        'series_per_sec': num_series / elapsed,
+                    })
+        finally:
+            os.chdir(original_cwd)
+            sys.path.remove(workdir)
+    return results
+
+def print_scaling_table(results):
+    print(f"{'executor':<10}{'workers':>8}{'seconds':>10}{'series/s':>10}{'speedup':>9}")
+    baselines = {}
+    for row in results:
+        baseline = baselines.setdefault(row['executor'], row['seconds'])
+        print(f"{row['executor']:<10}{row['workers']:>8}{row['seconds']:>10.2f}"
+              f"{row['series_per_sec']:>10.1f}{baseline / row['seconds']:>8.2f}x")
+
+def spearman(ranking, reference):
+    position = {name: i for i, name in enumerate(reference)}
+    n = len(ranking)
+    if n < 2:
+        return 1.0
+    squared = sum((i - position[name]) ** 2 for i, name in enumerate(ranking))
+    return 1 - 6 * squared / (n * (n * n - 1))
+
+# Runs the same graded field under each scheduler and compares its ranking
+# with the full round-robin's, along with how many matches that took.
+SCHEDULER_CONFIGS = [
+    ('round-robin', {}),
+    ('adaptive', {'adaptive': True}),
+    ('swiss', {'scheduler': 'swiss'}),
+    ('swiss+adaptive', {'scheduler': 'swiss', 'adaptive': True}),
+]
+
+def bench_schedulers(field_size, num_matches, executor='process'):
+    results = []
+    original_cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as workdir:
+        write_graded_field(workdir, field_size)
+        sys.path.insert(0, workdir)
+        os.chdir(workdir)
+        try:
+            reference = None
+            for label, options in SCHEDULER_CONFIGS:
+                result = tournament.run_tournament(executor=executor, verbosity=tournament.LOG_RESULTS,
+                                                   num_matches=num_matches, use_cache=False, **options)
+                ranking = [name for name, _ in result.standings()]
+                if reference is None:
+                    reference = ranking
+                results.append({
+                    'scheduler': label,
+                    'series': len(result.series),
+                    'matches': sum(series.matches or num_matches for series in result.series),
+                    'seconds': result.seconds,
+                    'spearman': spearman(ranking, reference),
+                })
+        finally:
+            os.chdir(original_cwd)
+            sys.path.remove(workdir)
+    return results
+
+# Stands in for a multi-node run on one machine: plays a plan as a single
+# shard, then as num_shards shards in concurrent processes through the
+# tournament_plan CLI, and checks that the merged totals are identical.
+def _plan_cli(*args, cwd):
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tournament_plan.py')
+    return subprocess.Popen([sys.executable, script, *args], cwd=cwd, stdout=subprocess.DEVNULL)
+
+def _wait(processes):
+    for process in processes:
+        if process.wait() != 0:
+            raise RuntimeError(f"tournament_plan.py exited with status {process.returncode}")
+
+def bench_shards(field_size, num_shards, num_matches, workers_per_shard):
+    with tempfile.TemporaryDirectory() as workdir:
+        write_synthetic_field(workdir, field_size)
+        _wait([_plan_cli('create', '--matches', str(num_matches), '--seed', '7', cwd=workdir)])
+
+        timings = {}
+        start = time.perf_counter()
+        _wait([_plan_cli('run', 'tournament_plan.json', '--workers', str(workers_per_shard * num_shards),
+                         '--out', 'single.json', cwd=workdir)])
+        timings['single'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        shard_files = [f"shard_{k}.json" for k in range(num_shards)]
+        _wait([_plan_cli('run', 'tournament_plan.json', '--shard', str(k), '--of', str(num_shards),
+                         '--workers', str(workers_per_shard), '--out', shard_files[k], cwd=workdir)
+               for k in range(num_shards)])
+        timings['sharded'] = time.perf_counter() - start
+
+        def load(name):
+            with open(os.path.join(workdir, name)) as f:
+                return json.load(f)
+        plan = load('tournament_plan.json')
+        single = tournament_plan.merge_shards(plan, [load('single.json')])
+        merged = tournament_plan.merge_shards(plan, [load(name) for name in shard_files])
+        if single.totals != merged.totals:
+            raise AssertionError(f"merged shards disagree with the single-node run: {merged.totals} != {single.totals}")
+        return len(plan['series']), timings, merged.standings()
+
+# Resumes a tournament over agents that all have the same source from a
+# checkpoint holding some of its series, each with scores no real series can
+# produce. Only those series may come back, each credited to its own pair,
+# and every other ordered pairing must be played exactly once.
+def check_resume(field_size, num_restored, num_matches):
+    with tempfile.TemporaryDirectory() as workdir:
+        names = write_synthetic_field(workdir, field_size, ('constant',))
+        hashes = {name: results_cache.hash_agent_file(os.path.join(workdir, f"{name}.py")) for name in names}
+        pairs = [(agent1, agent2) for agent1 in names for agent2 in names if agent1 != agent2]
+        restored = {}
+        checkpoint = results_cache.Checkpoint(os.path.join(workdir, results_cache.CHECKPOINT_FILE))
+        for i, (agent1, agent2) in enumerate(random.Random(0).sample(pairs, num_restored)):
+            restored[agent1, agent2] = (1000.0 + i, 2000.0 + i)
+            checkpoint.record(hashes[agent1], hashes[agent2], num_matches,
+                              results_cache.ResultsCache.entry(agent1, agent2, *restored[agent1, agent2]))
+        checkpoint.close()
+
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tournament.py')
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(filter(None, [workdir, env.get('PYTHONPATH')]))
+        output = subprocess.run([sys.executable, script, '--resume', '--no-cache', '--events', '--log-level', 'results',
+                                 '--matches', str(num_matches)],
+                                cwd=workdir, env=env, stdout=subprocess.PIPE, check=True, text=True).stdout
+        series = [event for event in map(json.loads, output.splitlines()) if event['event'] == 'series']
+        played = sorted((event['agent1'], event['agent2']) for event in series)
+        if played != sorted(pairs):
+            raise AssertionError(f"resumed run played {len(played)} series for {len(pairs)} pairings")
+        came_back = {(event['agent1'], event['agent2']): (event['score1'], event['score2'])
+                     for event in series if event['cached']}
+        if came_back != restored:
+            raise AssertionError(f"restored {len(came_back)} series, expected {len(restored)}: {came_back}")
+        return len(pairs), len(restored)
+
+def _legacy_rounds(moves):
+    loads1 = loads2 = 0
+    mirror1 = mirror2 = True
+    for move1, move2 in moves:
+        move1 = legacy_validate_move(move1, loads1, mirror1)
+        move2 = legacy_validate_move(move2, loads2, mirror2)
+        if move1 == 'load':
+            loads1 += 1
+        if move2 == 'load':
+            loads2 += 1
+        if move1 == 'fireball':
+            loads1 -= 1
+        if move2 == 'fireball':
+            loads2 -= 1
+        if move1 == 'tsunami':
+            loads1 -= 2
+        if move2 == 'tsunami':
+            loads2 -= 2
+        if move1 == 'mirror':
+            mirror1 = False
+        if move2 == 'mirror':
+            mirror2 = False
+        if legacy_determine_winner(move1, move2) is not None:
+            loads1 = loads2 = 0
+            mirror1 = mirror2 = True
+
+def _table_rounds(moves):
+    legal_move = rules.legal_move
+    load_delta = rules.LOAD_DELTA
+    outcome = rules.OUTCOME
+    mirror_code = rules.MIRROR
+    loads1 = loads2 = 0
+    mirror1 = mirror2 = True
+    for move1, move2 in moves:
+        code1 = legal_move(move1, loads1, mirror1)
+        code2 = legal_move(move2, loads2, mirror2)
+        loads1 += load_delta[code1]
+        loads2 += load_delta[code2]
+        if code1 == mirror_code:
+            mirror1 = False
+        if code2 == mirror_code:
+            mirror2 = False
+        if outcome[code1][code2] is not None:
+            loads1 = loads2 = 0
+            mirror1 = mirror2 = True
+
+def bench_rules(num_rounds):
+    rng = random.Random(0)
+    moves = [(rng.choice(rules.MOVES), rng.choice(rules.MOVES)) for _ in range(num_rounds)]
+    results = {}
+    for label, func in (('legacy', _legacy_rounds), ('table', _table_rounds)):
+        start = time.perf_counter()
+        func(moves)
+        results[label] = num_rounds / (time.perf_counter() - start)
+    return results
+
+# Scripted agents that implement both play() and the equivalent vectorized
+# policy, so the scalar and batch paths can be compared on the same pairing.
+class ShieldAgent:
+    def __init__(self):
+        pass
+
+    def play(self, opponent_last_move):
+        return 'shield'
+
+    @staticmethod
+    def vectorized_policy(opponent_last_move, loads, mirror, rng):
+        return rules.SHIELD
+
+class ChargeAgent:
+    def __init__(self):
+        self.loads = 0
+
+    def play(self, opponent_last_move):
+        if self.loads >= 2:
+            self.loads -= 2
+            return 'tsunami'
+        self.loads += 1
+        return 'load'
+
+    @staticmethod
+    def vectorized_policy(opponent_last_move, loads, mirror, rng):
+        return np.where(loads >= 2, rules.TSUNAMI, rules.LOAD)
+
+class CounterAgent:
+    def __init__(self):
+        self.loads = 0
+        self.mirror = True
+
+    def play(self, opponent_last_move):
+        if opponent_last_move == 'load' and self.mirror:
+            self.mirror = False
+            return 'mirror'
+        if opponent_last_move == 'shield' and self.loads >= 1:
+            self.loads -= 1
+            return 'fireball'
+        self.loads += 1
+        return 'load'
+
+    @staticmethod
+    def vectorized_policy(opponent_last_move, loads, mirror, rng):
+        fireball = np.where((opponent_last_move == rules.SHIELD) & (loads >= 1), rules.FIREBALL, rules.LOAD)
+        return np.where((opponent_last_move == rules.LOAD) & mirror, rules.MIRROR, fireball)
+
+BATCH_AGENTS = [ShieldAgent, ChargeAgent, CounterAgent]
+
+def _scalar_only(agent_class):
+    return type(agent_class.__name__, (agent_class,), {'vectorized_policy': None, '__module__': agent_class.__module__})
+
+def _archived_series(agent_class1, agent_class2, num_matches):
+    recorder = match_archive.SeriesRecorder('a', 'b')
+    scores = tournament.run_match_series(agent_class1, agent_class2, num_matches, recorder=recorder)
+    return scores, recorder.records
+
+def bench_batch(num_matches, repeats):
+    tournament.set_log_level(tournament.LOG_RESULTS)
+    results = []
+    for agent_class1, agent_class2 in itertools.permutations(BATCH_AGENTS, 2):
+        scalar1, scalar2 = _scalar_only(agent_class1), _scalar_only(agent_class2)
+        scalar_scores, scalar_records = _archived_series(scalar1, scalar2, num_matches)
+        batch_scores, batch_records = _archived_series(agent_class1, agent_class2, num_matches)
+        if scalar_scores != batch_scores or scalar_records != batch_records:
+            raise AssertionError(f"batch engine disagrees with Match for {agent_class1.__name__} vs {agent_class2.__name__}")
+
+        timings = {}
+        for label, pair in (('scalar', (scalar1, scalar2)), ('batch', (agent_class1, agent_class2))):
+            start = time.perf_counter()
+            for _ in range(repeats):
+                tournament.run_match_series(*pair, num_matches)
+            timings[label] = (time.perf_counter() - start) / repeats
+        results.append((f"{agent_class1.__name__} vs {agent_class2.__name__}", timings))
+    return results
+
+# End-to-end suite: a synthetic field of the given size and strategy mix is
+# played through tournament.run_tournament once per executor, each run in its
+# own process (the 'measure' subcommand) so peak RSS and I/O counts belong to
+# that run alone. Match.run and run_match_series are also timed in-process on
+# every pair of strategies in the mix. Results are appended to a JSON-lines
+# history and compared with the last run of the same configuration.
+BENCHMARK_HISTORY = 'benchmark_history.jsonl'
+# A metric this much worse than the baseline is flagged as a regression.
+REGRESSION_THRESHOLD = 0.10
+# Metrics compared with the baseline. Match and round counts vary with the
+# random agents' play and are only recorded.
+COMPARED_METRICS = ('matches_per_sec', 'rounds_per_sec', 'wall_seconds', 'peak_rss_mb', 'read_calls', 'write_calls',
+                    'block_reads', 'block_writes', 'match_run_rounds_per_sec', 'match_series_matches_per_sec')
+# Where higher is better; for the rest (seconds, RSS, I/O) lower is.
+HIGHER_IS_BETTER = ('matches_per_sec', 'rounds_per_sec')
+
+def parse_mix(spec):
+    mix = []
+    for part in spec.split(','):
+        strategy, _, weight = part.partition('=')
+        if strategy not in SYNTHETIC_AGENTS:
+            raise ValueError(f"Unknown strategy '{strategy}', expected one of: {', '.join(SYNTHETIC_AGENTS)}")
+        mix += [strategy] * int(weight or 1)
+    return mix
+
+# read/write syscalls and bytes of this process (Linux only).
+def _process_io():
+    try:
+        with open('/proc/self/io') as f:
+            fields = dict(line.split(': ') for line in f.read().splitlines())
+    except OSError:
+        return {}
+    return {'read_calls': int(fields['syscr']), 'write_calls': int(fields['syscw']),
+            'read_bytes': int(fields['rchar']), 'write_bytes': int(fields['wchar'])}
+
+# Runs in a fresh process inside the field's directory: plays the tournament
+# and reports what it took.
+def measure_tournament(executor, workers, num_matches, verbosity):
+    import resource
+    io_before = _process_io()
+    start = time.perf_counter()
+    result = tournament.run_tournament(executor=executor, max_workers=workers, verbosity=verbosity,
+                                       num_matches=num_matches, use_cache=False)
+    seconds = time.perf_counter() - start
+    matches = rounds = 0
+    with match_archive.MatchArchive() as archive:
+        for agent1, agent2 in archive.pairs():
+            summaries = archive.match_summaries(agent1, agent2)
+            matches += len(summaries)
+            rounds += sum(num_rounds for _, num_rounds in summaries)
+    io_after = _process_io()
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return {
+        'seconds': seconds,
+        'matches': matches,
+        'rounds': rounds,
+        'matches_per_sec': matches / seconds,
+        'rounds_per_sec': rounds / seconds,
+        # ru_maxrss is in KiB on Linux; children is the largest pool worker.
+        'peak_rss_mb': max(usage.ru_maxrss, children.ru_maxrss) / 1024,
+        'block_reads': usage.ru_inblock + children.ru_inblock,
+        'block_writes': usage.ru_oublock + children.ru_oublock,
+        **{key: io_after[key] - io_before[key] for key in io_after},
+        'errors': len(result.errors),
+    }
+
+def _measure_in_subprocess(workdir, executor, workers, num_matches, log_level):
+    here = os.path.dirname(os.path.abspath(__file__))
+    command = [sys.executable, os.path.abspath(__file__), 'measure', '--executor', executor,
+               '--matches', str(num_matches), '--log-level', log_level]
+    if workers:
+        command += ['--workers', str(workers)]
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [workdir, here, env.get('PYTHONPATH')]))
+    start = time.perf_counter()
+    output = subprocess.run(command, cwd=workdir, env=env, stdout=subprocess.PIPE, check=True, text=True).stdout
+    wall = time.perf_counter() - start
+    return {**json.loads(output.splitlines()[-1]), 'wall_seconds': wall}
+
+def bench_match_loop(mix, num_matches):
+    tournament.set_log_level(tournament.LOG_RESULTS)
+    namespaces = {}
+    for strategy in sorted(set(mix)):
+        namespaces[strategy] = {}
+        exec(SYNTHETIC_AGENTS[strategy], namespaces[strategy])
+    match_seconds = series_seconds = 0.0
+    matches = rounds = 0
+    for strategy1, strategy2 in itertools.product(sorted(namespaces), repeat=2):
+        agent_class1, agent_class2 = namespaces[strategy1]['Agent'], namespaces[strategy2]['Agent']
+        match = tournament.Match(agent_class1(), agent_class2())
+        start = time.perf_counter()
+        for _ in range(num_matches):
+            match.run()
+            rounds += len(match.rounds)
+        match_seconds += time.perf_counter() - start
+        start = time.perf_counter()
+        tournament.run_match_series(agent_class1, agent_class2, num_matches)
+        series_seconds += time.perf_counter() - start
+        matches += num_matches
+    return {'match_run_rounds_per_sec': rounds / match_seconds,
+            'match_series_matches_per_sec': matches / series_seconds}
+
+def bench_suite(field_size, mix, executors, workers, num_matches, log_level):
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        write_synthetic_field(workdir, field_size, mix)
+        for executor in executors:
+            results[executor] = _measure_in_subprocess(workdir, executor, workers, num_matches, log_level)
+    results['match_loop'] = bench_match_loop(mix, num_matches)
+    return results
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+def load_history(path=BENCHMARK_HISTORY):
+    try:
+        with open(path) as f:
+            return [json.loads(line) for line in f if line.strip()]
+    except FileNotFoundError:
+        return []
+
+def append_history(entry, path=BENCHMARK_HISTORY):
+    with open(path, 'a') as f:
+        f.write(json.dumps(entry, sort_keys=True) + '\n')
+
+# The most recent earlier run with the same configuration, or the one tagged
+# with label if given.
+def find_baseline(history, config, label=None):
+    for entry in reversed(history):
+        if label is not None:
+            if entry.get('label') == label:
+                return entry
+        elif entry['config'] == config:
+            return entry
+    return None
+
+# [(mode, metric, baseline, current, relative change, regressed)] for every
+# metric both runs have.
+def compare_runs(baseline, current, threshold=REGRESSION_THRESHOLD):
+    rows = []
+    for mode, metrics in current['results'].items():
+        for metric, value in metrics.items():
+            old = baseline['results'].get(mode, {}).get(metric)
+            if metric not in COMPARED_METRICS or not old:
+                continue
+            change = (value - old) / old
+            worse = -change if metric.endswith(HIGHER_IS_BETTER) else change
+            rows.append((mode, metric, old, value, change, worse > threshold))
+    return rows
+
+def print_suite(results):
+    print(f"{'mode':<10}{'matches/s':>11}{'rounds/s':>12}{'wall s':>9}{'peak MB':>9}{'reads':>9}{'writes':>9}")
+    for mode, metrics in results.items():
+        if mode == 'match_loop':
+            continue
+        print(f"{mode:<10}{metrics['matches_per_sec']:>11,.0f}{metrics['rounds_per_sec']:>12,.0f}"
+              f"{metrics['wall_seconds']:>9.2f}{metrics['peak_rss_mb']:>9.1f}"
+              f"{metrics.get('read_calls', 0):>9}{metrics.get('write_calls', 0):>9}")
+    loop = results['match_loop']
+    print(f"Match.run: {loop['match_run_rounds_per_sec']:,.0f} rounds/s; "
+          f"run_match_series: {loop['match_series_matches_per_sec']:,.0f} matches/s")
+
+def main():
+    parser = argparse.ArgumentParser(description="Tournament performance benchmarks.")
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    executors_parser = subparsers.add_parser('executors', help="tournament throughput as the worker count grows")
+    executors_parser.add_argument('--agents', type=int, default=8, help="size of the synthetic agent field")
+    executors_parser.add_argument('--workers', type=int, nargs='+',
+                                  default=sorted({1, 2, 4, os.cpu_count() or 1}),
+                                  help="worker counts to measure")
+    executors_parser.add_argument('--executor', choices=sorted(tournament.EXECUTORS), nargs='+',
+                                  default=['thread', 'process'])
+
+    rules_parser = subparsers.add_parser('rules', help="time the rules tables against the legacy rules")
+    rules_parser.add_argument('--rounds', type=int, default=1_000_000)
+
+    batch_parser = subparsers.add_parser('batch', help="check the NumPy batch engine against Match and time a series")
+    batch_parser.add_argument('--matches', type=int, default=100)
+    batch_parser.add_argument('--repeats', type=int, default=20)
+
+    schedulers_parser = subparsers.add_parser('schedulers',
+                                              help="matches needed by each scheduler and how close its ranking gets to round-robin")
+    schedulers_parser.add_argument('--agents', type=int, default=24, help="size of the graded agent field")
+    schedulers_parser.add_argument('--matches', type=int, default=100)
+    schedulers_parser.add_argument('--executor', choices=sorted(tournament.EXECUTORS), default='process')
+
+    shards_parser = subparsers.add_parser('shards', help="play a plan as one shard and as M concurrent shards and compare")
+    shards_parser.add_argument('--agents', type=int, default=8, help="size of the synthetic agent field")
+    shards_parser.add_argument('--shards', type=int, default=4)
+    shards_parser.add_argument('--matches', type=int, default=100)
+    shards_parser.add_argument('--workers', type=int, default=1, help="process pool size per shard")
+
+    suite_parser = subparsers.add_parser('suite', help="end-to-end throughput, memory and I/O per executor, "
+                                                       "recorded in a history and compared with a baseline")
+    suite_parser.add_argument('--agents', type=int, default=8, help="size of the synthetic agent field")
+    suite_parser.add_argument('--mix', default='constant,random,stateful,slow',
+                              help="strategies in the field, e.g. constant=2,random=1,slow=1")
+    suite_parser.add_argument('--executor', choices=sorted(tournament.EXECUTORS), nargs='+',
+                              default=sorted(tournament.EXECUTORS))
+    suite_parser.add_argument('--workers', type=int, default=None, help="pool size (default: os.cpu_count())")
+    suite_parser.add_argument('--matches', type=int, default=100)
+    suite_parser.add_argument('--log-level', choices=list(tournament.LOG_LEVELS), default='series')
+    suite_parser.add_argument('--history', default=BENCHMARK_HISTORY)
+    suite_parser.add_argument('--label', default=None, help="name this run so later runs can use it as a baseline")
+    suite_parser.add_argument('--baseline', default=None, metavar='LABEL',
+                              help="compare with the run with this label instead of the last matching one")
+    suite_parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD)
+    suite_parser.add_argument('--no-record', action='store_true', help="compare without appending to the history")
+
+    resume_parser = subparsers.add_parser('resume', help="check that a resumed tournament over agents with "
+                                                         "identical source restores exactly its checkpointed series")
+    resume_parser.add_argument('--agents', type=int, default=6, help="size of the synthetic agent field")
+    resume_parser.add_argument('--restored', type=int, default=9, help="series in the checkpoint")
+    resume_parser.add_argument('--matches', type=int, default=10)
+
+    # Used by the suite to run one executor in a fresh process.
+    measure_parser = subparsers.add_parser('measure')
+    measure_parser.add_argument('--executor', choices=sorted(tournament.EXECUTORS), default='thread')
+    measure_parser.add_argument('--workers', type=int, default=None)
+    measure_parser.add_argument('--matches', type=int, default=100)
+    measure_parser.add_argument('--log-level', choices=list(tournament.LOG_LEVELS), default='series')
+
+    args = parser.parse_args()
+
+    if args.benchmark == 'executors':
+        results = bench_executor_scaling(args.agents, args.workers, args.executor)
+        print_scaling_table(results)
+    elif args.benchmark == 'rules':
+        for label, rounds_per_sec in bench_rules(args.rounds).items():
+            print(f"{label:<8}{rounds_per_sec:>14,.0f} rounds/s")
+    elif args.benchmark == 'batch':
+        print(f"{'pairing':<28}{'scalar ms':>10}{'batch ms':>10}")
+        for pairing, timings in bench_batch(args.matches, args.repeats):
+            print(f"{pairing:<28}{timings['scalar'] * 1000:>10.2f}{timings['batch'] * 1000:>10.2f}")
+    elif args.benchmark == 'shards':
+        num_series, timings, standings = bench_shards(args.agents, args.shards, args.matches, args.workers)
+        print(f"{num_series} series: single node {timings['single']:.2f}s, "
+              f"{args.shards} shards {timings['sharded']:.2f}s, merged totals identical")
+        for agent_name, score in standings:
+            print(f"{agent_name}: {score} points")
+    elif args.benchmark == 'resume':
+        num_series, num_restored = check_resume(args.agents, args.restored, args.matches)
+        print(f"{num_series} series: {num_restored} restored from the checkpoint to their own pairs, "
+              f"the rest played once each")
+    elif args.benchmark == 'measure':
+        tournament.set_log_level(tournament.LOG_LEVELS[args.log_level])
+        print(json.dumps(measure_tournament(args.executor, args.workers, args.matches,
+                                            tournament.LOG_LEVELS[args.log_level])))
+    elif args.benchmark == 'suite':
+        mix = parse_mix(args.mix)
+        config = {'agents': args.agents, 'mix': args.mix, 'executors': args.executor, 'workers': args.workers,
+                  'matches': args.matches, 'log_level': args.log_level, 'cpu_count': os.cpu_count()}
+        entry = {'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'commit': _git_commit(), 'label': args.label,
+                 'python': sys.version.split()[0], 'config': config,
+                 'results': bench_suite(args.agents, mix, args.executor, args.workers, args.matches, args.log_level)}
+        print_suite(entry['results'])
+        baseline = find_baseline(load_history(args.history), config, args.baseline)
+        if baseline is None:
+            print("No baseline with this configuration yet")
+        else:
+            rows = compare_runs(baseline, entry, args.threshold)
+            print(f"\nAgainst {baseline['commit'] or 'unknown commit'} ({baseline['time']}):")
+            for mode, metric, old, new, change, regressed in rows:
+                flag = '  REGRESSION' if regressed else ''
+                print(f"{mode:<12}{metric:<30}{old:>14,.2f}{new:>14,.2f}{change:>+9.1%}{flag}")
+        if not args.no_record:
+            append_history(entry, args.history)
+    elif args.benchmark == 'schedulers':
+        results = bench_schedulers(args.agents, args.matches, args.executor)
+        full = results[0]['matches']
+        print(f"{'scheduler':<16}{'series':>8}{'matches':>9}{'of full':>9}{'seconds':>9}{'spearman':>10}")
+        for row in results:
+            print(f"{row['scheduler']:<16}{row['series']:>8}{row['matches']:>9}{row['matches'] / full:>8.1%}"
+                  f"{row['seconds']:>9.2f}{row['spearman']:>10.3f}")
+
+if __name__ == '__main__':
+    main()
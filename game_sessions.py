@@ -0,0 +1,185 @@
+import importlib
+import secrets
+import sys
+import threading
+import time
+
+import latency
+import rules
+from user_vs_agent_tournament import Match
+
+# Server side of human-vs-agent games in the web app. Every player has a
+# session holding one user_vs_agent_tournament.Match; a move is a dict lookup,
+# one play() call and the table-driven rules, all under the session's own
+# lock, so players never wait on each other and the Flask worker threads are
+# the only thread pool needed.
+#
+# Agent instances come from a pool per agent module: starting a game takes an
+# idle instance instead of importing and constructing one, and finishing it
+# resets the instance as a tournament does between games (latency.reset_agent)
+# and puts it back. Sessions that go quiet are expired, and their agents
+# returned, on the next session start after SWEEP_INTERVAL.
+ROUNDS = 100
+SESSION_IDLE_SECONDS = 600
+SWEEP_INTERVAL = 30
+MAX_SESSIONS = 10000
+MAX_IDLE_AGENTS = 64  # per agent module
+
+class SessionError(Exception):
+    pass
+
+class UnknownSession(SessionError):
+    pass
+
+class TooManySessions(SessionError):
+    pass
+
+class AgentPool:
+    def __init__(self, max_idle=MAX_IDLE_AGENTS):
+        self.max_idle = max_idle
+        self.created = 0
+        self._classes = {}
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def _agent_class(self, module_name):
+        agent_class = self._classes.get(module_name)
+        if agent_class is None:
+            importlib.invalidate_caches()
+            module = sys.modules.get(module_name)
+            module = importlib.reload(module) if module is not None else importlib.import_module(module_name)
+            agent_class = self._classes[module_name] = module.Agent
+        return agent_class
+
+    def acquire(self, module_name):
+        with self._lock:
+            idle = self._idle.get(module_name)
+            if idle:
+                return idle.pop()
+            agent_class = self._agent_class(module_name)
+            self.created += 1
+        return agent_class()
+
+    # Resets a finished game's agent and keeps it for the next one. An agent
+    # whose module changed since (see invalidate()) or whose reset raises is
+    # dropped instead.
+    def release(self, module_name, agent):
+        try:
+            latency.reset_agent(agent)
+        except Exception:
+            return
+        with self._lock:
+            idle = self._idle.setdefault(module_name, [])
+            if type(agent) is self._classes.get(module_name) and len(idle) < self.max_idle:
+                idle.append(agent)
+
+    # Call when an agent's file is edited or deleted: the next game imports
+    # the module again.
+    def invalidate(self, module_name):
+        with self._lock:
+            self._classes.pop(module_name, None)
+            self._idle.pop(module_name, None)
+
+class GameSession:
+    __slots__ = ('id', 'agent_name', 'match', 'lock', 'last_active', 'outcome')
+
+    def __init__(self, session_id, agent_name, match):
+        self.id = session_id
+        self.agent_name = agent_name
+        self.match = match
+        self.lock = threading.Lock()
+        self.last_active = time.monotonic()
+        self.outcome = None  # 'user', 'agent' or 'draw' once the match is over
+
+    def state(self):
+        match = self.match
+        return {
+            'session': self.id,
+            'agent': self.agent_name,
+            'round': match.rounds_played + 1,
+            'user_loads': match.user_loads,
+            'agent_loads': match.agent_loads,
+            'user_mirror': match.user_mirror,
+            'agent_mirror': match.agent_mirror,
+            'outcome': self.outcome,
+        }
+
+class SessionManager:
+    def __init__(self, pool=None, idle_seconds=SESSION_IDLE_SECONDS, max_sessions=MAX_SESSIONS, move_budget=None):
+        self.pool = pool or AgentPool()
+        self.idle_seconds = idle_seconds
+        self.max_sessions = max_sessions
+        self.move_budget = move_budget
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._last_sweep = time.monotonic()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def start(self, agent_name):
+        now = time.monotonic()
+        if now - self._last_sweep > SWEEP_INTERVAL:
+            self.expire(now)
+        if len(self._sessions) >= self.max_sessions:
+            raise TooManySessions("Too many games in progress, try again later")
+        session = GameSession(secrets.token_urlsafe(12), agent_name,
+                              Match(self.pool.acquire(agent_name), self.move_budget))
+        with self._lock:
+            self._sessions[session.id] = session
+        return session
+
+    def get(self, session_id):
+        session = self._sessions.get(session_id)
+        if session is None:
+            raise UnknownSession(f"No game {session_id!r} in progress")
+        return session
+
+    # Plays one round and returns the moves as played, the outcome (None
+    # while the match goes on) and the state after the round. A finished
+    # match's session is closed straight away.
+    def play(self, session_id, user_move):
+        session = self.get(session_id)
+        with session.lock:
+            if session.outcome is not None:
+                raise UnknownSession(f"Game {session_id!r} is over")
+            try:
+                winner, user_move, agent_move = session.match.run_round(user_move)
+            except Exception:
+                # The agent raised; it forfeits, as its instance can't be
+                # trusted back in the pool.
+                winner, user_move, agent_move = 0, rules.validate_move(user_move, session.match.user_loads,
+                                                                       session.match.user_mirror), None
+                session.match.agent = None
+            if winner == 0:
+                session.outcome = 'user'
+            elif winner == 1:
+                session.outcome = 'agent'
+            elif session.match.rounds_played >= ROUNDS:
+                session.outcome = 'draw'
+            session.last_active = time.monotonic()
+            result = {'user_move': user_move, 'agent_move': agent_move, **session.state()}
+        if session.outcome is not None:
+            self.end(session_id)
+        return result
+
+    def end(self, session_id):
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+        if session is not None:
+            # Waits for a move in progress before the agent goes back.
+            with session.lock:
+                agent, session.match.agent = session.match.agent, None
+            if agent is not None:
+                self.pool.release(session.agent_name, agent)
+        return session
+
+    def expire(self, now=None):
+        now = time.monotonic() if now is None else now
+        self._last_sweep = now
+        with self._lock:
+            expired = [session_id for session_id, session in self._sessions.items()
+                       if now - session.last_active > self.idle_seconds]
+        for session_id in expired:
+            self.end(session_id)
+        return len(expired)
@@ -0,0 +1,128 @@
+import time
+
+# Log2-bucketed latency histogram: bucket i counts calls that took less than
+# 2**i nanoseconds (and at least 2**(i-1)). Cheap to record, small to pickle
+# back from worker processes and trivially mergeable across series.
+NUM_BUCKETS = 64
+
+class LatencyStats:
+    __slots__ = ('calls', 'total_ns', 'max_ns', 'buckets')
+
+    def __init__(self):
+        self.calls = 0
+        self.total_ns = 0
+        self.max_ns = 0
+        self.buckets = [0] * NUM_BUCKETS
+
+    def record(self, ns):
+        self.calls += 1
+        self.total_ns += ns
+        if ns > self.max_ns:
+            self.max_ns = ns
+        self.buckets[min(ns.bit_length(), NUM_BUCKETS - 1)] += 1
+
+    def merge(self, other):
+        self.calls += other.calls
+        self.total_ns += other.total_ns
+        self.max_ns = max(self.max_ns, other.max_ns)
+        for i, count in enumerate(other.buckets):
+            self.buckets[i] += count
+        return self
+
+    # Upper bound of the bucket holding the q-th quantile, capped at the
+    # observed maximum, so it is at most 2x off and never above max.
+    def percentile_ns(self, q):
+        if not self.calls:
+            return 0
+        rank = q * self.calls
+        seen = 0
+        for i, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= rank:
+                return min(1 << i, self.max_ns)
+        return self.max_ns
+
+    def summary(self):
+        return {
+            'calls': self.calls,
+            'mean_ms': self.total_ns / self.calls / 1e6 if self.calls else 0.0,
+            'p50_ms': self.percentile_ns(0.50) / 1e6,
+            'p99_ms': self.percentile_ns(0.99) / 1e6,
+            'max_ms': self.max_ns / 1e6,
+        }
+
+    def to_dict(self):
+        return {
+            'calls': self.calls,
+            'total_ns': self.total_ns,
+            'max_ns': self.max_ns,
+            'buckets': {str(i): count for i, count in enumerate(self.buckets) if count},
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        stats = cls()
+        stats.calls = data['calls']
+        stats.total_ns = data['total_ns']
+        stats.max_ns = data['max_ns']
+        for i, count in data['buckets'].items():
+            stats.buckets[int(i)] = count
+        return stats
+
+# Everything measured for one side of a series (or, merged, for one agent over
+# a whole tournament): play() latency, __init__() reset cost and the number of
+# rounds forfeited for going over the move budget.
+class AgentTimings:
+    __slots__ = ('play', 'reset', 'forfeits')
+
+    def __init__(self):
+        self.play = LatencyStats()
+        self.reset = LatencyStats()
+        self.forfeits = 0
+
+    def merge(self, other):
+        self.play.merge(other.play)
+        self.reset.merge(other.reset)
+        self.forfeits += other.forfeits
+        return self
+
+    def summary(self):
+        return {'play': self.play.summary(), 'reset': self.reset.summary(), 'forfeits': self.forfeits}
+
+    def to_dict(self):
+        return {'play': self.play.to_dict(), 'reset': self.reset.to_dict(), 'forfeits': self.forfeits}
+
+    @classmethod
+    def from_dict(cls, data):
+        timings = cls()
+        timings.play = LatencyStats.from_dict(data['play'])
+        timings.reset = LatencyStats.from_dict(data['reset'])
+        timings.forfeits = data['forfeits']
+        return timings
+
+# Agent reset protocol, used wherever an agent instance is reused for another
+# game: a class that sets stateless = True is reused as it is, one that names
+# a method in reset_between_matches (e.g. 'reset') has that called, and any
+# other is __init__()ed again. Both are opt-in, so a method that happens to be
+# called reset() is never picked up by itself. Returns the call that resets
+# the agent, or None when there is nothing to do.
+def reset_method(agent):
+    agent_class = type(agent)
+    if getattr(agent_class, 'stateless', False):
+        return None
+    name = getattr(agent_class, 'reset_between_matches', None)
+    if name is not None:
+        return getattr(agent, name)
+    return agent.__init__
+
+def reset_agent(agent):
+    reset = reset_method(agent)
+    if reset is not None:
+        reset()
+
+def timed_reset(agent, timings):
+    reset = reset_method(agent)
+    if reset is not None:
+        start = time.perf_counter_ns()
+        reset()
+        timings.reset.record(time.perf_counter_ns() - start)
@@ -0,0 +1,352 @@
+import argparse
+import collections
+import os
+import struct
+import threading
+
+import profiling
+from rules import MOVES
+
+# One archive per tournament, written append-only:
+#
+#   file header   FBMA, version
+#   segment *     SEG1, segment length, match count, agent/class names,
+#                 match offset table, then one record per match
+#   index         FIDX, block length, (agent1, agent2, segment offset) entries
+#   trailer       index offset, FEND
+#
+# A match record is its outcome, its round count and one byte per round with
+# both players' validated move codes packed as nibbles. The index and trailer
+# are only written on close; if they are missing (crash) or stale (the archive
+# was appended to again) the reader rebuilds the index by walking segments.
+#
+# Replaying a series appends a new segment and leaves the old one behind, so a
+# writer that finds more than COMPACT_DEAD_FRACTION of its segment bytes
+# unindexed on close copies the indexed segments into a fresh file and renames
+# it over the archive.
+FILE_MAGIC = b'FBMA'
+FILE_VERSION = 1
+SEGMENT_MAGIC = b'SEG1'
+INDEX_MAGIC = b'FIDX'
+TRAILER_MAGIC = b'FEND'
+
+FILE_HEADER = struct.Struct('<4sHH')
+BLOCK_HEADER = struct.Struct('<4sI')
+SEGMENT_COUNT = struct.Struct('<I')
+NAME_LENGTH = struct.Struct('<H')
+OFFSET = struct.Struct('<I')
+MATCH_HEADER = struct.Struct('<BH')
+INDEX_ENTRY_OFFSET = struct.Struct('<Q')
+TRAILER = struct.Struct('<Q4s')
+
+AGENT1_WINS, AGENT2_WINS, DRAW = 0, 1, 2
+OUTCOME_SCORES = {AGENT1_WINS: (1, 0), AGENT2_WINS: (0, 1), DRAW: (1.1, 1.1)}
+
+DEFAULT_ARCHIVE = os.path.join('match_results', 'tournament.fbma')
+COMPACT_DEAD_FRACTION = 0.25
+
+MatchRecord = collections.namedtuple(
+    'MatchRecord', ['agent1', 'agent2', 'class1', 'class2', 'moves', 'outcome', 'score1', 'score2'])
+
+def pack_round(code1, code2):
+    return (code1 << 4) | code2
+
+def _pack_name(name):
+    encoded = name.encode('utf-8')
+    return NAME_LENGTH.pack(len(encoded)) + encoded
+
+def _unpack_name(buffer, offset):
+    (length,) = NAME_LENGTH.unpack_from(buffer, offset)
+    offset += NAME_LENGTH.size
+    return buffer[offset:offset + length].decode('utf-8'), offset + length
+
+# Collects one series worth of matches and serializes it as a segment. Lives in
+# whichever thread or process plays the series; only the bytes travel back.
+class SeriesRecorder:
+    def __init__(self, agent1, agent2, class1='Agent', class2='Agent'):
+        self.names = (agent1, agent2, class1, class2)
+        self.records = []
+        self.outcomes = []
+
+    def add_match(self, rounds, outcome):
+        self.records.append(MATCH_HEADER.pack(outcome, len(rounds)) + bytes(rounds))
+        self.outcomes.append(outcome)
+
+    def segment(self):
+        names = b''.join(_pack_name(name) for name in self.names)
+        table_start = BLOCK_HEADER.size + SEGMENT_COUNT.size + len(names)
+        offset = table_start + OFFSET.size * len(self.records)
+        table = bytearray()
+        for record in self.records:
+            table += OFFSET.pack(offset)
+            offset += len(record)
+        return b''.join([
+            BLOCK_HEADER.pack(SEGMENT_MAGIC, offset),
+            SEGMENT_COUNT.pack(len(self.records)),
+            names,
+            bytes(table),
+            *self.records,
+        ])
+
+class ArchiveWriter:
+    def __init__(self, path=DEFAULT_ARCHIVE, truncate=True):
+        self.path = path
+        self.index = {}
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        data_end = None
+        if not truncate and os.path.exists(path) and os.path.getsize(path) > 0:
+            try:
+                with MatchArchive(path) as existing:
+                    self.index = dict(existing.index)
+                    data_end = existing.data_end
+            except (ValueError, struct.error):
+                data_end = None  # not a usable archive; start a fresh one
+        if data_end is not None:
+            # Drop the old index/trailer (or a torn tail) so segments stay
+            # contiguous; close() writes a fresh index covering everything.
+            self._file = open(path, 'r+b')
+            self._file.truncate(data_end)
+            self._file.seek(data_end)
+        else:
+            self._file = open(path, 'w+b')
+            self._file.write(FILE_HEADER.pack(FILE_MAGIC, FILE_VERSION, 0))
+
+    def append_segment(self, agent1, agent2, segment):
+        with profiling.locked(self._lock, 'archive'):
+            offset = self._file.tell()
+            self._file.write(segment)
+            self._file.flush()
+            self.index[(agent1, agent2)] = offset
+        return offset
+
+    # Forget series that are no longer part of the tournament (for example a
+    # deleted agent's) so the next index only covers the given pairs.
+    def retain(self, pairs):
+        pairs = set(pairs)
+        with profiling.locked(self._lock, 'archive'):
+            self.index = {pair: offset for pair, offset in self.index.items() if pair in pairs}
+
+    def _segment_length(self, offset):
+        self._file.seek(offset)
+        _, length = BLOCK_HEADER.unpack(self._file.read(BLOCK_HEADER.size))
+        return length
+
+    def _write_index(self, f, index):
+        index_offset = f.tell()
+        entries = bytearray(SEGMENT_COUNT.pack(len(index)))
+        for (agent1, agent2), offset in index.items():
+            entries += _pack_name(agent1) + _pack_name(agent2) + INDEX_ENTRY_OFFSET.pack(offset)
+        f.write(BLOCK_HEADER.pack(INDEX_MAGIC, BLOCK_HEADER.size + len(entries)))
+        f.write(entries)
+        f.write(TRAILER.pack(index_offset, TRAILER_MAGIC))
+
+    # Copies the indexed segments, in file order, into a fresh archive that
+    # replaces this one.
+    def _compact(self, lengths):
+        temp_path = f"{self.path}.tmp"
+        index = {}
+        with open(temp_path, 'wb') as f:
+            f.write(FILE_HEADER.pack(FILE_MAGIC, FILE_VERSION, 0))
+            for pair, offset in sorted(self.index.items(), key=lambda item: item[1]):
+                self._file.seek(offset)
+                index[pair] = f.tell()
+                f.write(self._file.read(lengths[pair]))
+            self._write_index(f, index)
+        self._file.close()
+        os.replace(temp_path, self.path)
+        self.index = index
+
+    def close(self):
+        with profiling.locked(self._lock, 'archive'):
+            if self._file.closed:
+                return
+            data_end = self._file.tell()
+            lengths = {pair: self._segment_length(offset) for pair, offset in self.index.items()}
+            segment_bytes = data_end - FILE_HEADER.size
+            if segment_bytes - sum(lengths.values()) > COMPACT_DEAD_FRACTION * segment_bytes:
+                self._compact(lengths)
+                return
+            self._file.seek(data_end)
+            self._write_index(self._file, self.index)
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class MatchArchive:
+    def __init__(self, path=DEFAULT_ARCHIVE):
+        self.path = path
+        self._file = open(path, 'rb')
+        magic, version, _ = FILE_HEADER.unpack(self._file.read(FILE_HEADER.size))
+        if magic != FILE_MAGIC:
+            raise ValueError(f"{path} is not a match archive")
+        if version != FILE_VERSION:
+            raise ValueError(f"{path} has unsupported archive version {version}")
+        self._segments = {}
+        self.index = self._read_index()
+
+    def _read_index(self):
+        size = self._file.seek(0, os.SEEK_END)
+        if size >= FILE_HEADER.size + TRAILER.size:
+            self._file.seek(size - TRAILER.size)
+            index_offset, magic = TRAILER.unpack(self._file.read(TRAILER.size))
+            if magic == TRAILER_MAGIC and index_offset == size - TRAILER.size - self._block_length(index_offset):
+                self.data_end = index_offset
+                return self._parse_index(index_offset)
+        return self._scan_segments(size)
+
+    def _block_length(self, offset):
+        self._file.seek(offset)
+        header = self._file.read(BLOCK_HEADER.size)
+        if len(header) < BLOCK_HEADER.size:
+            return -1
+        magic, length = BLOCK_HEADER.unpack(header)
+        return length if magic == INDEX_MAGIC else -1
+
+    def _parse_index(self, index_offset):
+        self._file.seek(index_offset)
+        _, length = BLOCK_HEADER.unpack(self._file.read(BLOCK_HEADER.size))
+        buffer = self._file.read(length - BLOCK_HEADER.size)
+        (count,) = SEGMENT_COUNT.unpack_from(buffer, 0)
+        position = SEGMENT_COUNT.size
+        index = {}
+        for _ in range(count):
+            agent1, position = _unpack_name(buffer, position)
+            agent2, position = _unpack_name(buffer, position)
+            (offset,) = INDEX_ENTRY_OFFSET.unpack_from(buffer, position)
+            position += INDEX_ENTRY_OFFSET.size
+            index[(agent1, agent2)] = offset
+        return index
+
+    def _scan_segments(self, size):
+        index = {}
+        offset = FILE_HEADER.size
+        while offset + BLOCK_HEADER.size <= size:
+            self._file.seek(offset)
+            magic, length = BLOCK_HEADER.unpack(self._file.read(BLOCK_HEADER.size))
+            if magic not in (SEGMENT_MAGIC, INDEX_MAGIC) or length < BLOCK_HEADER.size or offset + length > size:
+                break  # torn write at the tail of an interrupted tournament
+            if magic == SEGMENT_MAGIC:
+                segment = self._load_segment(offset)
+                index[(segment['agent1'], segment['agent2'])] = offset
+                offset += length
+            else:
+                offset += length + TRAILER.size
+        self.data_end = offset
+        return index
+
+    def _load_segment(self, offset):
+        segment = self._segments.get(offset)
+        if segment is None:
+            self._file.seek(offset)
+            magic, length = BLOCK_HEADER.unpack(self._file.read(BLOCK_HEADER.size))
+            if magic != SEGMENT_MAGIC:
+                raise ValueError(f"No segment at offset {offset} in {self.path}")
+            (count,) = SEGMENT_COUNT.unpack(self._file.read(SEGMENT_COUNT.size))
+            names = []
+            for _ in range(4):
+                (name_length,) = NAME_LENGTH.unpack(self._file.read(NAME_LENGTH.size))
+                names.append(self._file.read(name_length).decode('utf-8'))
+            table = self._file.read(OFFSET.size * count)
+            offsets = [offset for (offset,) in OFFSET.iter_unpack(table)]
+            segment = {
+                'agent1': names[0], 'agent2': names[1], 'class1': names[2], 'class2': names[3],
+                'offset': offset, 'length': length, 'match_offsets': offsets,
+            }
+            self._segments[offset] = segment
+        return segment
+
+    def _segment_for(self, agent1, agent2):
+        try:
+            return self._load_segment(self.index[(agent1, agent2)])
+        except KeyError:
+            raise KeyError(f"No series {agent1} vs {agent2} in {self.path}") from None
+
+    def pairs(self):
+        return list(self.index)
+
+    def num_matches(self, agent1, agent2):
+        return len(self._segment_for(agent1, agent2)['match_offsets'])
+
+    def read_match(self, agent1, agent2, match_num):
+        segment = self._segment_for(agent1, agent2)
+        offsets = segment['match_offsets']
+        if not 1 <= match_num <= len(offsets):
+            raise IndexError(f"{agent1} vs {agent2} has {len(offsets)} matches, not {match_num}")
+        self._file.seek(segment['offset'] + offsets[match_num - 1])
+        outcome, num_rounds = MATCH_HEADER.unpack(self._file.read(MATCH_HEADER.size))
+        rounds = self._file.read(num_rounds)
+        score1, score2 = OUTCOME_SCORES[outcome]
+        return MatchRecord(agent1, agent2, segment['class1'], segment['class2'],
+                           rounds, outcome, score1, score2)
+
+    # (outcome, number of rounds) for every match of a series, read from the
+    # match headers without decoding any moves.
+    def match_summaries(self, agent1, agent2):
+        segment = self._segment_for(agent1, agent2)
+        self._file.seek(segment['offset'])
+        block = self._file.read(segment['length'])
+        return [MATCH_HEADER.unpack_from(block, offset) for offset in segment['match_offsets']]
+
+    def iter_matches(self, agent1, agent2):
+        for match_num in range(1, self.num_matches(agent1, agent2) + 1):
+            yield self.read_match(agent1, agent2, match_num)
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def decode_moves(rounds):
+    return [(MOVES[byte >> 4], MOVES[byte & 0x0F]) for byte in rounds]
+
+def format_legacy_match(record):
+    lines = [f"{record.class1} vs {record.class2}: {move1} vs {move2}" for move1, move2 in decode_moves(record.moves)]
+    if record.outcome == AGENT1_WINS:
+        lines.append(f"{record.class1} wins!")
+    elif record.outcome == AGENT2_WINS:
+        lines.append(f"{record.class2} wins!")
+    else:
+        lines.append("Draw!")
+    return (f"{record.agent1} vs {record.agent2}\n" + "\n".join(lines)
+            + f"\nFinal Score: {record.score1} - {record.score2}\n")
+
+# Writes match_results/<a>_vs_<b>/match_N.txt files in the format
+# run_match_series used to produce, for tools like visualize_game.
+def export_legacy(archive, output_folder, pairs=None, match_nums=None):
+    written = []
+    for agent1, agent2 in pairs or archive.pairs():
+        match_folder = os.path.join(output_folder, f"{agent1}_vs_{agent2}")
+        os.makedirs(match_folder, exist_ok=True)
+        for match_num in match_nums or range(1, archive.num_matches(agent1, agent2) + 1):
+            match_file = os.path.join(match_folder, f"match_{match_num}.txt")
+            with open(match_file, 'w') as f:
+                f.write(format_legacy_match(archive.read_match(agent1, agent2, match_num)))
+            written.append(match_file)
+    return written
+
+def main():
+    parser = argparse.ArgumentParser(description="Export matches from a tournament archive as legacy text files.")
+    parser.add_argument('archive', nargs='?', default=DEFAULT_ARCHIVE)
+    parser.add_argument('--pair', nargs=2, metavar=('AGENT1', 'AGENT2'), help="only export this series")
+    parser.add_argument('--match', type=int, nargs='+', help="only export these match numbers (1-based)")
+    parser.add_argument('--out', default='match_results', help="folder to write <a>_vs_<b>/match_N.txt into")
+    args = parser.parse_args()
+
+    with MatchArchive(args.archive) as archive:
+        pairs = [tuple(args.pair)] if args.pair else None
+        written = export_legacy(archive, args.out, pairs, args.match)
+    print(f"Exported {len(written)} matches to {args.out}")
+
+if __name__ == '__main__':
+    main()
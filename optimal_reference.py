@@ -0,0 +1,7 @@
+import solver
+
+# The solved game's maxmin strategy (solver.py) as a regular agent, to play
+# against or copy into a tournament. Like reference_opponent.py it isn't named
+# *_agent.py, so it only enters a tournament when copied to one.
+class Agent(solver.OptimalAgent):
+    pass
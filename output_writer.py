@@ -0,0 +1,60 @@
+import os
+import queue
+import threading
+
+import profiling
+
+# Log lines from any number of threads are pushed onto a queue and a single
+# background thread appends them to the output file in large batches.
+class OutputWriter:
+    def __init__(self, path, batch_size=8192):
+        self.path = path
+        self.batch_size = batch_size
+        self.pid = os.getpid()
+        self.lines_written = 0
+        self.batches_written = 0
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name='output-writer', daemon=True)
+        self._thread.start()
+
+    def write(self, message):
+        self._queue.put(message)
+
+    def flush(self):
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait()
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        # Unbuffered so every batch is a single O_APPEND write, which keeps
+        # batches from different worker processes from interleaving.
+        with open(self.path, 'ab', buffering=0) as f:
+            running = True
+            while running:
+                item = self._queue.get()
+                batch = []
+                waiters = []
+                while True:
+                    if item is None:
+                        running = False
+                    elif isinstance(item, threading.Event):
+                        waiters.append(item)
+                    else:
+                        batch.append(item)
+                    if len(batch) >= self.batch_size or not running:
+                        break
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                if batch:
+                    with profiling.phase('disk:output'):
+                        f.write(('\n'.join(batch) + '\n').encode('utf-8', errors='replace'))
+                    self.lines_written += len(batch)
+                    self.batches_written += 1
+                for waiter in waiters:
+                    waiter.set()
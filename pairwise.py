@@ -0,0 +1,149 @@
+import math
+
+import numpy as np
+
+import match_archive
+
+MATRIX_FILE = 'tournament_matrix.npz'
+
+# Bradley-Terry fit settings. Every pairing that was played gets one virtual
+# draw as a prior, so an agent that never won still has a finite rating.
+BT_PRIOR_DRAWS = 1.0
+BT_ITERATIONS = 1000
+BT_TOLERANCE = 1e-10
+ELO_BASE = 1500.0
+
+# Results of a tournament per ordered pair: wins[i, j] counts matches agent i
+# won playing as agent1 against agent j as agent2, likewise losses, draws
+# and rounds (summed game lengths). The head-to-head arrays fold both seatings
+# together from i's point of view, and cumulative_*[i, k] is agent i's total
+# against the k best-rated agents, which makes "X against the top k" one
+# lookup.
+class PairwiseMatrix:
+    def __init__(self, agents, wins, losses, draws, rounds, ratings=None):
+        self.agents = list(agents)
+        self.index = {agent: i for i, agent in enumerate(self.agents)}
+        self.wins = wins
+        self.losses = losses
+        self.draws = draws
+        self.rounds = rounds
+        self.ratings = fit_ratings(wins, losses, draws) if ratings is None else ratings
+
+        self.vs_wins = wins + losses.T
+        self.vs_losses = losses + wins.T
+        self.vs_draws = draws + draws.T
+        self.vs_rounds = rounds + rounds.T
+        # Best first; ties broken by name so the order is stable.
+        self.rank_order = np.array(sorted(range(len(self.agents)), key=lambda i: (-self.ratings[i], self.agents[i])),
+                                   dtype=np.intp)
+        self.rank_position = np.empty_like(self.rank_order)
+        self.rank_position[self.rank_order] = np.arange(len(self.agents))
+        self.cumulative = {
+            name: np.concatenate([np.zeros((len(self.agents), 1), dtype=np.int64),
+                                  np.cumsum(array[:, self.rank_order], axis=1, dtype=np.int64)], axis=1)
+            for name, array in (('wins', self.vs_wins), ('losses', self.vs_losses),
+                                ('draws', self.vs_draws), ('rounds', self.vs_rounds))
+        }
+
+    @classmethod
+    def from_archive(cls, path=match_archive.DEFAULT_ARCHIVE, agents=None):
+        with match_archive.MatchArchive(path) as archive:
+            pairs = archive.pairs()
+            if agents is None:
+                agents = sorted({agent for pair in pairs for agent in pair})
+            index = {agent: i for i, agent in enumerate(agents)}
+            shape = (len(agents), len(agents))
+            wins, losses, draws, rounds = (np.zeros(shape, dtype=np.int32) for _ in range(4))
+            for agent1, agent2 in pairs:
+                if agent1 not in index or agent2 not in index:
+                    continue
+                i, j = index[agent1], index[agent2]
+                for outcome, num_rounds in archive.match_summaries(agent1, agent2):
+                    if outcome == match_archive.AGENT1_WINS:
+                        wins[i, j] += 1
+                    elif outcome == match_archive.AGENT2_WINS:
+                        losses[i, j] += 1
+                    else:
+                        draws[i, j] += 1
+                    rounds[i, j] += num_rounds
+        return cls(agents, wins, losses, draws, rounds)
+
+    def save(self, path=MATRIX_FILE):
+        with open(path, 'wb') as f:
+            np.savez_compressed(f, agents=np.array(self.agents), wins=self.wins, losses=self.losses,
+                                draws=self.draws, rounds=self.rounds, ratings=self.ratings)
+
+    @classmethod
+    def load(cls, path=MATRIX_FILE):
+        with np.load(path) as data:
+            return cls(data['agents'].tolist(), data['wins'], data['losses'], data['draws'], data['rounds'],
+                       data['ratings'])
+
+    def _totals(self, wins, losses, draws, rounds):
+        games = wins + losses + draws
+        return {
+            'wins': wins,
+            'losses': losses,
+            'draws': draws,
+            'games': games,
+            'score': wins + 1.1 * draws,
+            'win_rate': wins / games if games else None,
+            'avg_length': rounds / games if games else None,
+        }
+
+    def head_to_head(self, agent, opponent):
+        i, j = self.index[agent], self.index[opponent]
+        return self._totals(int(self.vs_wins[i, j]), int(self.vs_losses[i, j]), int(self.vs_draws[i, j]),
+                            int(self.vs_rounds[i, j]))
+
+    # Agent's combined record against the k best-rated other agents.
+    def against_top(self, agent, k):
+        i = self.index[agent]
+        # If the agent is itself among the top k, its own (empty) column is
+        # skipped by taking one more.
+        k = min(k + 1 if self.rank_position[i] < k else k, len(self.agents))
+        totals = self._totals(*(int(self.cumulative[name][i, k]) for name in ('wins', 'losses', 'draws', 'rounds')))
+        totals['opponents'] = [self.agents[j] for j in self.rank_order[:k] if j != i]
+        return totals
+
+    def ranking(self):
+        return [(self.agents[i], float(self.ratings[i])) for i in self.rank_order]
+
+    def to_dict(self):
+        games = self.wins + self.losses + self.draws
+        with np.errstate(invalid='ignore', divide='ignore'):
+            avg_length = np.where(games > 0, self.rounds / games, np.nan)
+        return {
+            'agents': self.agents,
+            'ratings': [round(float(rating), 1) for rating in self.ratings],
+            'ranking': [self.agents[i] for i in self.rank_order],
+            'wins': self.wins.tolist(),
+            'losses': self.losses.tolist(),
+            'draws': self.draws.tolist(),
+            'avg_length': [[None if math.isnan(value) else round(value, 2) for value in row]
+                           for row in avg_length.tolist()],
+        }
+
+# Bradley-Terry strengths by Hunter's MM algorithm over both seatings, with a
+# draw counting as half a win for each side, returned on the Elo scale
+# (400 points = 10:1 odds, mean 1500).
+def fit_ratings(wins, losses, draws):
+    n = wins.shape[0]
+    if n == 0:
+        return np.zeros(0)
+    won = (wins + losses.T).astype(np.float64) + 0.5 * (draws + draws.T)
+    games = won + won.T
+    played = games > 0
+    won = won + 0.5 * BT_PRIOR_DRAWS * played
+    games = games + BT_PRIOR_DRAWS * played
+    total_won = won.sum(axis=1)
+    strength = np.ones(n)
+    for _ in range(BT_ITERATIONS):
+        denominator = (games / (strength[:, None] + strength[None, :])).sum(axis=1)
+        updated = np.where(denominator > 0, total_won / np.where(denominator > 0, denominator, 1), strength)
+        updated /= math.exp(np.log(updated).mean())
+        if np.abs(updated - strength).max() < BT_TOLERANCE:
+            strength = updated
+            break
+        strength = updated
+    return ELO_BASE + 400 * np.log10(strength)
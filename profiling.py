@@ -0,0 +1,305 @@
+import collections
+import cProfile
+import io
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+
+# Opt-in tournament profiling (tournament.py --profile). Every series runs
+# under its own cProfile.Profile and a stack sampler in whichever pool thread
+# or process plays it, and the profiles travel back with the series result.
+# Meanwhile the tournament code reports coarse phases (phase()) and waits on
+# its locks (locked()) into per-thread counters, which cost one global check
+# while profiling is off: the output writer, the shared progress counters, the
+# archive writer and the checkpoint journal. The merged report splits series
+# time into agent calls, logging and rules (the match loop itself: legal
+# moves, outcomes and bookkeeping), and lists the time spent publishing
+# progress, disk time per kind of file and every lock's waits.
+# With the sandbox executor both agents of a series play at once in their
+# agent_worker processes, so agent time is the wall time the series spends
+# waiting on them, pipe round trips included, rather than the sum of the
+# play() times the workers report.
+#
+# Everything is written to PROFILE_FOLDER next to the tournament output:
+#   report.txt / report.json   phase split, lock waits, per-worker totals and
+#                              the top functions of the merged profile
+#   merged.prof, worker-*.prof pstats files (python -m pstats, snakeviz)
+#   stacks.folded              sampled stacks in the folded format that
+#                              flamegraph.pl, speedscope and inferno read
+PROFILE_FOLDER = 'tournament_profile'
+SAMPLE_INTERVAL = 0.005
+TOP_FUNCTIONS = 40
+
+enabled = False
+
+_local = threading.local()
+_all_counters = []
+_registry_lock = threading.Lock()
+
+def enable():
+    global enabled
+    if not enabled:
+        with _registry_lock:
+            for counters in _all_counters:
+                counters.clear()
+        enabled = True
+
+def disable():
+    global enabled
+    enabled = False
+
+def _counters():
+    counters = getattr(_local, 'counters', None)
+    if counters is None:
+        counters = _local.counters = collections.Counter()
+        with _registry_lock:
+            _all_counters.append(counters)
+    return counters
+
+def add_time(name, ns):
+    _counters()[name] += ns
+
+# Totals over every thread of this process. Lock maxima are kept under
+# 'max:' keys and merge by max instead of sum.
+def snapshot():
+    total = collections.Counter()
+    with _registry_lock:
+        for counters in _all_counters:
+            for key, value in list(counters.items()):
+                if key.startswith('max:'):
+                    total[key] = max(total[key], value)
+                else:
+                    total[key] += value
+    return dict(total)
+
+class phase:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        if enabled:
+            self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.start is not None:
+            add_time(self.name, time.perf_counter_ns() - self.start)
+
+# with locked(lock, 'name'): is with lock: that also records how long the
+# acquire waited.
+class locked:
+    __slots__ = ('lock', 'name')
+
+    def __init__(self, lock, name):
+        self.lock = lock
+        self.name = name
+
+    def __enter__(self):
+        if not enabled:
+            self.lock.acquire()
+            return self
+        start = time.perf_counter_ns()
+        self.lock.acquire()
+        waited = time.perf_counter_ns() - start
+        counters = _counters()
+        counters[f"lock:{self.name}"] += waited
+        counters[f"waits:{self.name}"] += 1
+        if waited > counters[f"max:{self.name}"]:
+            counters[f"max:{self.name}"] = waited
+        return self
+
+    def __exit__(self, *exc_info):
+        self.lock.release()
+
+def _frame_name(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+# Samples one thread's Python stack every interval seconds and counts each
+# distinct stack, root first, as a folded-format line.
+class StackSampler(threading.Thread):
+    def __init__(self, thread_id, interval=SAMPLE_INTERVAL):
+        super().__init__(name='stack-sampler', daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            names = []
+            while frame is not None:
+                names.append(_frame_name(frame.f_code))
+                frame = frame.f_back
+            if names:
+                self.stacks[';'.join(reversed(names))] += 1
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+class SeriesProfile:
+    def __init__(self, worker, pid, stats, stacks, logging_ns, agent_wall_ns, counters):
+        self.worker = worker
+        self.pid = pid
+        self.stats = stats  # cProfile stats dict, or None if cProfile was busy
+        self.stacks = stacks
+        self.logging_ns = logging_ns
+        self.agent_wall_ns = agent_wall_ns  # time spent waiting on sandboxed agents, 0 in-process
+        self.counters = counters
+
+# Plays one series (function(*args)) under cProfile and the stack sampler and
+# returns (its result, SeriesProfile). Runs in the pool's thread or process.
+def run_profiled(function, *args):
+    enable()
+    counters = _counters()
+    logging_before, agents_before = counters['logging'], counters['agents']
+    profiler = cProfile.Profile()
+    sampler = StackSampler(threading.get_ident())
+    sampler.start()
+    try:
+        profiler.enable()
+    except ValueError:  # only one cProfile per process on newer Pythons
+        profiler = None
+    try:
+        result = function(*args)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        sampler.stop()
+    stats = None
+    if profiler is not None:
+        profiler.create_stats()
+        stats = profiler.stats
+    worker = f"{os.getpid()}-{threading.current_thread().name}"
+    return result, SeriesProfile(worker, os.getpid(), stats, dict(sampler.stacks),
+                                 counters['logging'] - logging_before, counters['agents'] - agents_before,
+                                 snapshot())
+
+# pstats.Stats loads anything with create_stats() and a stats dict.
+class _LoadedStats:
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+class TournamentProfile:
+    def __init__(self):
+        self.workers = {}  # worker -> {'series', 'seconds', 'agent_ns', 'logging_ns', 'stats'}
+        self.stacks = collections.Counter()
+        self.process_counters = {}
+
+    # seconds and timings are the series' wall time and latency.AgentTimings.
+    def add(self, profile, seconds, timings):
+        worker = self.workers.setdefault(profile.worker, {'series': 0, 'seconds': 0.0, 'agent_ns': 0,
+                                                          'logging_ns': 0, 'stats': None})
+        worker['series'] += 1
+        worker['seconds'] += seconds
+        if profile.agent_wall_ns:
+            worker['agent_ns'] += profile.agent_wall_ns
+        else:
+            worker['agent_ns'] += sum(side.play.total_ns + side.reset.total_ns for side in timings)
+        worker['logging_ns'] += profile.logging_ns
+        if profile.stats is not None:
+            if worker['stats'] is None:
+                worker['stats'] = pstats.Stats(_LoadedStats(profile.stats))
+            else:
+                worker['stats'].add(_LoadedStats(profile.stats))
+        self.stacks.update(profile.stacks)
+        # Counters only grow, so the latest snapshot of a process is the
+        # largest one.
+        previous = self.process_counters.get(profile.pid, {})
+        self.process_counters[profile.pid] = {key: max(value, previous.get(key, 0))
+                                              for key, value in profile.counters.items()}
+
+    def counters(self):
+        self.process_counters[os.getpid()] = snapshot()
+        total = collections.Counter()
+        for counters in self.process_counters.values():
+            for key, value in counters.items():
+                total[key] = max(total[key], value) if key.startswith('max:') else total[key] + value
+        return total
+
+    def report(self, wall_seconds):
+        counters = self.counters()
+        series_ns = sum(worker['seconds'] for worker in self.workers.values()) * 1e9
+        agent_ns = sum(worker['agent_ns'] for worker in self.workers.values())
+        logging_ns = sum(worker['logging_ns'] for worker in self.workers.values())
+        return {
+            'wall_seconds': wall_seconds,
+            'series_seconds': series_ns / 1e9,
+            'phases': {
+                'agents': agent_ns / 1e9,
+                'logging': logging_ns / 1e9,
+                'rules': (series_ns - agent_ns - logging_ns) / 1e9,
+            },
+            'logging_seconds': counters['logging'] / 1e9,
+            'progress_seconds': counters['progress'] / 1e9,
+            'disk': {key[5:]: value / 1e9 for key, value in sorted(counters.items()) if key.startswith('disk:')},
+            'locks': {key[5:]: {'waits': counters[f"waits:{key[5:]}"], 'seconds': value / 1e9,
+                                'max_ms': counters[f"max:{key[5:]}"] / 1e6}
+                      for key, value in sorted(counters.items()) if key.startswith('lock:')},
+            'workers': {name: {'series': worker['series'], 'seconds': worker['seconds'],
+                               'agents': worker['agent_ns'] / 1e9, 'logging': worker['logging_ns'] / 1e9}
+                        for name, worker in sorted(self.workers.items())},
+        }
+
+    def write(self, wall_seconds, folder=PROFILE_FOLDER):
+        os.makedirs(folder, exist_ok=True)
+        report = self.report(wall_seconds)
+        with open(os.path.join(folder, 'report.json'), 'w') as f:
+            json.dump(report, f, indent=2)
+
+        merged = None
+        for index, (name, worker) in enumerate(sorted(self.workers.items())):
+            if worker['stats'] is None:
+                continue
+            worker['stats'].dump_stats(os.path.join(folder, f"worker-{index}.prof"))
+            if merged is None:
+                merged = pstats.Stats(_LoadedStats(dict(worker['stats'].stats)))
+            else:
+                merged.add(worker['stats'])
+        top = io.StringIO()
+        if merged is not None:
+            merged.dump_stats(os.path.join(folder, 'merged.prof'))
+            merged.stream = top
+            merged.sort_stats('cumulative').print_stats(TOP_FUNCTIONS)
+
+        with open(os.path.join(folder, 'stacks.folded'), 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+        with open(os.path.join(folder, 'report.txt'), 'w') as f:
+            f.write(format_report(report))
+            f.write(top.getvalue())
+        return report
+
+def _share(seconds, total):
+    return f"{seconds:10.3f}s {seconds / total:7.1%}" if total else f"{seconds:10.3f}s"
+
+def format_report(report):
+    series = report['series_seconds']
+    lines = [f"Tournament wall time {report['wall_seconds']:.3f}s; series ran for {series:.3f}s in total", '',
+             'Series time by phase:']
+    for name, seconds in report['phases'].items():
+        lines.append(f"  {name:<28}{_share(seconds, series)}")
+    lines += ['', f"Logging calls, all threads: {report['logging_seconds']:.3f}s",
+              f"Progress updates, file write included: {report['progress_seconds']:.3f}s", '', 'Disk:']
+    for name, seconds in report['disk'].items():
+        lines.append(f"  {name:<28}{seconds:10.3f}s")
+    lines += ['', 'Lock waits:']
+    for name, waits in report['locks'].items():
+        lines.append(f"  {name:<28}{waits['seconds']:10.3f}s over {waits['waits']} acquires, "
+                     f"longest {waits['max_ms']:.2f} ms")
+    lines += ['', 'Workers:']
+    for name, worker in report['workers'].items():
+        lines.append(f"  {name:<28}{worker['series']:5} series {worker['seconds']:9.3f}s, "
+                     f"agents {worker['agents']:.3f}s, logging {worker['logging']:.3f}s")
+    return '\n'.join(lines) + '\n\n'
@@ -0,0 +1,128 @@
+import json
+import multiprocessing
+import os
+import threading
+import time
+
+import profiling
+
+# Tournament progress. Series workers count the matches and rounds they play
+# into a Counters object, which lives in shared memory when the series run on
+# a process pool. The tournament's main thread owns a ProgressReporter that
+# turns those counters and the finished series into a progress record with an
+# ETA, and publishes it at most every PUBLISH_INTERVAL seconds: to the progress
+# file, written to a temporary file and renamed over it so readers never see a
+# partial record, and as a 'progress' event.
+PUBLISH_INTERVAL = 0.5
+
+class Counters:
+    def __init__(self, shared=False):
+        if shared:
+            self._values = multiprocessing.RawArray('q', 2)
+            self._lock = multiprocessing.Lock()
+        else:
+            self._values = [0, 0]
+            self._lock = threading.Lock()
+
+    def add(self, matches, rounds):
+        with profiling.locked(self._lock, 'progress_counters'):
+            self._values[0] += matches
+            self._values[1] += rounds
+
+    # (matches, rounds) played so far.
+    def read(self):
+        with profiling.locked(self._lock, 'progress_counters'):
+            return self._values[0], self._values[1]
+
+# The counters this process's series report to, if any; process-pool workers
+# get the parent's shared counters through set_counters as their initializer.
+_counters = None
+
+def set_counters(counters):
+    global _counters
+    _counters = counters
+
+def record(matches, rounds):
+    counters = _counters
+    if counters is not None:
+        counters.add(matches, rounds)
+
+def write_atomic(path, progress):
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, 'w') as f:
+        json.dump(progress, f)
+    os.replace(temporary, path)
+
+# The last published progress, or {} before the first one.
+def read_progress(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+class ProgressReporter:
+    # on_publish(progress) is called with every published record.
+    def __init__(self, path, total_series, matches_per_series, counters, on_publish=None, interval=PUBLISH_INTERVAL):
+        self.path = path
+        self.total_series = total_series
+        self.matches_per_series = matches_per_series
+        self.counters = counters
+        self.on_publish = on_publish
+        self.interval = interval
+        self.series = 0
+        self.played_series_matches = 0  # matches of the played series that have finished
+        self.started = time.monotonic()
+        self._last_published = None
+        self._last_counts = None
+        self._dirty = True
+
+    # A series finished; matches is how many it played, 0 for one that came
+    # from the cache or the checkpoint.
+    def series_done(self, matches=0):
+        self.series += 1
+        self.played_series_matches += matches
+        self._dirty = True
+
+    def snapshot(self):
+        matches, rounds = self.counters.read()
+        elapsed = time.monotonic() - self.started
+        total, series = self.total_series, self.series
+        # Matches of the series still running count as fractions of a series.
+        running_matches = max(matches - self.played_series_matches, 0)
+        running = min(running_matches / self.matches_per_series, total - series) if self.matches_per_series else 0
+        # The ETA assumes every series left plays all of its matches at the
+        # throughput seen so far, so with adaptive sampling it is an upper bound.
+        remaining_matches = max((total - series) * self.matches_per_series - running_matches, 0)
+        matches_per_second = matches / elapsed if elapsed > 0 else 0.0
+        eta = remaining_matches / matches_per_second if matches_per_second else None
+        if series >= total:
+            eta = 0.0
+        return {
+            'current': series,
+            'total': total,
+            'percentage': (series + running) / total * 100 if total else 100.0,
+            'matches': matches,
+            'rounds': rounds,
+            'elapsed': elapsed,
+            'matches_per_second': matches_per_second,
+            'rounds_per_second': rounds / elapsed if elapsed > 0 else 0.0,
+            'eta_seconds': eta,
+        }
+
+    # Publishes if anything changed and, unless forced, the last publication
+    # is at least interval seconds old.
+    def publish(self, force=False):
+        now = time.monotonic()
+        if not force and self._last_published is not None and now - self._last_published < self.interval:
+            return None
+        counts = self.counters.read()
+        if not self._dirty and counts == self._last_counts:
+            return None
+        progress = self.snapshot()
+        with profiling.phase('disk:progress'):
+            write_atomic(self.path, progress)
+        self._last_published, self._last_counts, self._dirty = now, counts, False
+        if self.on_publish is not None:
+            self.on_publish(progress)
+        return progress
@@ -0,0 +1,28 @@
+import random
+
+# Opponent for the submit-time smoke match (agent_validation.py). It plays a
+# random legal move each round so the agent under test sees every move, and
+# deliberately isn't named *_agent.py so it never enters a tournament.
+class Agent:
+    def __init__(self):
+        self.loads = 0
+        self.mirror = True
+
+    def play(self, opponent_last_move):
+        moves = ['shield', 'load']
+        if self.loads >= 1:
+            moves.append('fireball')
+        if self.loads >= 2:
+            moves.append('tsunami')
+        if self.mirror:
+            moves.append('mirror')
+        move = random.choice(moves)
+        if move == 'load':
+            self.loads += 1
+        elif move == 'fireball':
+            self.loads -= 1
+        elif move == 'tsunami':
+            self.loads -= 2
+        elif move == 'mirror':
+            self.mirror = False
+        return move
@@ -0,0 +1,129 @@
+import hashlib
+import json
+import os
+import threading
+
+import profiling
+
+CACHE_FILE = 'tournament_cache.json'
+CHECKPOINT_FILE = 'tournament_checkpoint.jsonl'
+
+def hash_agent_file(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+# Series results keyed by both agents' code hashes and names, the match count,
+# the per-move time budget and the sampling settings if any.
+# Editing an agent changes its hash, so only pairings involving it miss the
+# cache; everything else is rebuilt from the stored per-pair scores. The names
+# keep two agents with identical code from sharing each other's entries.
+class ResultsCache:
+    def __init__(self, path=CACHE_FILE):
+        self.path = path
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        if os.path.exists(path):
+            try:
+                with open(path, 'r') as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError):
+                self.entries = {}
+
+    @staticmethod
+    def key(agent1, agent2, hash1, hash2, num_matches, move_budget=None, sampling=None):
+        key = f"{hash1}:{hash2}:{agent1}:{agent2}:{num_matches}"
+        if move_budget is not None:
+            key += f":{move_budget!r}"
+        if sampling is not None:
+            key += f":{sampling}"
+        return key
+
+    # Returns the stored entry (agent names, scores and serialized timings)
+    # or None on a miss.
+    def get(self, agent1, agent2, hash1, hash2, num_matches, move_budget=None, sampling=None):
+        entry = self.entries.get(self.key(agent1, agent2, hash1, hash2, num_matches, move_budget, sampling))
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry
+
+    @staticmethod
+    def entry(agent1, agent2, score1, score2, timings=None, matches=None, confidence=None):
+        return {
+            'agent1': agent1,
+            'agent2': agent2,
+            'score1': score1,
+            'score2': score2,
+            'timings': None if timings is None else [side.to_dict() for side in timings],
+            'matches': matches,
+            'confidence': confidence,
+        }
+
+    def put(self, agent1, agent2, hash1, hash2, num_matches, score1, score2,
+            move_budget=None, timings=None, sampling=None, matches=None, confidence=None):
+        self.entries[self.key(agent1, agent2, hash1, hash2, num_matches, move_budget, sampling)] = \
+            self.entry(agent1, agent2, score1, score2, timings, matches, confidence)
+
+    # Drops every entry that mentions a code hash no current agent has, which
+    # covers both deleted agents and the old versions of edited ones, and
+    # entries from before keys carried the agents' names.
+    def evict(self, live_hashes):
+        live_hashes = set(live_hashes)
+        stale = [key for key, entry in self.entries.items()
+                 if not set(key.split(':')[:2]) <= live_hashes
+                 or key.split(':')[2:4] != [entry.get('agent1'), entry.get('agent2')]]
+        for key in stale:
+            del self.entries[key]
+        return len(stale)
+
+    def save(self):
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(self.entries, f)
+        os.replace(temp_path, self.path)
+
+# Journal of the series completed by the tournament in progress, one JSON line
+# per series, fsynced as each one finishes. Entries use the cache's keys and
+# format, agent names included, so a resumed run skips exactly the series
+# whose agents, settings and match count are unchanged. A line torn by a crash is dropped on load.
+class Checkpoint:
+    def __init__(self, path=CHECKPOINT_FILE, resume=False):
+        self.path = path
+        self.entries = {}
+        valid_length = 0
+        if resume and os.path.exists(path):
+            with open(path, 'rb') as f:
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        break
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        break
+                    self.entries[record.pop('key')] = record
+                    valid_length += len(line)
+        self._file = open(path, 'ab' if resume else 'wb')
+        self._file.truncate(valid_length)
+        self._lock = threading.Lock()
+
+    def get(self, agent1, agent2, hash1, hash2, num_matches, move_budget=None, sampling=None):
+        return self.entries.get(ResultsCache.key(agent1, agent2, hash1, hash2, num_matches, move_budget, sampling))
+
+    def record(self, hash1, hash2, num_matches, entry, move_budget=None, sampling=None):
+        key = ResultsCache.key(entry['agent1'], entry['agent2'], hash1, hash2, num_matches, move_budget, sampling)
+        line = json.dumps({'key': key, **entry}).encode('utf-8') + b'\n'
+        with profiling.locked(self._lock, 'checkpoint'):
+            self.entries[key] = entry
+            self._file.write(line)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    # A finished tournament has nothing left to resume.
+    def close(self, remove=False):
+        with profiling.locked(self._lock, 'checkpoint'):
+            if not self._file.closed:
+                self._file.close()
+        if remove and os.path.exists(self.path):
+            os.remove(self.path)
@@ -0,0 +1,103 @@
+MOVES = ['shield', 'load', 'fireball', 'tsunami', 'mirror']
+
+# Moves are encoded as their index in MOVES. Anything an agent returns that is
+# not a move gets the extra INVALID code, which the legality table turns into
+# a load just like validate_move always has.
+SHIELD, LOAD, FIREBALL, TSUNAMI, MIRROR = range(len(MOVES))
+INVALID = len(MOVES)
+MOVE_CODES = {move: code for code, move in enumerate(MOVES)}
+
+# Change in loads caused by playing each (already validated) move.
+LOAD_DELTA = (0, 1, -1, -2, 0)
+
+def _reference_winner(move1, move2):
+    if move1 == move2:
+        return None
+    if move1 == FIREBALL:
+        if move2 == LOAD:
+            return 0
+        elif move2 == MIRROR:
+            return 1
+    if move1 == TSUNAMI:
+        if move2 in (LOAD, SHIELD):
+            return 0
+        elif move2 == MIRROR:
+            return 1
+    if move1 == MIRROR:
+        if move2 in (FIREBALL, TSUNAMI):
+            return 0
+    if move2 in (FIREBALL, TSUNAMI) and move1 == LOAD:
+        return 1
+    if move1 == SHIELD and move2 == TSUNAMI:
+        return 1
+    return None
+
+# OUTCOME[move1][move2] is 0 if player 1 wins the round, 1 if player 2 wins
+# and None if the match carries on.
+OUTCOME = tuple(
+    tuple(_reference_winner(move1, move2) for move2 in range(len(MOVES)))
+    for move1 in range(len(MOVES))
+)
+
+def _reference_legal(move, loads_bucket, mirror):
+    if move == FIREBALL and loads_bucket < 1:
+        return LOAD
+    if move == TSUNAMI and loads_bucket < 2:
+        return LOAD
+    if move == MIRROR and not mirror:
+        return LOAD
+    if move == INVALID:
+        return LOAD
+    return move
+
+# LEGAL[move][loads_bucket][mirror] is the move that is actually played. Loads
+# only matter up to 2 (tsunami), so they are bucketed as 0, 1 and 2-or-more.
+LEGAL = tuple(
+    tuple(
+        tuple(_reference_legal(move, bucket, mirror) for mirror in (False, True))
+        for bucket in range(3)
+    )
+    for move in range(len(MOVES) + 1)
+)
+
+# Per-move slice of LEGAL keyed by the move string, so the hot path is one dict
+# lookup plus two tuple indexes.
+_LEGAL_BY_MOVE = {move: LEGAL[code] for move, code in MOVE_CODES.items()}
+
+def encode(move):
+    try:
+        return MOVE_CODES.get(move, INVALID)
+    except TypeError:  # unhashable return value from play()
+        return INVALID
+
+def loads_bucket(loads):
+    if loads >= 2:
+        return 2
+    if loads >= 1:
+        return 1
+    return 0
+
+def legal_move(move, loads, mirror_status):
+    try:
+        table = _LEGAL_BY_MOVE.get(move)
+    except TypeError:
+        return LOAD
+    if table is None:
+        return LOAD
+    return table[2 if loads >= 2 else 1 if loads >= 1 else 0][1 if mirror_status else 0]
+
+def validate_move(move, loads, mirror_status):
+    return MOVES[legal_move(move, loads, mirror_status)]
+
+def determine_winner(move1, move2):
+    code2 = encode(move2)
+    if code2 == INVALID:
+        return None
+    code1 = encode(move1)
+    if code1 == INVALID:
+        # The original rules checked `move1 in 'load'`, so any substring of
+        # 'load' (including '') loses to fireball/tsunami like a real load.
+        if (code2 == FIREBALL or code2 == TSUNAMI) and move1 in 'load':
+            return 1
+        return None
+    return OUTCOME[code1][code2]
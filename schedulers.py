@@ -0,0 +1,139 @@
+import math
+import statistics
+
+import match_archive
+
+# Schedulers decide which series get played. The tournament asks for one round
+# of pairings at a time, passing the standings so far, and stops when a round
+# comes back empty. Scoring is untouched: every match still pays 1 for a win
+# and 1.1 to each side for a draw.
+
+class RoundRobin:
+    def __init__(self, agent_names):
+        self.agent_names = list(agent_names)
+        self.bye = None
+        self._done = False
+
+    # Upper bound on series, for progress reporting.
+    @property
+    def total_series(self):
+        n = len(self.agent_names)
+        return n * (n - 1)
+
+    def next_round(self, standings):
+        if self._done:
+            return []
+        self._done = True
+        return [(agent1, agent2) for agent1 in self.agent_names for agent2 in self.agent_names if agent1 != agent2]
+
+# Swiss system: every round pairs agents with neighbours in the current
+# standings, never twice against the same opponent, so a field of N needs
+# about log2(N) rounds of N/2 series instead of N*(N-1). With an odd field the
+# lowest-ranked agent that hasn't had one sits out and gets a bye (see
+# bye_score); who plays as agent1 alternates to keep sides balanced.
+class Swiss:
+    def __init__(self, agent_names, rounds=None):
+        self.agent_names = list(agent_names)
+        n = len(self.agent_names)
+        default_rounds = math.ceil(math.log2(n)) + 2 if n > 1 else 0
+        self.rounds = min(rounds or default_rounds, max(n - 1, 0))
+        self.round_num = 0
+        self.bye = None
+        self._met = {name: set() for name in self.agent_names}
+        self._first = {name: 0 for name in self.agent_names}
+        self._had_bye = set()
+
+    @property
+    def total_series(self):
+        return self.rounds * (len(self.agent_names) // 2)
+
+    def next_round(self, standings):
+        self.bye = None
+        if self.round_num >= self.rounds:
+            return []
+        self.round_num += 1
+        points = dict(standings)
+        # Ties are broken by name so the same standings give the same pairings.
+        ranked = sorted(self.agent_names, key=lambda name: (-points.get(name, 0), name))
+
+        if len(ranked) % 2:
+            self.bye = next((name for name in reversed(ranked) if name not in self._had_bye), ranked[-1])
+            self._had_bye.add(self.bye)
+            ranked.remove(self.bye)
+
+        pairings = []
+        unpaired = ranked
+        while unpaired:
+            agent = unpaired.pop(0)
+            # Closest-ranked opponent not met yet; a rematch only when the
+            # field has run out of fresh opponents.
+            index = next((i for i, other in enumerate(unpaired) if other not in self._met[agent]), 0)
+            opponent = unpaired.pop(index)
+            self._met[agent].add(opponent)
+            self._met[opponent].add(agent)
+            if self._first[opponent] < self._first[agent]:
+                agent, opponent = opponent, agent
+            self._first[agent] += 1
+            pairings.append((agent, opponent))
+        return pairings
+
+    # The bye is worth what an average agent scored per series this round, so
+    # sitting out neither helps nor hurts an agent's place in the standings.
+    @staticmethod
+    def bye_score(round_series):
+        scores = [score for series in round_series for score in (series.score1, series.score2)]
+        return sum(scores) / len(scores) if scores else 0
+
+SCHEDULERS = {
+    'round-robin': RoundRobin,
+    'swiss': Swiss,
+}
+
+def make_scheduler(name, agent_names, rounds=None):
+    if name not in SCHEDULERS:
+        raise ValueError(f"Unknown scheduler '{name}', expected one of: {', '.join(SCHEDULERS)}")
+    if name == 'swiss':
+        return Swiss(agent_names, rounds)
+    return SCHEDULERS[name](agent_names)
+
+# Adaptive sampling plays a series in blocks and stops once the per-match
+# score difference (+1 agent1 win, -1 agent2 win, 0 draw) is settled: its
+# confidence interval excludes zero, or is narrower than +/- tolerance.
+# Series scores are then scaled up to max_matches so a series that stopped
+# early carries the same weight in the totals as one that didn't.
+class AdaptiveSampling:
+    def __init__(self, max_matches=100, min_matches=20, block=10, confidence=0.95, tolerance=0.1):
+        self.max_matches = max_matches
+        self.min_matches = min(min_matches, max_matches)
+        self.block = block
+        self.confidence = confidence
+        self.tolerance = tolerance
+        self.z = statistics.NormalDist().inv_cdf(0.5 + confidence / 2)
+
+    # Part of the results cache key: different settings give different results.
+    def key(self):
+        return f"adaptive:{self.min_matches}:{self.block}:{self.confidence!r}:{self.tolerance!r}"
+
+    def next_block(self, played):
+        return min(self.block, self.max_matches - played)
+
+    # Confidence bounds on agent1's mean per-match score lead; unbounded until
+    # at least two matches have been played.
+    def bounds(self, outcomes):
+        n = len(outcomes)
+        if n == 0:
+            return -math.inf, math.inf
+        differences = [1 if outcome == match_archive.AGENT1_WINS else -1 if outcome == match_archive.AGENT2_WINS else 0
+                       for outcome in outcomes]
+        mean = sum(differences) / n
+        half_width = self.z * statistics.stdev(differences) / math.sqrt(n) if n > 1 else math.inf
+        return mean - half_width, mean + half_width
+
+    def settled(self, outcomes):
+        if len(outcomes) < self.min_matches:
+            return False
+        low, high = self.bounds(outcomes)
+        return low > 0 or high < 0 or (high - low) / 2 <= self.tolerance
+
+    def scale(self, score, played):
+        return score * self.max_matches / played if played != self.max_matches else score
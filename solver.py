@@ -0,0 +1,355 @@
+import argparse
+import itertools
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+import rules
+
+# Exact solution of the fireball game. Which moves are legal and how a round
+# ends only depend on both sides' loads and mirrors, and what a win or a draw
+# pays only on whether the match is over, so the game is a stack of one-shot
+# 5x5 games, one per (round, loads, opponent's loads, mirror, opponent's
+# mirror). Last moves don't change what either side can do next and are left
+# out of the state.
+#
+# The solution is the maxmin one: the value of a state is the points per
+# match a player is guaranteed from there (win 1, loss 0, a draw after the
+# last round 1.1) however its opponent plays. States are solved backwards
+# from the last round, one batch of matrix games per round, and only the
+# values are stored: a state's mixed strategy, and the opponent's strategy
+# that holds the player to the value, come from solving that state's single
+# game against the next round's values when it is first looked up.
+#
+# The table stays small for two reasons. With loads at least twice the
+# rounds left, every move stays legal until the end, so loads are capped
+# there. And far from the end the values stop changing from one round to the
+# next; once a round matches the one after it, it stands in for every
+# earlier round as well.
+SOLVER_TABLE_FILE = 'solver_table.npz'
+ROUNDS = 100
+WIN, LOSS, DRAW = 1.0, 0.0, 1.1
+NUM_MOVES = len(rules.MOVES)
+# Solutions accepted up to this much rounding error.
+TOLERANCE = 1e-9
+# Submatrices with a smaller bordered determinant are treated as singular.
+SINGULAR = 1e-12
+# Rounds whose values differ by less than this are the same.
+STATIONARY_TOLERANCE = 1e-12
+# Games solved per batch, which bounds the solver's memory.
+BATCH_SIZE = 2048
+
+_LEGAL = np.array(rules.LEGAL[:NUM_MOVES], dtype=np.intp)  # [move, loads bucket, mirror]
+_OUTCOME = np.array([[-1 if winner is None else winner for winner in row] for row in rules.OUTCOME], dtype=np.int8)
+_LOAD_DELTA = np.array(rules.LOAD_DELTA, dtype=np.intp)
+
+# Row and column sets of the square submatrices of a 5x5 game, by size.
+_SUPPORTS = []
+for _size in range(1, NUM_MOVES + 1):
+    _pairs = list(itertools.product(itertools.combinations(range(NUM_MOVES), _size), repeat=2))
+    _SUPPORTS.append((np.array([rows for rows, _ in _pairs]), np.array([columns for _, columns in _pairs])))
+
+# Solves zero-sum games (payoffs[s, i, j] to the maximizing row player). By
+# the Shapley-Snow theorem every matrix game has an optimal pair of
+# strategies whose supports are the rows and columns of a square submatrix,
+# with both players indifferent inside it, so trying submatrices, smallest
+# first, until both sides' solutions are non-negative and neither player
+# gains by leaving the support finds one exactly. Returns values, row and
+# column strategies.
+def solve_matrix_games(payoffs):
+    payoffs = np.asarray(payoffs, dtype=float)
+    solutions = [_solve_batch(payoffs[start:start + BATCH_SIZE]) for start in range(0, len(payoffs), BATCH_SIZE)]
+    return tuple(np.concatenate(parts) for parts in zip(*solutions))
+
+def _solve_batch(payoffs):
+    count = len(payoffs)
+    values = np.zeros(count)
+    row_strategies = np.zeros((count, NUM_MOVES))
+    column_strategies = np.zeros((count, NUM_MOVES))
+    unsolved = np.arange(count)
+    for rows, columns in _SUPPORTS:
+        if unsolved.size == 0:
+            break
+        supports, size = rows.shape
+        games = payoffs[unsolved]
+        # [[sub, -1], [1, 0]] [y, v] = [0, 1] gives the column strategy, and
+        # the same with sub transposed the row strategy.
+        bordered = np.zeros((len(games), supports, size + 1, size + 1))
+        bordered[..., :size, size] = -1
+        bordered[..., size, :size] = 1
+        bordered_transposed = bordered.copy()
+        sub = games[:, rows[:, :, None], columns[:, None, :]]
+        bordered[..., :size, :size] = sub
+        bordered_transposed[..., :size, :size] = sub.swapaxes(-1, -2)
+        solvable = np.abs(np.linalg.det(bordered)) > SINGULAR
+        target = np.zeros((int(solvable.sum()), size + 1, 1))
+        target[:, size] = 1
+
+        value = np.full(solvable.shape, np.nan)
+        row_strategy = np.zeros(solvable.shape + (NUM_MOVES,))
+        column_strategy = np.zeros(solvable.shape + (NUM_MOVES,))
+        column_solution = np.linalg.solve(bordered[solvable], target)[..., 0]
+        row_solution = np.linalg.solve(bordered_transposed[solvable], target)[..., 0]
+        game_index, support_index = np.nonzero(solvable)
+        value[solvable] = column_solution[:, size]
+        row_strategy[game_index[:, None], support_index[:, None], rows[support_index]] = row_solution[:, :size]
+        column_strategy[game_index[:, None], support_index[:, None], columns[support_index]] = \
+            column_solution[:, :size]
+
+        optimal = (solvable & (row_strategy >= -TOLERANCE).all(axis=-1) & (column_strategy >= -TOLERANCE).all(axis=-1)
+                   & (np.einsum('gsi,gij->gsj', row_strategy, games) >= value[..., None] - TOLERANCE).all(axis=-1)
+                   & (np.einsum('gij,gsj->gsi', games, column_strategy) <= value[..., None] + TOLERANCE).all(axis=-1))
+        found = optimal.any(axis=1)
+        first = optimal.argmax(axis=1)[found]
+        solved = unsolved[found]
+        values[solved] = value[found, first]
+        row_strategies[solved] = np.maximum(row_strategy[found, first], 0)
+        column_strategies[solved] = np.maximum(column_strategy[found, first], 0)
+        unsolved = unsolved[~found]
+    if unsolved.size:
+        raise ArithmeticError(f"{unsolved.size} matrix games have no solution within tolerance")
+    row_strategies /= row_strategies.sum(axis=1, keepdims=True)
+    column_strategies /= column_strategies.sum(axis=1, keepdims=True)
+    return values, row_strategies, column_strategies
+
+# Highest loads that still make a difference at round_num (0-based): no more
+# than could have been loaded so far, nor twice the rounds left.
+def load_cap(round_num, rounds=ROUNDS):
+    return min(round_num, 2 * (rounds - round_num))
+
+def _index(loads, opponent_loads, mirror, opponent_mirror, cap):
+    return ((np.minimum(loads, cap) * (cap + 1) + np.minimum(opponent_loads, cap)) * 2 + mirror) * 2 + opponent_mirror
+
+def _states(cap):
+    grid = np.meshgrid(np.arange(cap + 1), np.arange(cap + 1), [0, 1], [0, 1], indexing='ij')
+    return [axis.ravel() for axis in grid]
+
+# Payoff matrices of the given states, where next_values(loads, opponent
+# loads, mirror, opponent mirror) looks up the values of the round after
+# (None for the last round). Moves that are illegal in a state are played as
+# the load the rules turn them into.
+def _payoffs(loads, opponent_loads, mirror, opponent_mirror, next_values):
+    payoffs = np.empty((len(loads), NUM_MOVES, NUM_MOVES))
+    codes = _LEGAL[:, np.minimum(loads, 2), mirror]
+    opponent_codes = _LEGAL[:, np.minimum(opponent_loads, 2), opponent_mirror]
+    for move in range(NUM_MOVES):
+        code = codes[move]
+        for opponent_move in range(NUM_MOVES):
+            opponent_code = opponent_codes[opponent_move]
+            if next_values is None:
+                carry_on = DRAW
+            else:
+                carry_on = next_values(loads + _LOAD_DELTA[code], opponent_loads + _LOAD_DELTA[opponent_code],
+                                       mirror & (code != rules.MIRROR), opponent_mirror & (opponent_code != rules.MIRROR))
+            outcome = _OUTCOME[code, opponent_code]
+            payoffs[:, move, opponent_move] = np.where(outcome == 0, WIN, np.where(outcome == 1, LOSS, carry_on))
+    return payoffs
+
+# Values of every state, flattened round after round. A round's states start
+# at offsets[round] and are laid out by _index with caps[round]; rounds
+# before the stationary one share its block.
+class SolverTable:
+    def __init__(self, rounds, caps, offsets, values):
+        self.rounds = rounds
+        self.caps = caps
+        self.offsets = offsets
+        self.values = values
+        self._caps = caps.tolist()
+        self._offsets = offsets.tolist()
+        self._solutions = {}
+
+    @classmethod
+    def solve(cls, rounds=ROUNDS):
+        blocks = {}
+        next_values = None
+        stationary_from = 0
+        for round_num in range(rounds - 1, -1, -1):
+            cap = load_cap(round_num, rounds)
+            states = _states(cap)
+            values = solve_matrix_games(_payoffs(*states, next_values))[0]
+            if round_num + 1 in blocks and load_cap(round_num + 1, rounds) >= cap:
+                next_round = blocks[round_num + 1]
+                if np.abs(values - next_round[_index(*states, load_cap(round_num + 1, rounds))]).max() \
+                        < STATIONARY_TOLERANCE:
+                    stationary_from = round_num + 1
+                    break
+            blocks[round_num] = values
+            next_values = (lambda values, cap: lambda *state: values[_index(*state, cap)])(values, cap)
+
+        caps = np.array([load_cap(round_num, rounds) for round_num in range(rounds)], dtype=np.int32)
+        caps[:stationary_from] = caps[stationary_from]
+        offsets = np.zeros(rounds, dtype=np.int64)
+        position = 0
+        for round_num in range(stationary_from, rounds):
+            offsets[round_num] = position
+            position += blocks[round_num].size
+        return cls(rounds, caps, offsets, np.concatenate([blocks[round_num]
+                                                          for round_num in range(stationary_from, rounds)]))
+
+    def save(self, path=SOLVER_TABLE_FILE):
+        with open(path, 'wb') as f:
+            np.savez_compressed(f, rounds=self.rounds, caps=self.caps, offsets=self.offsets, values=self.values)
+
+    @classmethod
+    def load(cls, path=SOLVER_TABLE_FILE):
+        with np.load(path) as data:
+            return cls(int(data['rounds']), data['caps'], data['offsets'], data['values'])
+
+    # State as seen by the player the value and strategies are for: its own
+    # loads and mirror first. round_num counts rounds already played.
+    def index(self, round_num, loads, opponent_loads, mirror, opponent_mirror):
+        return self._offsets[round_num] + int(_index(loads, opponent_loads, int(mirror), int(opponent_mirror),
+                                                     self._caps[round_num]))
+
+    def value(self, round_num=0, loads=0, opponent_loads=0, mirror=True, opponent_mirror=True):
+        return float(self.values[self.index(round_num, loads, opponent_loads, mirror, opponent_mirror)])
+
+    # (value, strategy, opponent's strategy) of a state, memoized by index.
+    def solution(self, round_num=0, loads=0, opponent_loads=0, mirror=True, opponent_mirror=True):
+        index = self.index(round_num, loads, opponent_loads, mirror, opponent_mirror)
+        solution = self._solutions.get(index)
+        if solution is None:
+            if round_num + 1 < self.rounds:
+                offset, cap = self._offsets[round_num + 1], self._caps[round_num + 1]
+                next_values = lambda *state: self.values[offset + _index(*state, cap)]
+            else:
+                next_values = None
+            state = [np.array([int(x)]) for x in (loads, opponent_loads, mirror, opponent_mirror)]
+            value, strategy, counter_strategy = solve_matrix_games(_payoffs(*state, next_values))
+            solution = self._solutions[index] = (float(value[0]), strategy[0], counter_strategy[0])
+        return solution
+
+    def strategy(self, round_num=0, loads=0, opponent_loads=0, mirror=True, opponent_mirror=True):
+        return self.solution(round_num, loads, opponent_loads, mirror, opponent_mirror)[1]
+
+    # What an opponent plays to hold the player to the state's value.
+    def counter_strategy(self, round_num=0, loads=0, opponent_loads=0, mirror=True, opponent_mirror=True):
+        return self.solution(round_num, loads, opponent_loads, mirror, opponent_mirror)[2]
+
+    def stationary_from(self):
+        return int(np.argmax(self.offsets > 0)) - 1 if self.offsets.any() else self.rounds - 1
+
+_tables = {}
+
+def load_table(path=None):
+    path = path or os.path.join(os.path.dirname(os.path.abspath(__file__)), SOLVER_TABLE_FILE)
+    if path not in _tables:
+        _tables[path] = SolverTable.load(path)
+    return _tables[path]
+
+# Keeps track of a match from one side, following both sides' validated
+# moves exactly as Match does, and picks moves from the solver table. A new
+# match starts whenever the opponent's last move is None.
+class _TablePlayer:
+    def __init__(self, counter=False):
+        self.table = load_table()
+        self.counter = counter
+        self.new_match()
+
+    def new_match(self):
+        self.round_num = 0
+        self.loads = self.opponent_loads = 0
+        self.mirror = self.opponent_mirror = True
+        self.last_code = None
+
+    def play(self, opponent_last_move):
+        if opponent_last_move is None:
+            self.new_match()
+        else:
+            opponent_code = rules.MOVE_CODES[opponent_last_move]
+            self.loads += rules.LOAD_DELTA[self.last_code]
+            self.opponent_loads += rules.LOAD_DELTA[opponent_code]
+            self.mirror = self.mirror and self.last_code != rules.MIRROR
+            self.opponent_mirror = self.opponent_mirror and opponent_code != rules.MIRROR
+            self.round_num += 1
+        round_num = min(self.round_num, self.table.rounds - 1)
+        if self.counter:
+            # Counter strategies are stored from the opponent's side.
+            weights = self.table.counter_strategy(round_num, self.opponent_loads, self.loads, self.opponent_mirror,
+                                                  self.mirror)
+        else:
+            weights = self.table.strategy(round_num, self.loads, self.opponent_loads, self.mirror,
+                                          self.opponent_mirror)
+        move = rules.MOVES[random.choices(range(NUM_MOVES), weights)[0]]
+        self.last_code = rules.legal_move(move, self.loads, self.mirror)
+        return move
+
+# Reference agent that plays the maxmin strategy: it scores at least the
+# game value (SolverTable.value()) per match in expectation against anyone.
+class OptimalAgent:
+    def __init__(self):
+        self.player = _TablePlayer()
+
+    def play(self, opponent_last_move):
+        return self.player.play(opponent_last_move)
+
+# Opponent that holds whoever it plays to at most the game value, for
+# measuring how far below it an agent falls.
+class CounterAgent:
+    def __init__(self):
+        self.player = _TablePlayer(counter=True)
+
+    def play(self, opponent_last_move):
+        return self.player.play(opponent_last_move)
+
+# Points per match an agent falls short of the game value against
+# CounterAgent, over both seats: OptimalAgent scores 0 up to sampling noise,
+# and a best-responding opponent could take at least this much from anything
+# else. Returns (exploitability, standard error).
+def exploitability(agent_class, num_matches=500, seed=0):
+    import match_archive
+    import tournament
+    random.seed(seed)
+    scores = []
+    for seat in (0, 1):
+        recorder = match_archive.SeriesRecorder('agent', 'counter')
+        if seat == 0:
+            tournament.run_match_series(agent_class, CounterAgent, num_matches, recorder)
+        else:
+            tournament.run_match_series(CounterAgent, agent_class, num_matches, recorder)
+        scores.extend(match_archive.OUTCOME_SCORES[outcome][seat] for outcome in recorder.outcomes)
+    scores = np.array(scores)
+    return load_table().value() - scores.mean(), scores.std(ddof=1) / np.sqrt(len(scores))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Solve the fireball game and report how exploitable agents are.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build_parser = subparsers.add_parser('build', help="solve the game and write the lookup table")
+    build_parser.add_argument('--rounds', type=int, default=ROUNDS)
+    build_parser.add_argument('--out', default=SOLVER_TABLE_FILE)
+    report_parser = subparsers.add_parser('report', help="exploitability of agents in this directory")
+    report_parser.add_argument('agents', nargs='*', help="agent modules (default: every *_agent.py)")
+    report_parser.add_argument('--matches', type=int, default=500, help="matches per seat")
+    report_parser.add_argument('--seed', type=int, default=0)
+    report_parser.add_argument('--out', default=None, help="also write the report as JSON")
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        started = time.perf_counter()
+        table = SolverTable.solve(args.rounds)
+        table.save(args.out)
+        print(f"Solved {table.values.size} states in {time.perf_counter() - started:.1f}s, rounds up to "
+              f"{table.stationary_from()} share one table; game value {table.value():.6f}: {args.out}")
+        return
+
+    import importlib
+    import tournament
+    import tournament_plan
+    tournament.set_log_level(tournament.LOG_RESULTS)
+    agents = args.agents or [agent_file[:-3] for agent_file in tournament.find_agent_files()]
+    game_value = load_table().value()
+    print(f"Game value: {game_value:.4f} points per match")
+    report = {'game_value': game_value, 'matches': args.matches, 'seed': args.seed, 'agents': {}}
+    for name in agents:
+        value, error = exploitability(importlib.import_module(name).Agent, args.matches, args.seed)
+        report['agents'][name] = {'exploitability': value, 'standard_error': error}
+        print(f"{name}: exploitability {value:.4f} +/- {error:.4f}")
+    if args.out:
+        tournament_plan.save_json(report, args.out)
+
+if __name__ == '__main__':
+    sys.path.insert(0, os.getcwd())
+    main()
@@ -0,0 +1,249 @@
+import argparse
+import concurrent.futures
+import hashlib
+import importlib
+import os
+import sys
+import time
+
+import numpy as np
+
+import agent_worker
+import results_cache
+import rules
+import tournament
+import tournament_plan
+
+# Self-play search over a parameterized agent template. A candidate is a move
+# table: one move for every (opponent's last move, own loads 0/1/2+, mirror
+# available) state, which is exactly the state a vectorized_policy sees, so a
+# candidate plays batch_engine's many-games-at-once path against any opponent
+# that has one and the normal play() loop against the rest. Candidates are
+# rendered to agent source and evaluated from that source; the best one can
+# be written out as a regular *_agent.py file that plays identically.
+#
+# The search is the cross-entropy method: keep a distribution over the move
+# for each state, sample a population of tables from it, score each against
+# the field, and move the distribution towards the elite. Scores are cached
+# per (candidate code hash, opponent code hash), so candidates that come up
+# again and opponents that haven't changed are never replayed.
+SEARCH_CACHE_FILE = 'strategy_search_cache.json'
+LAST_MOVES = len(rules.MOVES) + 1  # opponent's last move, or none yet
+NUM_STATES = LAST_MOVES * 3 * 2
+
+AGENT_TEMPLATE = '''import numpy as np
+import rules
+
+# Generated by strategy_search.py. TABLE holds the move code to play for each
+# (opponent's last move + 1, own loads 0/1/2+, mirror available) state.
+TABLE = {table!r}
+POLICY = np.array(TABLE, dtype=np.intp)
+
+class Agent:
+    def __init__(self):
+        self.loads = 0
+        self.mirror = True
+
+    def play(self, opponent_last_move):
+        last = -1 if opponent_last_move is None else rules.MOVE_CODES[opponent_last_move]
+        bucket = 2 if self.loads >= 2 else self.loads
+        code = rules.LEGAL[TABLE[(last + 1) * 6 + bucket * 2 + self.mirror]][bucket][self.mirror]
+        self.loads += rules.LOAD_DELTA[code]
+        if code == rules.MIRROR:
+            self.mirror = False
+        return rules.MOVES[code]
+
+    @staticmethod
+    def vectorized_policy(opponent_last_move, loads, mirror, rng):
+        return POLICY.take((opponent_last_move + 1) * 6 + np.minimum(loads, 2) * 2 + mirror)
+'''
+
+# Moves that are legal in each state; the search never samples the others,
+# since the rules would turn them into a load anyway.
+def legal_mask():
+    mask = np.zeros((NUM_STATES, len(rules.MOVES)), dtype=bool)
+    for state in range(NUM_STATES):
+        bucket, mirror = (state // 2) % 3, state % 2
+        for code in range(len(rules.MOVES)):
+            mask[state, code] = rules.LEGAL[code][bucket][mirror] == code
+    return mask
+
+def agent_source(table):
+    return AGENT_TEMPLATE.format(table=tuple(int(code) for code in table))
+
+def source_hash(source):
+    return hashlib.sha256(source.encode('utf-8')).hexdigest()
+
+def make_agent_class(source, name):
+    namespace = {'__name__': name}
+    exec(compile(source, f"<{name}>", 'exec'), namespace)
+    agent_class = namespace['Agent']
+    agent_class.__module__ = name
+    return agent_class
+
+# Plays one candidate against the given opponents in both seats and returns
+# [(score as agent1, opponent's score), (opponent's score, score as agent2)]
+# per opponent. Runs in a pool process; each series is seeded from the
+# search seed and both agents' hashes, so a cached score is reproducible.
+def evaluate_candidate(table, opponents, num_matches, seed):
+    source = agent_source(table)
+    candidate_hash = source_hash(source)
+    candidate = make_agent_class(source, f"candidate_{candidate_hash[:12]}")
+    results = []
+    for opponent_name, opponent_hash in opponents:
+        opponent = tournament._load_worker_agent(opponent_name)
+        agent_worker.seed_random(tournament_plan.series_seed(seed, candidate_hash, opponent_hash))
+        first = tournament.run_match_series(candidate, opponent, num_matches)
+        agent_worker.seed_random(tournament_plan.series_seed(seed, opponent_hash, candidate_hash))
+        second = tournament.run_match_series(opponent, candidate, num_matches)
+        results.append((first, second))
+    return results
+
+# (name, code hash) of every opponent. Each is imported here so an agent that
+# doesn't load fails the search up front rather than in a pool worker.
+def load_field(directory='.', exclude=()):
+    field = []
+    for agent_file in tournament.find_agent_files(directory):
+        name = agent_file[:-3]
+        if name not in exclude:
+            importlib.import_module(name).Agent
+            field.append((name, results_cache.hash_agent_file(os.path.join(directory, agent_file))))
+    return field
+
+class StrategySearch:
+    def __init__(self, field, num_matches=100, population=32, elite_fraction=0.2, smoothing=0.7,
+                 min_probability=0.02, seed=0, cache_path=SEARCH_CACHE_FILE):
+        if not field:
+            raise ValueError("No opponents to search against")
+        self.field = field
+        self.num_matches = num_matches
+        self.population = population
+        self.num_elite = max(1, round(population * elite_fraction))
+        self.smoothing = smoothing
+        self.min_probability = min_probability
+        self.seed = seed
+        self.rng = np.random.default_rng(seed)
+        self.mask = legal_mask()
+        self.probabilities = self.mask / self.mask.sum(axis=1, keepdims=True)
+        self.cache = results_cache.ResultsCache(cache_path)
+        self.best = None  # (fitness, table)
+        self.history = []
+        self.games_played = 0
+
+    def sample(self):
+        cumulative = self.probabilities.cumsum(axis=1)
+        draws = self.rng.random((self.population, NUM_STATES, 1)) * cumulative[None, :, -1:]
+        return (draws >= cumulative[None]).sum(axis=2)
+
+    def _cached_scores(self, candidate_hash, opponent):
+        name, opponent_hash = opponent
+        first = self.cache.get(candidate_hash, name, candidate_hash, opponent_hash, self.num_matches)
+        second = self.cache.get(name, candidate_hash, opponent_hash, candidate_hash, self.num_matches)
+        if first is None or second is None:
+            return None
+        return first['score1'] + second['score2']
+
+    # Candidate fitness is its average points per match over both seats
+    # against every opponent, the same points a tournament would award.
+    def evaluate(self, tables, pool):
+        hashes = [source_hash(agent_source(table)) for table in tables]
+        totals = np.zeros(len(tables))
+        # Series still to play, per distinct candidate: a population can
+        # sample the same table more than once.
+        missing = {}
+        for i, candidate_hash in enumerate(hashes):
+            for opponent in self.field:
+                score = self._cached_scores(candidate_hash, opponent)
+                if score is None:
+                    if candidate_hash not in missing or opponent not in missing[candidate_hash][1]:
+                        missing.setdefault(candidate_hash, (i, []))[1].append(opponent)
+                else:
+                    totals[i] += score
+
+        futures = {pool.submit(evaluate_candidate, tables[i], opponents, self.num_matches, self.seed): candidate_hash
+                   for candidate_hash, (i, opponents) in missing.items()}
+        for future in concurrent.futures.as_completed(futures):
+            candidate_hash = futures[future]
+            opponents = missing[candidate_hash][1]
+            for (name, opponent_hash), ((score1, opponent1), (opponent2, score2)) in zip(opponents,
+                                                                                                 future.result()):
+                self.cache.put(candidate_hash, name, candidate_hash, opponent_hash, self.num_matches,
+                               score1, opponent1)
+                self.cache.put(name, candidate_hash, opponent_hash, candidate_hash, self.num_matches,
+                               opponent2, score2)
+                self.games_played += 2 * self.num_matches
+                for i, other_hash in enumerate(hashes):
+                    if other_hash == candidate_hash:
+                        totals[i] += score1 + score2
+        return totals / (2 * self.num_matches * len(self.field))
+
+    def step(self, pool):
+        tables = self.sample()
+        fitness = self.evaluate(tables, pool)
+        order = np.argsort(-fitness, kind='stable')
+        elite = tables[order[:self.num_elite]]
+        frequencies = np.zeros_like(self.probabilities)
+        for table in elite:
+            frequencies[np.arange(NUM_STATES), table] += 1
+        frequencies /= len(elite)
+        probabilities = self.smoothing * frequencies + (1 - self.smoothing) * self.probabilities
+        # A floor on every legal move keeps the search from freezing early.
+        probabilities = np.where(self.mask, np.maximum(probabilities, self.min_probability), 0)
+        self.probabilities = probabilities / probabilities.sum(axis=1, keepdims=True)
+
+        if self.best is None or fitness[order[0]] > self.best[0]:
+            self.best = (float(fitness[order[0]]), tables[order[0]].tolist())
+        self.history.append({'generation': len(self.history) + 1, 'best': float(fitness[order[0]]),
+                             'mean': float(fitness.mean()), 'best_so_far': self.best[0]})
+        return self.history[-1]
+
+    def run(self, generations=20, max_workers=None, on_generation=None):
+        with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers or os.cpu_count(),
+                                                    initializer=tournament.set_log_level,
+                                                    initargs=(tournament.LOG_RESULTS,)) as pool:
+            for _ in range(generations):
+                generation = self.step(pool)
+                self.cache.save()
+                if on_generation is not None:
+                    on_generation(generation)
+        return self.best
+
+def write_agent(table, path):
+    with open(path, 'w') as f:
+        f.write(agent_source(table))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Search for a move-table agent that scores best against the "
+                                                 "*_agent.py files in this directory.")
+    parser.add_argument('--generations', type=int, default=20)
+    parser.add_argument('--population', type=int, default=32, help="candidates per generation")
+    parser.add_argument('--elite', type=float, default=0.2, help="fraction of each generation the search follows")
+    parser.add_argument('--matches', type=int, default=100, help="matches per series")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=None, help="process pool size (default: os.cpu_count())")
+    parser.add_argument('--exclude', nargs='*', default=[], help="agents to leave out of the field")
+    parser.add_argument('--write', default=None, metavar='NAME', help="write the best candidate to NAME_agent.py")
+    parser.add_argument('--out', default='strategy_search.json', help="best table and per-generation history")
+    args = parser.parse_args(argv)
+
+    field = load_field(exclude=set(args.exclude) | ({f"{args.write}_agent"} if args.write else set()))
+    search = StrategySearch(field, args.matches, args.population, args.elite, seed=args.seed)
+    started = time.perf_counter()
+
+    def report(generation):
+        elapsed = time.perf_counter() - started
+        print(f"Generation {generation['generation']}: best {generation['best']:.3f}, "
+              f"mean {generation['mean']:.3f} points per match; {search.games_played / elapsed * 3600:,.0f} games/hour")
+
+    fitness, table = search.run(args.generations, args.workers, report)
+    print(f"Best candidate: {fitness:.3f} points per match against {len(field)} agents "
+          f"({search.games_played} games played, {search.cache.hits} series from cache)")
+    tournament_plan.save_json({'fitness': fitness, 'table': table, 'field': field, 'history': search.history},
+                              args.out)
+    if args.write:
+        write_agent(table, f"{args.write}_agent.py")
+        print(f"Wrote {args.write}_agent.py")
+
+if __name__ == '__main__':
+    sys.path.insert(0, os.getcwd())
+    main()
@@ -0,0 +1,61 @@
+import itertools
+
+import rules
+
+# The string-compare rules that Match used before the rules module, kept as
+# the reference the lookup tables are checked and timed against.
+def legacy_validate_move(move, loads, mirrorStatus):
+    if move == 'fireball' and loads < 1:
+        return 'load'
+    if move == 'tsunami' and loads < 2:
+        return 'load'
+    if move == 'mirror' and not mirrorStatus:
+        return 'load'
+    if move not in rules.MOVES:
+        return 'load'
+    return move
+
+def legacy_determine_winner(move1, move2):
+    if move1 == move2:
+        return None  # Draw
+    if move1 == 'fireball':
+        if move2 in ['load']:
+            return 0
+        elif move2 in ['mirror']:
+            return 1
+    if move1 == 'tsunami':
+        if move2 in ['load', 'shield']:
+            return 0
+        elif move2 in ['mirror']:
+            return 1
+    if move1 == 'mirror':
+        if move2 in ['fireball', 'tsunami']:
+            return 0
+    if (move2 == 'fireball' or move2 == 'tsunami') and move1 in 'load':
+        return 1
+    if (move1 == 'shield') and move2 == 'tsunami':
+        return 1
+    return None  # Draw
+
+# Everything an agent could plausibly return, including the substrings of
+# 'load' that the old `move1 in 'load'` check let through.
+QUIRK_MOVES = ['', 'l', 'lo', 'oa', 'oad', 'load ', 'Load', 'LOAD', 'fire', 'pass', None, 3, ['load']]
+CHECK_LOADS = [-3, -1, 0, 0.5, 1, 1.5, 2, 3, 10]
+CHECK_MIRRORS = [True, False, None, 0, 1]
+
+def _outcome(func, *args):
+    try:
+        return func(*args)
+    except TypeError:
+        return TypeError
+
+def test_rules_match_legacy_rules():
+    candidates = rules.MOVES + QUIRK_MOVES
+    for move, loads, mirror in itertools.product(candidates, CHECK_LOADS, CHECK_MIRRORS):
+        expected = _outcome(legacy_validate_move, move, loads, mirror)
+        actual = _outcome(rules.validate_move, move, loads, mirror)
+        assert actual == expected, f"validate_move({move!r}, {loads!r}, {mirror!r}): {actual!r} != {expected!r}"
+    for move1, move2 in itertools.product(candidates, repeat=2):
+        expected = _outcome(legacy_determine_winner, move1, move2)
+        actual = _outcome(rules.determine_winner, move1, move2)
+        assert actual == expected, f"determine_winner({move1!r}, {move2!r}): {actual!r} != {expected!r}"
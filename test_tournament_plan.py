@@ -0,0 +1,37 @@
+import os
+import subprocess
+import sys
+
+import benchmark
+import tournament_plan
+
+PLAN_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tournament_plan.py')
+
+# Stands in for several nodes: the plan is played as NUM_SHARDS shards in
+# concurrent tournament_plan.py processes, and their merged totals must be
+# exactly those of playing it as one shard here.
+NUM_SHARDS = 3
+
+def _plan_cli(*args, cwd):
+    return subprocess.Popen([sys.executable, PLAN_SCRIPT, *args], cwd=cwd, stdout=subprocess.DEVNULL)
+
+def test_merged_shards_match_single_node(tmp_path, monkeypatch):
+    benchmark.write_synthetic_field(str(tmp_path), 4, ('constant', 'random', 'stateful'))
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.syspath_prepend(str(tmp_path))
+    plan = tournament_plan.make_plan(num_matches=10, seed=7)
+    tournament_plan.save_json(plan, 'tournament_plan.json')
+
+    processes = [_plan_cli('run', 'tournament_plan.json', '--shard', str(k), '--of', str(NUM_SHARDS),
+                           '--workers', '1', '--out', f"shard_{k}.json", cwd=tmp_path)
+                 for k in range(NUM_SHARDS)]
+    single = tournament_plan.merge_shards(plan, [tournament_plan.run_shard(plan, max_workers=2)])
+    assert [process.wait() for process in processes] == [0] * NUM_SHARDS
+
+    merged = tournament_plan.merge_shards(plan, [tournament_plan.load_json(f"shard_{k}.json")
+                                                 for k in range(NUM_SHARDS)])
+    assert not merged.errors
+    assert len(merged.series) == len(plan['series'])
+    assert merged.totals == single.totals
+    assert [(series.agent1, series.agent2, series.score1, series.score2) for series in merged.series] == \
+           [(series.agent1, series.agent2, series.score1, series.score2) for series in single.series]
@@ -3,227 +3,737 @@ import os
 import sys
 import time
 import json
+import math
+import random
+import argparse
+import atexit
 import concurrent.futures
+import dataclasses
 import threading
 
-MOVES = ['shield', 'load', 'fireball', 'tsunami', 'mirror']
+import agent_worker
+import batch_engine
+import latency
+import match_archive
+import pairwise
+import profiling
+import progress
+import results_cache
+import rules
+import schedulers
+from output_writer import OutputWriter
+from rules import MOVES
+
 OUTPUT_FILE = 'tournament_output.txt'
 PROGRESS_FILE = 'tournament_progress.json'
 MATCH_FOLDER = 'match_results'
+ARCHIVE_FILE = os.path.join(MATCH_FOLDER, 'tournament.fbma')
+
+# Output verbosity: each level includes every level before it. Round lines
+# dwarf everything else, so production runs can stop at 'series' or 'matches'.
+LOG_RESULTS, LOG_SERIES, LOG_MATCHES, LOG_ROUNDS = range(4)
+LOG_LEVELS = {'results': LOG_RESULTS, 'series': LOG_SERIES, 'matches': LOG_MATCHES, 'rounds': LOG_ROUNDS}
+log_level = LOG_ROUNDS
+
+def set_log_level(level):
+    global log_level
+    log_level = level
+
+# Every process gets its own batching writer; after a fork the parent's writer
+# thread does not exist in the child, so a fresh one is started there.
+_output_writer = None
+_output_writer_lock = threading.Lock()
+
+def get_output_writer():
+    global _output_writer
+    writer = _output_writer
+    if writer is None or writer.pid != os.getpid():
+        with profiling.locked(_output_writer_lock, 'output_writer'):
+            writer = _output_writer
+            if writer is None or writer.pid != os.getpid():
+                writer = _output_writer = OutputWriter(OUTPUT_FILE)
+    return writer
+
+def write_output(message, level=LOG_RESULTS):
+    if level <= log_level:
+        if profiling.enabled:
+            with profiling.phase('logging'):
+                get_output_writer().write(message)
+        else:
+            get_output_writer().write(message)
+
+def flush_output():
+    writer = _output_writer
+    if writer is not None and writer.pid == os.getpid():
+        with profiling.phase('logging'):
+            writer.flush()
+
+def close_output():
+    global _output_writer
+    writer = _output_writer
+    if writer is not None and writer.pid == os.getpid():
+        writer.close()
+    _output_writer = None
+
+atexit.register(close_output)
+
+# Typed results returned by run_tournament and mirrored by its events.
+@dataclasses.dataclass
+class SeriesResult:
+    agent1: str
+    agent2: str
+    score1: float
+    score2: float
+    seconds: float
+    cached: bool = False
+    timings1: dict = None  # latency.AgentTimings.summary() for each side
+    timings2: dict = None
+    matches: int = None  # matches actually played when sampling adaptively
+    confidence: list = None  # bounds on agent1's mean per-match score lead, None below two matches
+
+    def to_dict(self):
+        return dataclasses.asdict(self)
+
+@dataclasses.dataclass
+class SeriesError:
+    agent1: str
+    agent2: str  # None when agent1 failed to load
+    type: str
+    message: str
+    traceback: str = ''
+
+    def to_dict(self):
+        return dataclasses.asdict(self)
+
+@dataclasses.dataclass
+class TournamentResult:
+    num_matches: int = 100
+    totals: dict = dataclasses.field(default_factory=dict)
+    series: list = dataclasses.field(default_factory=list)
+    errors: list = dataclasses.field(default_factory=list)
+    seconds: float = 0.0
+    timings: dict = dataclasses.field(default_factory=dict)  # agent -> latency.AgentTimings
 
-# Thread-safe writing to output file
-output_lock = threading.Lock()
-def write_output(message):
-       with output_lock:
-           with open(OUTPUT_FILE, 'ab') as f:
-               f.write((message + '\n').encode('utf-8', errors='replace'))
-
-# Thread-safe progress update
-progress_lock = threading.Lock()
-def update_progress(current, total):
-    with progress_lock:
-        progress = {
-            'current': current,
-            'total': total,
-            'percentage': (current / total) * 100
+    def add_timings(self, agent_name, timings):
+        self.timings.setdefault(agent_name, latency.AgentTimings()).merge(timings)
+
+    def standings(self):
+        return sorted(self.totals.items(), key=lambda x: x[1], reverse=True)
+
+    def to_dict(self):
+        return {
+            'num_matches': self.num_matches,
+            'standings': self.standings(),
+            'totals': self.totals,
+            'series': [series.to_dict() for series in self.series],
+            'errors': [error.to_dict() for error in self.errors],
+            'seconds': self.seconds,
+            'latency': {agent: timings.summary() for agent, timings in self.timings.items()},
         }
-        with open(PROGRESS_FILE, 'w') as f:
-            json.dump(progress, f)
 
+# Structured events for whoever is driving the tournament: run_tournament's
+# on_event callback, or JSON lines on stdout with --events. Agents share that
+# stdout with anything they print, so a program reading the events should
+# hand over a pipe of its own with --events-fd instead.
+_event_handler = None
+
+def set_event_handler(handler):
+    global _event_handler
+    previous, _event_handler = _event_handler, handler
+    return previous
+
+def emit_event(event, **data):
+    if _event_handler is not None:
+        _event_handler(event, data)
+
+def json_lines_handler(stream):
+    def handle(event, data):
+        stream.write(json.dumps({'event': event, **data}) + '\n')
+        stream.flush()
+    return handle
+
+def _record_error(result, agent_name1, agent_name2, exc):
+    import traceback
+    error = SeriesError(agent_name1, agent_name2, type(exc).__name__, str(exc),
+                        ''.join(traceback.format_exception(exc)))
+    result.errors.append(error)
+    emit_event('error', **error.to_dict())
+
+# Progress is published from the tournament's main thread, coalesced to at
+# most one update per progress.PUBLISH_INTERVAL (see progress.py).
+def publish_progress(reporter, force=False):
+    with profiling.phase('progress'):
+        return reporter.publish(force)
+
+def _emit_progress(record):
+    emit_event('progress', **record)
+
+# Yields futures as they finish like concurrent.futures.as_completed, and
+# calls tick() at least every interval seconds while waiting.
+def _as_completed(futures, tick, interval=progress.PUBLISH_INTERVAL):
+    pending = set(futures)
+    while pending:
+        done, pending = concurrent.futures.wait(pending, timeout=interval,
+                                                return_when=concurrent.futures.FIRST_COMPLETED)
+        yield from done
+        tick()
+
+def _init_worker(verbosity, counters):
+    set_log_level(verbosity)
+    progress.set_counters(counters)
+
+# State of one match between two agent instances. A series plays all of its
+# matches on one Match: run() starts by clearing the state in place, moves
+# are kept as one packed byte per round (the archive format) and log lines are
+# only formatted at a log level that writes them, so a series takes the same
+# memory however long it runs and however much is logged.
 class Match:
-    def __init__(self, agent1, agent2, reset_between_games=True):
+    __slots__ = ('agent1', 'agent2', 'name1', 'name2', 'timings1', 'timings2', 'move_budget_ns',
+                 'loads1', 'loads2', 'mirror1', 'mirror2', 'rounds', 'outcome')
+
+    def __init__(self, agent1, agent2, timings=None, move_budget=None):
         self.agent1 = agent1
         self.agent2 = agent2
-        self.reset_between_games = reset_between_games
+        self.name1 = agent1.__class__.__name__
+        self.name2 = agent2.__class__.__name__
+        self.timings1, self.timings2 = timings or (latency.AgentTimings(), latency.AgentTimings())
+        # Seconds a single play() call may take before that agent forfeits the
+        # round. play() can't be interrupted in-process, but the match ends on
+        # the first slow move instead of paying for it every round. The budget
+        # is charged in the calling thread's CPU time: wall time would also
+        # bill an agent for waiting on the GIL or for being descheduled while
+        # other series run, which a loaded pool does all the time.
+        self.move_budget_ns = None if move_budget is None else int(move_budget * 1e9)
+        self.rounds = bytearray()
+        self.new_match()
+
+    def new_match(self):
         self.loads1 = 0
         self.loads2 = 0
         self.mirror1 = True
         self.mirror2 = True
-        self.match_log = []
+        self.rounds.clear()
+        self.outcome = None
 
     def validate_move(self, move, loads, mirrorStatus):
-        if move == 'fireball' and loads < 1:
-            return 'load'
-        if move == 'tsunami' and loads < 2:
-            return 'load'
-        if move == 'mirror' and not mirrorStatus:
-            return 'load'
-        if move not in MOVES:
-            return 'load'
-        return move
+        return rules.validate_move(move, loads, mirrorStatus)
 
     def determine_winner(self, move1, move2):
-        if move1 == move2:
-            return None  # Draw
-        if move1 == 'fireball':
-            if move2 in ['load']:
-                return 0
-            elif move2 in ['mirror']:
-                return 1
-        if move1 == 'tsunami':
-            if move2 in ['load', 'shield']:
-                return 0
-            elif move2 in ['mirror']:
-                return 1
-        if move1 == 'mirror':
-            if move2 in ['fireball', 'tsunami']:
-                return 0
-        if (move2 == 'fireball' or move2 == 'tsunami') and move1 in 'load':
-            return 1
-        if (move1 == 'shield') and move2 == 'tsunami':
-            return 1
-        return None  # Draw
+        return rules.determine_winner(move1, move2)
 
     def run_round(self, last_move1, last_move2):
+        budgeted = self.move_budget_ns is not None
+        start = time.perf_counter_ns()
+        cpu_start = time.thread_time_ns() if budgeted else 0
         move1 = self.agent1.play(last_move2)
+        middle = time.perf_counter_ns()
+        cpu_middle = time.thread_time_ns() if budgeted else 0
         move2 = self.agent2.play(last_move1)
+        end = time.perf_counter_ns()
+        cpu_end = time.thread_time_ns() if budgeted else 0
+        self.timings1.play.record(middle - start)
+        self.timings2.play.record(end - middle)
+
+        code1 = rules.legal_move(move1, self.loads1, self.mirror1)
+        code2 = rules.legal_move(move2, self.loads2, self.mirror2)
+        move1 = MOVES[code1]
+        move2 = MOVES[code2]
+        self.rounds.append((code1 << 4) | code2)
+        if log_level >= LOG_ROUNDS:
+            write_output(f"{self.name1} vs {self.name2}: {move1} vs {move2}", LOG_ROUNDS)
 
-        move1 = self.validate_move(move1, self.loads1, self.mirror1)
-        move2 = self.validate_move(move2, self.loads2, self.mirror2)
-        round_result = f"{self.agent1.__class__.__name__} vs {self.agent2.__class__.__name__}: {move1} vs {move2}"
-        self.match_log.append(round_result)
-        write_output(round_result)
-
-        if move1 == 'load':
-            self.loads1 += 1
-        if move2 == 'load':
-            self.loads2 += 1
-        if move1 == 'fireball':
-            self.loads1 -= 1
-        if move2 == 'fireball':
-            self.loads2 -= 1
-        if move1 == 'tsunami':
-            self.loads1 -= 2
-        if move2 == 'tsunami':
-            self.loads2 -= 2
-        if move1 == 'mirror':
+        self.loads1 += rules.LOAD_DELTA[code1]
+        self.loads2 += rules.LOAD_DELTA[code2]
+        if code1 == rules.MIRROR:
             self.mirror1 = False
-        if move2 == 'mirror':
+        if code2 == rules.MIRROR:
             self.mirror2 = False
-        winner = self.determine_winner(move1, move2)
+        winner = rules.OUTCOME[code1][code2]
+
+        if budgeted:
+            over1 = cpu_middle - cpu_start > self.move_budget_ns
+            over2 = cpu_end - cpu_middle > self.move_budget_ns
+            if over1:
+                self.timings1.forfeits += 1
+            if over2:
+                self.timings2.forfeits += 1
+            if over1 and not over2:
+                winner = 1
+            elif over2 and not over1:
+                winner = 0
 
         return winner, move1, move2
 
+    # Plays one match from the current agent instances; resetting them in
+    # between is up to the caller (see run_match_series).
     def run(self, rounds=100):
-        score1, score2 = 0, 0
+        self.new_match()
         last_move1, last_move2 = None, None
 
         for _ in range(rounds):
             winner, move1, move2 = self.run_round(last_move1, last_move2)
-            if winner == 0:
-                score1 += 1
-                result = f"{self.agent1.__class__.__name__} wins!"
-                self.match_log.append(result)
-                write_output(result)
-                break
-            elif winner == 1:
-                score2 += 1
-                result = f"{self.agent2.__class__.__name__} wins!"
-                self.match_log.append(result)
-                write_output(result)
+            if winner is not None:
                 break
             last_move1, last_move2 = move1, move2
         else:
-            score1 += 1.1
-            score2 += 1.1
-            result = "Draw!"
-            self.match_log.append(result)
-            write_output(result)
+            winner = match_archive.DRAW
 
-        if self.reset_between_games:
-            self.agent1.__init__()
-            self.agent2.__init__()
+        self.outcome = winner
+        if log_level >= LOG_MATCHES:
+            if winner == match_archive.DRAW:
+                write_output("Draw!", LOG_MATCHES)
+            else:
+                write_output(f"{self.name2 if winner else self.name1} wins!", LOG_MATCHES)
+        return match_archive.OUTCOME_SCORES[winner]
 
-        return score1, score2
+# Every match of a series starts from agents in their initial state: the
+# instances made for the first match are reset before each later one under the
+# latency.reset_method protocol, so stateless agents skip the reset altogether.
+def run_match_series(agent_class1, agent_class2, num_matches=100, recorder=None, timings=None, move_budget=None):
+    if isinstance(agent_class1, agent_worker.SandboxedAgent):
+        return run_sandboxed_series(agent_class1, agent_class2, num_matches, recorder, timings, move_budget)
+
+    policy1 = batch_engine.get_vectorized_policy(agent_class1)
+    policy2 = batch_engine.get_vectorized_policy(agent_class2)
+    if policy1 is not None and policy2 is not None:
+        return run_batch_series(agent_class1, agent_class2, policy1, policy2, num_matches, recorder)
 
-def run_match_series(agent_class1, agent_class2, num_matches=100, reset_between_games=True):
     total_score1, total_score2 = 0, 0
-    agent1_name = agent_class1.__module__
-    agent2_name = agent_class2.__module__
-    match_folder = os.path.join(MATCH_FOLDER, f"{agent1_name}_vs_{agent2_name}")
-    os.makedirs(match_folder, exist_ok=True)
+    timings = timings or (latency.AgentTimings(), latency.AgentTimings())
+    timings1, timings2 = timings
 
+    start = time.perf_counter_ns()
     agent1 = agent_class1()
+    middle = time.perf_counter_ns()
     agent2 = agent_class2()
+    timings1.reset.record(middle - start)
+    timings2.reset.record(time.perf_counter_ns() - middle)
+    reset1 = latency.reset_method(agent1)
+    reset2 = latency.reset_method(agent2)
 
+    match = Match(agent1, agent2, timings, move_budget)
     for match_num in range(num_matches):
-        match = Match(agent1, agent2, reset_between_games)
+        if match_num:
+            if reset1 is not None:
+                start = time.perf_counter_ns()
+                reset1()
+                timings1.reset.record(time.perf_counter_ns() - start)
+            if reset2 is not None:
+                start = time.perf_counter_ns()
+                reset2()
+                timings2.reset.record(time.perf_counter_ns() - start)
         score1, score2 = match.run()
         total_score1 += score1
         total_score2 += score2
+        if recorder is not None:
+            recorder.add_match(match.rounds, match.outcome)
+        progress.record(1, len(match.rounds))
 
-        # Save individual match result
-        match_file = os.path.join(match_folder, f"match_{match_num+1}.txt")
-        with open(match_file, 'w') as f:
-            f.write(f"{agent1_name} vs {agent2_name}\n")
-            f.write("\n".join(match.match_log))
-            f.write(f"\nFinal Score: {score1} - {score2}\n")
+    return total_score1, total_score2
 
-        if not reset_between_games:
-            agent1.__init__()
-            agent2.__init__()
+# Both agents declared a vectorized policy, so every match of the series is
+# simulated at once as array operations instead of calling play() per round.
+def run_batch_series(agent_class1, agent_class2, policy1, policy2, num_matches=100, recorder=None):
+    # Drawn from the global random state so seeding a series also seeds this.
+    rng = batch_engine.np.random.default_rng(random.getrandbits(64))
+    result = batch_engine.simulate_series(policy1, policy2, num_matches, rng=rng)
+    rounds_played = result.rounds_played.tolist()
+    outcomes = result.outcomes.tolist()
 
+    if recorder is not None or log_level >= LOG_MATCHES:
+        name1, name2 = agent_class1.__name__, agent_class2.__name__
+        for match_num, (outcome, num_rounds) in enumerate(zip(outcomes, rounds_played)):
+            rounds = result.moves[match_num, :num_rounds].tobytes()
+            if recorder is not None:
+                recorder.add_match(rounds, outcome)
+            _log_match(name1, name2, rounds, outcome)
+    progress.record(num_matches, sum(rounds_played))
+
+    return batch_engine.series_scores(result.outcomes)
+
+# Agents hosted in agent_worker subprocesses play the whole series as
+# concurrent games; only the move codes cross the pipes.
+def run_sandboxed_series(agent1, agent2, num_matches=100, recorder=None, timings=None, move_budget=None):
+    timings = timings or (latency.AgentTimings(), latency.AgentTimings())
+    results = agent_worker.play_series(agent1, agent2, num_matches, timings, move_budget)
+    total_score1, total_score2 = 0, 0
+    for rounds, outcome in results:
+        score1, score2 = match_archive.OUTCOME_SCORES[outcome]
+        total_score1 += score1
+        total_score2 += score2
+        if recorder is not None:
+            recorder.add_match(rounds, outcome)
+        if log_level >= LOG_MATCHES:
+            _log_match(agent1.__name__, agent2.__name__, rounds, outcome)
+    progress.record(len(results), sum(len(rounds) for rounds, _ in results))
     return total_score1, total_score2
 
-def main():
-    open(OUTPUT_FILE, 'w').close()
-    open(PROGRESS_FILE, 'w').close()
-    os.makedirs(MATCH_FOLDER, exist_ok=True)
+# Log lines for a match that was played without going through Match.
+def _log_match(name1, name2, rounds, outcome):
+    if log_level >= LOG_ROUNDS:
+        for packed in rounds:
+            write_output(f"{name1} vs {name2}: {MOVES[packed >> 4]} vs {MOVES[packed & 0x0F]}", LOG_ROUNDS)
+    if outcome == match_archive.DRAW:
+        write_output("Draw!", LOG_MATCHES)
+    else:
+        write_output(f"{name2 if outcome else name1} wins!", LOG_MATCHES)
+
+# Plays a series and packs its matches into an archive segment, which the
+# parent appends to the tournament archive. With a schedulers.AdaptiveSampling
+# the series is played in blocks until the result is settled; the last item is
+# then (matches played, confidence bounds), otherwise None. A seed makes the
+# series reproducible as long as nothing else touches the global RNGs while
+# it runs, i.e. on a process pool.
+def record_match_series(agent_class1, agent_class2, num_matches=100, move_budget=None, sampling=None, seed=None):
+    started = time.perf_counter()
+    if seed is not None:
+        agent_worker.seed_random(seed)
+    recorder = match_archive.SeriesRecorder(agent_class1.__module__, agent_class2.__module__,
+                                            agent_class1.__name__, agent_class2.__name__)
+    timings = (latency.AgentTimings(), latency.AgentTimings())
+    try:
+        score1, score2, sampled = _play_recorded_series(agent_class1, agent_class2, num_matches, move_budget,
+                                                        sampling, recorder, timings)
+    except BaseException:
+        # A failed series doesn't count as played, so the matches it already
+        # added to the progress counters come off again.
+        progress.record(-len(recorder.outcomes),
+                        -sum(len(record) - match_archive.MATCH_HEADER.size for record in recorder.records))
+        raise
+    return score1, score2, recorder.segment(), time.perf_counter() - started, timings, sampled
+
+def _play_recorded_series(agent_class1, agent_class2, num_matches, move_budget, sampling, recorder, timings):
+    if sampling is None:
+        score1, score2 = run_match_series(agent_class1, agent_class2, num_matches, recorder, timings, move_budget)
+        return score1, score2, None
+
+    score1, score2, played = 0, 0, 0
+    while played < sampling.max_matches:
+        block = sampling.next_block(played)
+        block_score1, block_score2 = run_match_series(agent_class1, agent_class2, block, recorder, timings,
+                                                      move_budget)
+        score1 += block_score1
+        score2 += block_score2
+        played += block
+        if sampling.settled(recorder.outcomes):
+            break
+    # JSON has no infinity, so a lead too few matches to bound is reported
+    # without bounds.
+    bounds = sampling.bounds(recorder.outcomes)
+    return (sampling.scale(score1, played), sampling.scale(score2, played),
+            (played, bounds if all(map(math.isfinite, bounds)) else None))
+
+# Process-pool workers import each agent module once and keep the class around
+# for every series they are handed, so only module names cross the pipe.
+_worker_agent_classes = {}
+
+def _load_worker_agent(module_name):
+    agent_class = _worker_agent_classes.get(module_name)
+    if agent_class is None:
+        agent_class = importlib.import_module(module_name).Agent
+        _worker_agent_classes[module_name] = agent_class
+    return agent_class
 
-    agent_files = [f for f in os.listdir('.') if f.endswith('_agent.py')]
+def run_match_series_by_name(agent_name1, agent_name2, num_matches=100, move_budget=None, sampling=None, seed=None):
+    agent_class1 = _load_worker_agent(agent_name1)
+    agent_class2 = _load_worker_agent(agent_name2)
+    result = record_match_series(agent_class1, agent_class2, num_matches, move_budget, sampling, seed)
+    # Make sure this series' lines are on disk before the parent can write the
+    # final results block.
+    flush_output()
+    return result
+
+# Sorted so every node and every run sees the agents in the same order.
+def find_agent_files(directory='.'):
+    return sorted(f for f in os.listdir(directory) if f.endswith('_agent.py'))
+
+# 'sandbox' drives series from threads, but every agent runs in its own
+# resource-limited agent_worker subprocess instead of being imported here.
+EXECUTORS = {
+    'thread': concurrent.futures.ThreadPoolExecutor,
+    'process': concurrent.futures.ProcessPoolExecutor,
+    'sandbox': concurrent.futures.ThreadPoolExecutor,
+}
+
+def run_tournament(executor='thread', max_workers=None, verbosity=LOG_ROUNDS, num_matches=100, use_cache=True,
+                   on_event=None, move_budget=None, memory_mb=agent_worker.DEFAULT_MEMORY_MB, cpu_seconds=None,
+                   scheduler='round-robin', swiss_rounds=None, adaptive=False, resume=False, profile=False):
+    # Profiling is switched on for the whole process, so it is switched off
+    # again however the tournament ends.
+    if not profile:
+        return _run_tournament(executor, max_workers, verbosity, num_matches, use_cache, on_event, move_budget,
+                               memory_mb, cpu_seconds, scheduler, swiss_rounds, adaptive, resume, None)
+    profiling.enable()
+    try:
+        return _run_tournament(executor, max_workers, verbosity, num_matches, use_cache, on_event, move_budget,
+                               memory_mb, cpu_seconds, scheduler, swiss_rounds, adaptive, resume,
+                               profiling.TournamentProfile())
+    finally:
+        profiling.disable()
+
+def _run_tournament(executor, max_workers, verbosity, num_matches, use_cache, on_event, move_budget, memory_mb,
+                    cpu_seconds, scheduler, swiss_rounds, adaptive, resume, tournament_profile):
+    if executor not in EXECUTORS:
+        raise ValueError(f"Unknown executor '{executor}', expected one of: {', '.join(EXECUTORS)}")
+    if scheduler not in schedulers.SCHEDULERS:
+        raise ValueError(f"Unknown scheduler '{scheduler}', expected one of: {', '.join(schedulers.SCHEDULERS)}")
+    started = time.perf_counter()
+    result = TournamentResult(num_matches=num_matches)
+    previous_handler = set_event_handler(on_event) if on_event is not None else None
+    close_output()
+    set_log_level(verbosity)
+    # A resumed run carries on the interrupted run's output instead of
+    # starting it over.
+    if not resume:
+        open(OUTPUT_FILE, 'w').close()
+    # With the cache on or when resuming, series that aren't replayed keep
+    # their segments from earlier runs.
+    archive = match_archive.ArchiveWriter(ARCHIVE_FILE, truncate=not (use_cache or resume))
+    cache = results_cache.ResultsCache() if use_cache else None
+    checkpoint = results_cache.Checkpoint(resume=resume)
+    if resume:
+        write_output(f"\nResuming with {len(checkpoint.entries)} series from {checkpoint.path}.")
+
+    agent_files = find_agent_files()
+    workers = agent_worker.AgentWorkerPool(memory_mb, cpu_seconds) if executor == 'sandbox' else None
     agent_classes = {}
+    agent_hashes = {}
 
     write_output("Loading agents...")
     for agent_file in agent_files:
         module_name = agent_file[:-3]
-        module = importlib.import_module(module_name)
-        agent_classes[module_name] = module.Agent
+        try:
+            if workers is not None:
+                agent_classes[module_name] = agent_worker.SandboxedAgent(workers, module_name)
+            else:
+                agent_classes[module_name] = importlib.import_module(module_name).Agent
+        except Exception as exc:
+            write_output(f"Failed to load {module_name}: {type(exc).__name__}: {exc}")
+            _record_error(result, module_name, None, exc)
+            continue
+        agent_hashes[module_name] = results_cache.hash_agent_file(agent_file)
         write_output(f"Loaded: {module_name}")
 
-    scores = {agent_name: 0 for agent_name in agent_classes.keys()}
+    if cache is not None:
+        evicted = cache.evict(agent_hashes.values())
+        if evicted:
+            write_output(f"Evicted {evicted} cached series for deleted or edited agents.")
+
+    scores = result.totals
+    scores.update({agent_name: 0 for agent_name in agent_classes.keys()})
     write_output(f"Loaded {len(agent_classes)} agents.")
 
     agent_names = list(agent_classes.keys())
-    total_matches = len(agent_names) * (len(agent_names) - 1)
+    scheduler = schedulers.make_scheduler(scheduler, agent_names, swiss_rounds)
+    sampling = schedulers.AdaptiveSampling(num_matches) if adaptive else None
+    sampling_key = None if sampling is None else sampling.key()
+    total_matches = scheduler.total_series
     matches_played = 0
+    played_pairs = set()
 
     write_output("\nStarting tournament...")
+    emit_event('started', agents=agent_names, total=total_matches)
+
+    use_processes = executor == 'process'
+    # Series count their matches and rounds here as they play them.
+    counters = progress.Counters(shared=use_processes)
+    reporter = progress.ProgressReporter(PROGRESS_FILE, total_matches, num_matches, counters, _emit_progress)
+    publish_progress(reporter, force=True)
 
-    with concurrent.futures.ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
-        future_to_match = {}
-        for i, agent_name1 in enumerate(agent_names):
-            for j, agent_name2 in enumerate(agent_names):
-                if i != j:
-                    reset_between_games = getattr(agent_classes[agent_name1], 'reset_between_games', True) and getattr(agent_classes[agent_name2], 'reset_between_games', True)
-                    future = executor.submit(run_match_series, agent_classes[agent_name1], agent_classes[agent_name2], reset_between_games=reset_between_games)
-                    future_to_match[future] = (agent_name1, agent_name2)
-
-        for future in concurrent.futures.as_completed(future_to_match):
-            agent_name1, agent_name2 = future_to_match[future]
-            try:
-                score1, score2 = future.result()
-                scores[agent_name1] += score1
-                scores[agent_name2] += score2
-                matches_played += 1
-                update_progress(matches_played, total_matches)
-                write_output(f"Match completed: {agent_name1} vs {agent_name2}")
-                write_output(f"Progress: {matches_played}/{total_matches} matches completed")
-            except Exception as exc:
-                import traceback
-                error_msg = f"""
+    with EXECUTORS[executor](max_workers=max_workers or os.cpu_count(),
+                             initializer=_init_worker, initargs=(verbosity, counters)) as pool:
+        # Each scheduler round is played out before the next one is paired,
+        # since Swiss pairings depend on the standings it produced.
+        while True:
+            pairings = scheduler.next_round(result.standings())
+            if not pairings:
+                break
+            round_series = []
+            future_to_match = {}
+            for agent_name1, agent_name2 in pairings:
+                played_pairs.add((agent_name1, agent_name2))
+                series_key = (agent_name1, agent_name2, agent_hashes[agent_name1], agent_hashes[agent_name2], num_matches, move_budget, sampling_key)
+                # Series finished before an interruption come back from the
+                # checkpoint; unchanged pairings from earlier runs from the cache.
+                stored, source = checkpoint.get(*series_key), 'restored'
+                if stored is None and cache is not None:
+                    stored, source = cache.get(*series_key), 'cached'
+                if stored is not None:
+                    scores[agent_name1] += stored['score1']
+                    scores[agent_name2] += stored['score2']
+                    matches_played += 1
+                    reporter.series_done()
+                    write_output(f"Match {source}: {agent_name1} vs {agent_name2}", LOG_SERIES)
+                    series = SeriesResult(agent_name1, agent_name2, stored['score1'], stored['score2'], 0.0, True,
+                                          matches=stored.get('matches'), confidence=stored.get('confidence'))
+                    if stored.get('timings'):
+                        timings1, timings2 = (latency.AgentTimings.from_dict(side) for side in stored['timings'])
+                        result.add_timings(agent_name1, timings1)
+                        result.add_timings(agent_name2, timings2)
+                        series.timings1, series.timings2 = timings1.summary(), timings2.summary()
+                    result.series.append(series)
+                    round_series.append(series)
+                    emit_event('series', **series.to_dict())
+                    continue
+                if use_processes:
+                    series_args = (run_match_series_by_name, agent_name1, agent_name2, num_matches, move_budget, sampling)
+                else:
+                    series_args = (record_match_series, agent_classes[agent_name1], agent_classes[agent_name2], num_matches, move_budget, sampling)
+                if tournament_profile is not None:
+                    future = pool.submit(profiling.run_profiled, *series_args)
+                else:
+                    future = pool.submit(*series_args)
+                future_to_match[future] = (agent_name1, agent_name2)
+
+            if cache is not None or resume:
+                write_output(f"Reused {len(round_series)} cached series, scheduled {len(future_to_match)}.")
+                if round_series:
+                    publish_progress(reporter)
+
+            for future in _as_completed(future_to_match, lambda: publish_progress(reporter)):
+                agent_name1, agent_name2 = future_to_match[future]
+                try:
+                    series_result = future.result()
+                    if tournament_profile is not None:
+                        series_result, series_profile = series_result
+                    score1, score2, segment, seconds, (timings1, timings2), sampled = series_result
+                    if tournament_profile is not None:
+                        tournament_profile.add(series_profile, seconds, (timings1, timings2))
+                    matches, confidence = sampled if sampled is not None else (None, None)
+                    with profiling.phase('disk:archive'):
+                        archive.append_segment(agent_name1, agent_name2, segment)
+                    with profiling.phase('disk:checkpoint'):
+                        checkpoint.record(agent_hashes[agent_name1], agent_hashes[agent_name2], num_matches,
+                                          results_cache.ResultsCache.entry(agent_name1, agent_name2, score1, score2,
+                                                                           (timings1, timings2), matches, confidence),
+                                          move_budget, sampling_key)
+                    if cache is not None:
+                        cache.put(agent_name1, agent_name2, agent_hashes[agent_name1], agent_hashes[agent_name2],
+                                  num_matches, score1, score2, move_budget, (timings1, timings2),
+                                  sampling_key, matches, confidence)
+                    scores[agent_name1] += score1
+                    scores[agent_name2] += score2
+                    matches_played += 1
+                    result.add_timings(agent_name1, timings1)
+                    result.add_timings(agent_name2, timings2)
+                    series = SeriesResult(agent_name1, agent_name2, score1, score2, seconds, False,
+                                          timings1.summary(), timings2.summary(), matches, confidence)
+                    result.series.append(series)
+                    round_series.append(series)
+                    emit_event('series', **series.to_dict())
+                    reporter.series_done(num_matches if matches is None else matches)
+                    publish_progress(reporter)
+                    write_output(f"Match completed: {agent_name1} vs {agent_name2}", LOG_SERIES)
+                    write_output(f"Progress: {matches_played}/{total_matches} matches completed", LOG_SERIES)
+                except Exception as exc:
+                    import traceback
+                    error_msg = f"""
         Error in match between {agent_name1} and {agent_name2}:
         Exception type: {type(exc).__name__}
         Exception message: {str(exc)}
         Traceback:
         {traceback.format_exc()}
         """
-                write_output(error_msg)
+                    write_output(error_msg)
+                    _record_error(result, agent_name1, agent_name2, exc)
+                    # record_match_series took the failed series' matches off
+                    # the counters again, so it finishes with none.
+                    reporter.series_done()
+
+            if scheduler.bye is not None:
+                bye_score = scheduler.bye_score(round_series)
+                scores[scheduler.bye] += bye_score
+                write_output(f"Bye: {scheduler.bye} ({bye_score:.2f} points)", LOG_SERIES)
+                emit_event('bye', agent=scheduler.bye, score=bye_score)
 
-    sorted_scores = sorted(scores.items(), key=lambda x: x[1], reverse=True)
+    publish_progress(reporter, force=True)
+    progress.set_counters(None)
+    sorted_scores = result.standings()
 
     write_output("\nTournament Results:")
     for agent_name, score in sorted_scores:
         write_output(f"{agent_name}: {score} points")
+    if cache is not None:
+        with profiling.phase('disk:cache'):
+            cache.save()
+    checkpoint.close(remove=True)
+    if workers is not None:
+        workers.close()
+    with profiling.phase('disk:archive'):
+        archive.retain(played_pairs)
+        archive.close()
+    # Per-pair wins/losses/draws and ratings over every series in the archive,
+    # cached ones included, for the head-to-head views.
+    if agent_names:
+        with profiling.phase('disk:pairwise'):
+            pairwise.PairwiseMatrix.from_archive(ARCHIVE_FILE, agent_names).save(pairwise.MATRIX_FILE)
+    close_output()
+
+    result.seconds = time.perf_counter() - started
+    if tournament_profile is not None:
+        tournament_profile.write(result.seconds, os.path.join(os.path.dirname(OUTPUT_FILE), profiling.PROFILE_FOLDER))
+    emit_event('results', **result.to_dict())
+    if on_event is not None:
+        set_event_handler(previous_handler)
+    return result
+
+def main(executor='thread', max_workers=None, verbosity=LOG_ROUNDS, num_matches=100, use_cache=True, move_budget=None,
+         memory_mb=agent_worker.DEFAULT_MEMORY_MB, cpu_seconds=None, scheduler='round-robin', swiss_rounds=None,
+         adaptive=False, resume=False, profile=False):
+    return run_tournament(executor, max_workers, verbosity, num_matches, use_cache, move_budget=move_budget,
+                          memory_mb=memory_mb, cpu_seconds=cpu_seconds, scheduler=scheduler,
+                          swiss_rounds=swiss_rounds, adaptive=adaptive, resume=resume, profile=profile).totals
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run a round-robin tournament between all *_agent.py files.")
+    parser.add_argument('--executor', choices=sorted(EXECUTORS), default='thread',
+                        help="run series on a thread pool (default), a process pool that uses every core, "
+                             "or with each agent sandboxed in its own worker process")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="number of pool workers (default: os.cpu_count())")
+    parser.add_argument('--log-level', choices=list(LOG_LEVELS), default='rounds',
+                        help="how much detail goes to the output file; 'rounds' logs every move")
+    parser.add_argument('--matches', type=int, default=100, help="matches per series")
+    parser.add_argument('--scheduler', choices=list(schedulers.SCHEDULERS), default='round-robin',
+                        help="play every ordered pairing, or Swiss rounds paired by current standings")
+    parser.add_argument('--swiss-rounds', type=int, default=None,
+                        help="number of Swiss rounds (default: ceil(log2(agents)) + 2)")
+    parser.add_argument('--adaptive', action='store_true',
+                        help="stop each series early once its result is statistically settled; "
+                             "scores are scaled to --matches")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="replay every series instead of reusing cached results for unchanged agents")
+    parser.add_argument('--move-budget-ms', type=float, default=None,
+                        help="an agent whose play() uses more CPU time than this forfeits the round")
+    parser.add_argument('--memory-mb', type=int, default=agent_worker.DEFAULT_MEMORY_MB,
+                        help="address-space limit for each sandboxed agent worker (0 for none)")
+    parser.add_argument('--cpu-seconds', type=int, default=None,
+                        help="CPU seconds each sandboxed agent may use per series; workers are recycled between "
+                             "series once they have used that much, and one that hits it mid-series is "
+                             "restarted")
+    parser.add_argument('--resume', action='store_true',
+                        help="carry on an interrupted tournament, replaying only series missing from its checkpoint")
+    parser.add_argument('--events', action='store_true',
+                        help="print progress, series results and final standings as JSON lines on stdout")
+    parser.add_argument('--events-fd', type=int, default=None, metavar='FD',
+                        help="write the --events JSON lines to this inherited file descriptor instead of stdout, "
+                             "apart from anything agents print")
+    parser.add_argument('--profile', action='store_true',
+                        help=f"profile every series and write a merged report, pstats files and folded stacks "
+                             f"for flame graphs to {profiling.PROFILE_FOLDER}/")
+    return parser.parse_args(argv)
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    args = parse_args()
+    events = None
+    if args.events_fd is not None:
+        events = os.fdopen(args.events_fd, 'w')
+    elif args.events:
+        events = sys.stdout
+    run_tournament(executor=args.executor, max_workers=args.workers, verbosity=LOG_LEVELS[args.log_level],
+                   num_matches=args.matches, use_cache=not args.no_cache,
+                   on_event=json_lines_handler(events) if events is not None else None,
+                   move_budget=None if args.move_budget_ms is None else args.move_budget_ms / 1000,
+                   memory_mb=args.memory_mb, cpu_seconds=args.cpu_seconds, scheduler=args.scheduler,
+                   swiss_rounds=args.swiss_rounds, adaptive=args.adaptive, resume=args.resume,
+                   profile=args.profile)
\ No newline at end of file
@@ -0,0 +1,200 @@
+import argparse
+import concurrent.futures
+import hashlib
+import importlib
+import json
+import os
+import sys
+import time
+
+import latency
+import results_cache
+import tournament
+
+# A tournament plan pins down everything a node needs to play its part of a
+# round-robin without talking to the others: the agents and their code
+# hashes, every ordered pairing with its match count and a seed derived from
+# the tournament seed. Shard K of M plays series K, K+M, K+2M, ... of the
+# plan; merging all M shards gives the same totals as playing the plan as a
+# single shard, since series are seeded individually and totals are summed
+# in plan order.
+PLAN_VERSION = 1
+
+def series_seed(seed, agent1, agent2):
+    digest = hashlib.sha256(f"{seed}:{agent1}:{agent2}".encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'little')
+
+def make_plan(num_matches=100, seed=0, move_budget=None, directory='.'):
+    agents = []
+    for agent_file in tournament.find_agent_files(directory):
+        module_name = agent_file[:-3]
+        importlib.import_module(module_name).Agent  # an agent that doesn't load fails the plan, not a shard
+        agents.append({
+            'name': module_name,
+            'hash': results_cache.hash_agent_file(os.path.join(directory, agent_file)),
+        })
+    series = [
+        {
+            'agent1': agent1['name'],
+            'agent2': agent2['name'],
+            'num_matches': num_matches,
+            'seed': series_seed(seed, agent1['name'], agent2['name']),
+        }
+        for agent1 in agents for agent2 in agents if agent1 is not agent2
+    ]
+    return {
+        'version': PLAN_VERSION,
+        'seed': seed,
+        'num_matches': num_matches,
+        'move_budget': move_budget,
+        'agents': agents,
+        'series': series,
+    }
+
+def plan_hash(plan):
+    return hashlib.sha256(json.dumps(plan, sort_keys=True).encode('utf-8')).hexdigest()
+
+def load_json(path):
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def save_json(data, path):
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(temp_path, path)
+
+def shard_series(plan, shard, num_shards):
+    if not 0 <= shard < num_shards:
+        raise ValueError(f"Shard {shard} is out of range for {num_shards} shards")
+    return [(index, series) for index, series in enumerate(plan['series']) if index % num_shards == shard]
+
+# Refuses to play if any local agent file differs from the plan, since the
+# shard's results would silently mix two versions of an agent.
+def check_agents(plan, directory='.'):
+    mismatched = []
+    for agent in plan['agents']:
+        path = os.path.join(directory, f"{agent['name']}.py")
+        if not os.path.exists(path) or results_cache.hash_agent_file(path) != agent['hash']:
+            mismatched.append(agent['name'])
+    if mismatched:
+        raise ValueError(f"Agent files differ from the plan: {', '.join(mismatched)}")
+
+# Series always run on a process pool: a seed only makes a series
+# reproducible if no other series shares its RNGs.
+def run_shard(plan, shard=0, num_shards=1, max_workers=None):
+    check_agents(plan)
+    started = time.perf_counter()
+    assigned = shard_series(plan, shard, num_shards)
+    results = []
+    errors = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers or os.cpu_count(),
+                                                initializer=tournament.set_log_level,
+                                                initargs=(tournament.LOG_RESULTS,)) as pool:
+        future_to_series = {
+            pool.submit(tournament.run_match_series_by_name, series['agent1'], series['agent2'],
+                        series['num_matches'], plan['move_budget'], None, series['seed']): (index, series)
+            for index, series in assigned
+        }
+        for future in concurrent.futures.as_completed(future_to_series):
+            index, series = future_to_series[future]
+            try:
+                score1, score2, _, seconds, (timings1, timings2), _ = future.result()
+            except Exception as exc:
+                errors.append({'index': index, 'agent1': series['agent1'], 'agent2': series['agent2'],
+                               'type': type(exc).__name__, 'message': str(exc)})
+                continue
+            results.append({
+                'index': index,
+                'agent1': series['agent1'],
+                'agent2': series['agent2'],
+                'score1': score1,
+                'score2': score2,
+                'seconds': seconds,
+                'timings': [timings1.to_dict(), timings2.to_dict()],
+            })
+    results.sort(key=lambda series: series['index'])
+    return {
+        'plan_hash': plan_hash(plan),
+        'shard': shard,
+        'num_shards': num_shards,
+        'series': results,
+        'errors': errors,
+        'seconds': time.perf_counter() - started,
+    }
+
+def merge_shards(plan, shards):
+    expected_hash = plan_hash(plan)
+    by_index = {}
+    errors = []
+    for shard in shards:
+        if shard['plan_hash'] != expected_hash:
+            raise ValueError(f"Shard {shard['shard']} was played from a different plan")
+        for series in shard['series']:
+            by_index[series['index']] = series
+        errors.extend(shard['errors'])
+    failed = {error['index'] for error in errors}
+    missing = [index for index in range(len(plan['series'])) if index not in by_index and index not in failed]
+    if missing:
+        raise ValueError(f"{len(missing)} series of the plan are in none of the shards")
+
+    result = tournament.TournamentResult(num_matches=plan['num_matches'])
+    result.totals.update({agent['name']: 0 for agent in plan['agents']})
+    for index in sorted(by_index):
+        series = by_index[index]
+        timings1, timings2 = (latency.AgentTimings.from_dict(side) for side in series['timings'])
+        result.totals[series['agent1']] += series['score1']
+        result.totals[series['agent2']] += series['score2']
+        result.add_timings(series['agent1'], timings1)
+        result.add_timings(series['agent2'], timings2)
+        result.series.append(tournament.SeriesResult(series['agent1'], series['agent2'], series['score1'],
+                                                     series['score2'], series['seconds'], False,
+                                                     timings1.summary(), timings2.summary()))
+    for error in sorted(errors, key=lambda error: error['index']):
+        result.errors.append(tournament.SeriesError(error['agent1'], error['agent2'], error['type'], error['message']))
+    result.seconds = max((shard['seconds'] for shard in shards), default=0.0)
+    return result
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Plan a tournament, play it in shards on any number of nodes and merge the results.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    create_parser = subparsers.add_parser('create', help="write a plan for the *_agent.py files in this directory")
+    create_parser.add_argument('--matches', type=int, default=100, help="matches per series")
+    create_parser.add_argument('--seed', type=int, default=0, help="tournament seed every series seed is derived from")
+    create_parser.add_argument('--move-budget-ms', type=float, default=None)
+    create_parser.add_argument('--out', default='tournament_plan.json')
+
+    run_parser = subparsers.add_parser('run', help="play shard K of M of a plan and write a result shard")
+    run_parser.add_argument('plan')
+    run_parser.add_argument('--shard', type=int, default=0, help="0-based shard number K")
+    run_parser.add_argument('--of', type=int, default=1, dest='num_shards', help="number of shards M")
+    run_parser.add_argument('--workers', type=int, default=None, help="process pool size (default: os.cpu_count())")
+    run_parser.add_argument('--out', default=None, help="default: tournament_shard_K_of_M.json")
+
+    merge_parser = subparsers.add_parser('merge', help="combine result shards into tournament totals")
+    merge_parser.add_argument('plan')
+    merge_parser.add_argument('shards', nargs='+')
+    merge_parser.add_argument('--out', default=None, help="also write the merged results as JSON")
+
+    args = parser.parse_args(argv)
+    if args.command == 'create':
+        plan = make_plan(args.matches, args.seed,
+                         None if args.move_budget_ms is None else args.move_budget_ms / 1000)
+        save_json(plan, args.out)
+        print(f"Planned {len(plan['series'])} series between {len(plan['agents'])} agents: {args.out}")
+    elif args.command == 'run':
+        shard = run_shard(load_json(args.plan), args.shard, args.num_shards, args.workers)
+        out = args.out or f"tournament_shard_{args.shard}_of_{args.num_shards}.json"
+        save_json(shard, out)
+        print(f"Played {len(shard['series'])} series ({len(shard['errors'])} errors) in {shard['seconds']:.2f}s: {out}")
+    elif args.command == 'merge':
+        result = merge_shards(load_json(args.plan), [load_json(path) for path in args.shards])
+        if args.out:
+            save_json(result.to_dict(), args.out)
+        for agent_name, score in result.standings():
+            print(f"{agent_name}: {score} points")
+
+if __name__ == '__main__':
+    sys.path.insert(0, os.getcwd())
+    main()
@@ -1,78 +1,62 @@
 import importlib
 import os
+import time
 
-MOVES = ['shield', 'load', 'fireball', 'tsunami', 'mirror']
+import rules
+from rules import MOVES
 
+# One match against an agent, from the user's side. __slots__ keep it small,
+# since the web app holds one per player (game_sessions.py). The match keeps
+# the user's last move itself: the agent has to be shown its opponent's
+# previous move, never its own.
 class Match:
-    def __init__(self, agent):
+    __slots__ = ('agent', 'user_loads', 'agent_loads', 'user_mirror', 'agent_mirror', 'last_user_move',
+                 'rounds_played', 'move_budget_ns')
+
+    def __init__(self, agent, move_budget=None):
         self.agent = agent
+        # Seconds of CPU time the agent's play() may take before it forfeits
+        # the round, as in a tournament: the web app serves many games from
+        # one process, so wall time would charge it for the other requests.
+        self.move_budget_ns = None if move_budget is None else int(move_budget * 1e9)
+        self.reset()
+
+    def reset(self):
         self.user_loads = 0
         self.agent_loads = 0
         self.user_mirror = True
         self.agent_mirror = True
-        self.match_log = []
+        self.last_user_move = None
+        self.rounds_played = 0
 
     def validate_move(self, move, loads, mirror_status):
-        if move == 'fireball' and loads < 1:
-            return 'load'
-        if move == 'tsunami' and loads < 2:
-            return 'load'
-        if move == 'mirror' and not mirror_status:
-            return 'load'
-        if move not in MOVES:
-            return 'load'
-        return move
+        return rules.validate_move(move, loads, mirror_status)
 
     def determine_winner(self, move1, move2):
-        if move1 == move2:
-            return None  # Draw
-        if move1 == 'fireball':
-            if move2 in ['load']:
-                return 0
-            elif move2 in ['mirror']:
-                return 1
-        if move1 == 'tsunami':
-            if move2 in ['load', 'shield']:
-                return 0
-            elif move2 in ['mirror']:
-                return 1
-        if move1 == 'mirror':
-            if move2 in ['fireball', 'tsunami']:
-                return 0
-        if (move2 == 'fireball' or move2 == 'tsunami') and move1 in 'load':
-            return 1
-        if (move1 == 'shield') and move2 == 'tsunami':
-            return 1
-        return None  # Draw
-
-    def run_round(self, user_move, last_agent_move):
-        agent_move = self.agent.play(last_agent_move)
-
-        user_move = self.validate_move(user_move, self.user_loads, self.user_mirror)
-        agent_move = self.validate_move(agent_move, self.agent_loads, self.agent_mirror)
-        
-        round_result = f"User vs {self.agent.__class__.__name__}: {user_move} vs {agent_move}"
-        self.match_log.append(round_result)
-        print(round_result)
-
-        if user_move == 'load':
-            self.user_loads += 1
-        if agent_move == 'load':
-            self.agent_loads += 1
-        if user_move == 'fireball':
-            self.user_loads -= 1
-        if agent_move == 'fireball':
-            self.agent_loads -= 1
-        if user_move == 'tsunami':
-            self.user_loads -= 2
-        if agent_move == 'tsunami':
-            self.agent_loads -= 2
-        if user_move == 'mirror':
+        return rules.determine_winner(move1, move2)
+
+    def run_round(self, user_move):
+        start = time.thread_time_ns()
+        agent_move = self.agent.play(self.last_user_move)
+        elapsed = time.thread_time_ns() - start
+
+        user_code = rules.legal_move(user_move, self.user_loads, self.user_mirror)
+        agent_code = rules.legal_move(agent_move, self.agent_loads, self.agent_mirror)
+        user_move = MOVES[user_code]
+        agent_move = MOVES[agent_code]
+
+        self.user_loads += rules.LOAD_DELTA[user_code]
+        self.agent_loads += rules.LOAD_DELTA[agent_code]
+        if user_code == rules.MIRROR:
             self.user_mirror = False
-        if agent_move == 'mirror':
+        if agent_code == rules.MIRROR:
             self.agent_mirror = False
+        self.last_user_move = user_move
+        self.rounds_played += 1
 
-        winner = self.determine_winner(user_move, agent_move)
+        winner = rules.OUTCOME[user_code][agent_code]
+        if self.move_budget_ns is not None and elapsed > self.move_budget_ns:
+            winner = 0
 
         return winner, user_move, agent_move
 
@@ -104,8 +88,6 @@ def main():
 
     match = Match(chosen_agent)
     user_score, agent_score = 0, 0
-    last_user_move = None
-    last_agent_move = None
 
     print("\nLet the tournament begin!")
     print("Valid moves are: shield, load, fireball, tsunami, mirror")
@@ -122,7 +104,8 @@ def main():
                 break
             print("Invalid move. Please try again.")
 
-        winner, last_user_move, last_agent_move = match.run_round(user_move, last_user_move)
+        winner, user_move, agent_move = match.run_round(user_move)
+        print(f"User vs {chosen_agent.__class__.__name__}: {user_move} vs {agent_move}")
 
         if winner == 0:
             user_score += 1
@@ -1,10 +1,37 @@
+import argparse
 import re
 import os
-from PIL import Image, ImageDraw, ImageFont
+import functools
+import hashlib
+import importlib.util
+import tempfile
+import threading
+from PIL import Image, ImageChops, ImageDraw, ImageFont, GifImagePlugin
 import imageio
 
+import batch_engine
+import match_archive
+import rules
+
 MOVES = ['shield', 'load', 'fireball', 'tsunami', 'mirror']
 
+FRAME_SIZE = (1000, 600)
+SPRITE_SIZE = (300, 300)
+FRAME_DURATION_MS = 1000
+FONT_SIZE = 24
+LEFT_PANEL_X = 50
+RIGHT_PANEL_X = 700
+LEFT_SPRITE = (50, 250)
+RIGHT_SPRITE = (650, 250)
+
+FORMATS = ('gif', 'mp4')
+REPLAY_CACHE_DIR = 'replay_cache'
+REPLAY_CACHE_MAX_BYTES = 256 * 1024 * 1024
+# Bump when frames change so replays cached by an older renderer aren't served.
+RENDER_VERSION = 2
+
+# Fonts are looked up once per size instead of once per frame.
+@functools.lru_cache(maxsize=None)
 def load_font(size=20):
     try:
         return ImageFont.truetype("/Library/Fonts/Arial.ttf", size)
@@ -24,87 +51,268 @@ def load_move_images(static_folder):
             print(f"Warning: Image for {move} not found at {image_path}")
     return move_images
 
-def create_frame(agent1, agent2, move1, move2, loads1, loads2, mirror1, mirror2, move_images):
-    # Create a larger blank image
-    img = Image.new('RGB', (1000, 600), color='white')
-    draw = ImageDraw.Draw(img)
-    font = load_font(24)  # Increased font size
-    
-    # Draw agent1 info
-    draw.text((50, 50), f"Agent: {agent1}", fill="black", font=font)
-    draw.text((50, 90), f"Loads: {loads1}", fill="black", font=font)
-    draw.text((50, 130), f"Move: {move1}", fill="black", font=font)
-    draw.text((50, 170), f"Mirror: {'Yes' if mirror1 else 'No'}", fill="black", font=font)
-    
-    # Draw agent2 info
-    draw.text((700, 50), f"Agent: {agent2}", fill="black", font=font)
-    draw.text((700, 90), f"Loads: {loads2}", fill="black", font=font)
-    draw.text((700, 130), f"Move: {move2}", fill="black", font=font)
-    draw.text((700, 170), f"Mirror: {'Yes' if mirror2 else 'No'}", fill="black", font=font)
-    
-    # Draw move images
-    def paste_move_image(move, x, y, flip=False):
-        if move in move_images:
-            move_img = move_images[move].copy()
-            move_img.thumbnail((300, 300))  # Increased size
-            if flip:
-                move_img = move_img.transpose(Image.FLIP_LEFT_RIGHT)
-            img.paste(move_img, (x, y), move_img)
+# MP4 goes through imageio's ffmpeg plugin, which is an optional extra
+# (pip install imageio-ffmpeg); GIF only needs Pillow.
+def mp4_available():
+    return importlib.util.find_spec('imageio_ffmpeg') is not None
+
+# Everything that is the same in every frame is prepared once: sprites are
+# scaled, and flipped for agent2's side, when the renderer is created, the
+# font comes from load_font's cache, and each replay draws its agent names
+# onto one background that every frame starts from. Frames are produced one
+# at a time and handed straight to the encoder, so a replay never holds more
+# than the frame being drawn.
+class ReplayRenderer:
+    def __init__(self, static_folder='static'):
+        self.font = load_font(FONT_SIZE)
+        self.sprites = {}
+        for move, image in load_move_images(static_folder).items():
+            image.thumbnail(SPRITE_SIZE)
+            self.sprites[move] = (image, image.transpose(Image.FLIP_LEFT_RIGHT))
+        self.blank = Image.new('RGB', FRAME_SIZE, color='white')
+        self.palette = self._make_palette()
+
+    # One palette shared by every frame, so GIF frames can be written as they
+    # are drawn instead of being collected to build a palette at the end.
+    # It is fitted to the sprites plus a grey ramp for the anti-aliased text.
+    def _make_palette(self):
+        width = SPRITE_SIZE[0] * max(len(self.sprites), 1)
+        swatch = Image.new('RGB', (width, SPRITE_SIZE[1] + 16), color='white')
+        for i, (sprite, _) in enumerate(self.sprites.values()):
+            swatch.paste(sprite, (i * SPRITE_SIZE[0], 0), sprite)
+        ramp = ImageDraw.Draw(swatch)
+        for x in range(width):
+            grey = 255 * x // max(width - 1, 1)
+            ramp.line([(x, SPRITE_SIZE[1]), (x, SPRITE_SIZE[1] + 15)], fill=(grey, grey, grey))
+        return swatch.quantize(colors=256, method=Image.Quantize.MEDIANCUT)
+
+    def background(self, agent1, agent2):
+        img = self.blank.copy()
+        draw = ImageDraw.Draw(img)
+        draw.text((LEFT_PANEL_X, 50), f"Agent: {agent1}", fill="black", font=self.font)
+        draw.text((RIGHT_PANEL_X, 50), f"Agent: {agent2}", fill="black", font=self.font)
+        return img
+
+    def frame(self, background, move1, move2, loads1, loads2, mirror1, mirror2):
+        img = background.copy()
+        draw = ImageDraw.Draw(img)
+        for x, move, loads, mirror in ((LEFT_PANEL_X, move1, loads1, mirror1),
+                                       (RIGHT_PANEL_X, move2, loads2, mirror2)):
+            draw.text((x, 90), f"Loads: {loads}", fill="black", font=self.font)
+            draw.text((x, 130), f"Move: {move}", fill="black", font=self.font)
+            draw.text((x, 170), f"Mirror: {'Ready' if mirror else 'Used'}", fill="black", font=self.font)
+
+        for (x, y), move, flip in ((LEFT_SPRITE, move1, False), (RIGHT_SPRITE, move2, True)):
+            if move in self.sprites:
+                sprite = self.sprites[move][flip]
+                img.paste(sprite, (x, y), sprite)
+            else:
+                draw.rectangle([x, y, x + SPRITE_SIZE[0], y + SPRITE_SIZE[1]], outline="black", width=2)
+                draw.text((x + 100, y + 140), move, fill="black", font=self.font)
+        return img
+
+    # Frames for match `row` of a batch_engine.replay_states batch, each
+    # showing the moves of a round and both agents' loads and mirror after it.
+    def frames(self, agents, states, row=0):
+        background = self.background(*agents)
+        length = int(states.rounds_played[row])
+        columns = (states.codes1, states.codes2, states.loads1, states.loads2, states.mirror1, states.mirror2)
+        for code1, code2, loads1, loads2, mirror1, mirror2 in zip(*(column[row, :length].tolist() for column in columns)):
+            yield self.frame(background, MOVES[code1], MOVES[code2], loads1, loads2, mirror1, mirror2)
+
+    # Writes the GIF header with the first frame and then each frame as soon
+    # as it is drawn, using Pillow's frame-level GIF encoder. After the first,
+    # a frame only carries the box that changed since the one before it.
+    def write_gif(self, frames, fp):
+        previous = None
+        for frame in frames:
+            if previous is None:
+                box = (0, 0) + frame.size
+            else:
+                # Equal colours quantize to equal palette indexes, so the
+                # changed box can be taken before quantizing.
+                box = ImageChops.difference(frame, previous).getbbox() or (0, 0, 1, 1)
+            image = frame.crop(box).quantize(palette=self.palette, dither=Image.Dither.NONE)
+            if previous is None:
+                header, _ = GifImagePlugin.getheader(image, info={'loop': 0})
+                fp.write(b''.join(header))
+            fp.write(b''.join(GifImagePlugin.getdata(image, box[:2], duration=FRAME_DURATION_MS)))
+            previous = frame
+        if previous is None:
+            raise ValueError("A replay needs at least one round")
+        fp.write(b';')
+
+    def write_mp4(self, frames, path):
+        if not mp4_available():
+            raise RuntimeError("MP4 replays need imageio-ffmpeg (pip install imageio-ffmpeg)")
+        import numpy as np
+        # 1000x600 isn't a multiple of ffmpeg's default 16 pixel blocks.
+        with imageio.get_writer(path, format='FFMPEG', fps=1000 / FRAME_DURATION_MS, macro_block_size=8) as writer:
+            for frame in frames:
+                writer.append_data(np.asarray(frame))
+
+    def render(self, agents, states, path, fmt='gif', row=0):
+        if fmt == 'gif':
+            with open(path, 'wb') as f:
+                self.write_gif(self.frames(agents, states, row), f)
+        elif fmt == 'mp4':
+            self.write_mp4(self.frames(agents, states, row), path)
         else:
-            draw.rectangle([x, y, x+300, y+300], outline="black", width=2)
-            draw.text((x+100, y+140), move, fill="black", font=font)
-    
-    paste_move_image(move1, 50, 250)
-    paste_move_image(move2, 650, 250, flip=True)
-    
-    return img
+            raise ValueError(f"Unknown replay format '{fmt}', expected one of: {', '.join(FORMATS)}")
+
+# Rendered replays on disk, least recently used first out. Entries are keyed
+# by the match's content rather than its place in the archive, so a replay
+# stays valid across tournaments for as long as the same moves come out of
+# the same pairing, and a rerun that changes the match simply misses. A hit
+# touches the file's mtime, which is what eviction orders by.
+class ReplayCache:
+    def __init__(self, directory=REPLAY_CACHE_DIR, max_bytes=REPLAY_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(record, fmt):
+        digest = hashlib.sha256()
+        digest.update(f"{RENDER_VERSION}:{fmt}:{record.agent1}:{record.agent2}:"
+                      f"{record.class1}:{record.class2}:".encode('utf-8'))
+        digest.update(record.moves)
+        return digest.hexdigest()
+
+    def path(self, key, fmt):
+        return os.path.join(self.directory, f"{key}.{fmt}")
+
+    def get(self, key, fmt):
+        path = self.path(key, fmt)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    # Renders into a temporary file and renames it into place, so a replay
+    # being requested while it renders is never served half-written.
+    def put(self, key, fmt, render):
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=f".{fmt}.tmp")
+        os.close(fd)
+        try:
+            render(temp_path)
+            path = self.path(key, fmt)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        self.evict()
+        return path
+
+    def evict(self):
+        with self._lock:
+            entries = []
+            for entry in os.scandir(self.directory):
+                if entry.is_file() and not entry.name.endswith('.tmp'):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+_renderer = None
+_renderer_lock = threading.Lock()
+
+def get_renderer(static_folder='static'):
+    global _renderer
+    with _renderer_lock:
+        if _renderer is None:
+            _renderer = ReplayRenderer(static_folder)
+        return _renderer
+
+def _check_format(fmt):
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown replay format '{fmt}', expected one of: {', '.join(FORMATS)}")
+
+# Renders the records that aren't cached yet, replaying all of their states
+# in one batch, and returns the cached path of every record in order.
+def render_records(records, fmt='gif', cache=None):
+    _check_format(fmt)
+    cache = cache or ReplayCache()
+    keys = [cache.key(record, fmt) for record in records]
+    paths = [cache.get(key, fmt) for key in keys]
+    missing = [i for i, path in enumerate(paths) if path is None]
+    if missing:
+        states = batch_engine.replay_states([records[i].moves for i in missing])
+        renderer = get_renderer()
+        for row, i in enumerate(missing):
+            agents = (records[i].agent1, records[i].agent2)
+            paths[i] = cache.put(keys[i], fmt, lambda temp_path: renderer.render(agents, states, temp_path, fmt, row))
+    return paths
+
+# Path to a rendered replay of one archived match, rendering it on a cache
+# miss. Raises KeyError/IndexError for a pairing or match not in the archive.
+def render_archived_match(agent1, agent2, match_num, fmt='gif', cache=None, archive_path=match_archive.DEFAULT_ARCHIVE):
+    _check_format(fmt)
+    with match_archive.MatchArchive(archive_path) as archive:
+        record = archive.read_match(agent1, agent2, match_num)
+    return render_records([record], fmt, cache)[0]
+
+# Replays of every match (or the given match numbers) of one pairing.
+def render_pairing(agent1, agent2, fmt='gif', cache=None, match_nums=None, archive_path=match_archive.DEFAULT_ARCHIVE):
+    _check_format(fmt)
+    with match_archive.MatchArchive(archive_path) as archive:
+        match_nums = match_nums or range(1, archive.num_matches(agent1, agent2) + 1)
+        records = [archive.read_match(agent1, agent2, match_num) for match_num in match_nums]
+    return render_records(records, fmt, cache)
 
 def parse_game_file(filename):
     with open(filename, 'r') as file:
         content = file.read()
-    
+
     agents = re.findall(r'(\w+) vs (\w+)', content)
     if not agents:
         raise ValueError(f"Could not find agent names in {filename}")
     agents = agents[0]
-    
-    moves = re.findall(r'Agent vs Agent: (\w+) vs (\w+)', content)
+
+    # Round lines are "<class1> vs <class2>: <move1> vs <move2>".
+    moves = re.findall(r'^\w+ vs \w+: (\w+) vs (\w+)$', content, re.MULTILINE)
     if not moves:
         raise ValueError(f"Could not find moves in {filename}")
-    
+
     return agents, moves
 
-def create_gif(agents, moves, move_images, output_filename):
-    frames = []
-    loads1, loads2 = 0, 0
-    mirror1, mirror2 = False, False
-    
-    for move1, move2 in moves:
-        if move1 == 'load':
-            loads1 += 1
-        if move2 == 'load':
-            loads2 += 1
-        mirror1 = move1 == 'mirror'
-        mirror2 = move2 == 'mirror'
-        
-        frame = create_frame(agents[0], agents[1], move1, move2, loads1, loads2, mirror1, mirror2, move_images)
-        frames.append(frame)
-    
-    # Save as GIF
-    frames[0].save(output_filename, save_all=True, append_images=frames[1:], duration=1000, loop=0)
+def create_gif(agents, moves, output_filename, renderer=None):
+    rounds = bytes(match_archive.pack_round(rules.MOVE_CODES[move1], rules.MOVE_CODES[move2]) for move1, move2 in moves)
+    (renderer or get_renderer()).render(agents, batch_engine.replay_states([rounds]), output_filename, 'gif')
 
 def main():
-    game_file = 'match_results/dj_agent_vs_sample_agent/match_3.txt'
-    static_folder = 'static'
-    output_filename = 'dj_agent_vs_sample_agent_match3_game_visualization.gif'
+    parser = argparse.ArgumentParser(description="Render archived matches as animated replays.")
+    parser.add_argument('--archive', default=match_archive.DEFAULT_ARCHIVE)
+    parser.add_argument('--pair', nargs=2, metavar=('AGENT1', 'AGENT2'), default=['dj_agent', 'sample_agent'])
+    parser.add_argument('--match', type=int, nargs='+', default=None,
+                        help="match numbers (1-based); every match of the pair when left out")
+    parser.add_argument('--format', choices=FORMATS, default='gif')
+    parser.add_argument('--out', default='.', help="folder for <agent1>_vs_<agent2>_match<N>_game_visualization.<format>")
+    args = parser.parse_args()
+    agent1, agent2 = args.pair
 
     try:
-        agents, moves = parse_game_file(game_file)
-        move_images = load_move_images(static_folder)
-        create_gif(agents, moves, move_images, output_filename)
-        print(f"GIF created successfully: {output_filename}")
+        with match_archive.MatchArchive(args.archive) as archive:
+            match_nums = args.match or range(1, archive.num_matches(agent1, agent2) + 1)
+            records = [archive.read_match(agent1, agent2, match_num) for match_num in match_nums]
+        states = batch_engine.replay_states([record.moves for record in records])
+        renderer = get_renderer()
+        os.makedirs(args.out, exist_ok=True)
+        for row, match_num in enumerate(match_nums):
+            output_filename = os.path.join(args.out, f"{agent1}_vs_{agent2}_match{match_num}_game_visualization.{args.format}")
+            renderer.render((agent1, agent2), states, output_filename, args.format, row)
+        print(f"Created {len(records)} replays in {args.out}")
     except Exception as e:
         print(f"An error occurred: {e}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()